@@ -16,8 +16,12 @@ from builtins import range
 
 import os
 import os.path as op
+import tempfile
 
 import nibabel as nb
+from nibabel.arrayproxy import ArrayProxy
+from nibabel.openers import ImageOpener
+from nibabel.volumeutils import apply_read_scaling, array_to_file
 import numpy as np
 from numpy.polynomial import Legendre
 from scipy import linalg
@@ -28,7 +32,8 @@ from ..interfaces.base import (traits, TraitedSpec, BaseInterface,
                                BaseInterfaceInputSpec, File, isdefined,
                                InputMultiPath)
 from ..utils import NUMPY_MMAP
-from ..utils.misc import normalize_mc_params
+from ..utils.misc import (normalize_mc_params, open_nifti, iter_blocks,
+                          write_batch_table)
 
 IFLOG = logging.getLogger('interface')
 
@@ -264,13 +269,9 @@ Bradley L. and Petersen, Steven E.},
     }]
 
     def _run_interface(self, runtime):
-        mpars = np.loadtxt(self.inputs.in_file)  # mpars is N_t x 6
-        mpars = np.apply_along_axis(func1d=normalize_mc_params,
-                                    axis=1, arr=mpars,
-                                    source=self.inputs.parameter_source)
-        diff = mpars[:-1, :6] - mpars[1:, :6]
-        diff[:, 3:6] *= self.inputs.radius
-        fd_res = np.abs(diff).sum(axis=1)
+        mpars = _load_motion_params(self.inputs.in_file)  # N_t x 6
+        fd_res = compute_fd(mpars, self.inputs.parameter_source,
+                            self.inputs.radius)
 
         self._results = {
             'out_file': op.abspath(self.inputs.out_file),
@@ -299,6 +300,77 @@ Bradley L. and Petersen, Steven E.},
     def _list_outputs(self):
         return self._results
 
+
+class BatchFramewiseDisplacementInputSpec(BaseInterfaceInputSpec):
+    in_files = InputMultiPath(File(exists=True), mandatory=True,
+                              desc='motion parameters, one file per run')
+    parameter_source = traits.Enum("FSL", "AFNI", "SPM", "FSFAST",
+                                   desc="Source of movement parameters",
+                                   mandatory=True)
+    radius = traits.Float(50, usedefault=True,
+                          desc='radius in mm to calculate angular FDs, 50mm is the '
+                               'default since it is used in Power et al. 2012')
+    run_ids = traits.List(traits.Str(),
+                          desc='identifiers of the runs written in the first '
+                               'column (default: their position)')
+    out_file = File('fd_power_2012.csv', usedefault=True,
+                    desc='table with one row per run and volume')
+
+
+class BatchFramewiseDisplacementOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc='table with one row per run and volume')
+    fd_average = traits.List(traits.Float(), desc='average FD of each run')
+
+
+class BatchFramewiseDisplacement(BaseInterface):
+    """
+    Calculate the :abbr:`FD (framewise displacement)` of many runs, as
+    :py:class:`FramewiseDisplacement` does for one, and write them to a
+    single table.
+
+    The table has the columns ``run, volume, framewise_displacement``, with
+    one row for each volume but the first of every run: the FD of volume
+    ``t`` is its displacement from volume ``t - 1``.
+
+    Example
+    -------
+
+    >>> fd = BatchFramewiseDisplacement()
+    >>> fd.inputs.in_files = ['fsl_mcflirt_movpar.txt'] * 2
+    >>> fd.inputs.parameter_source = 'FSL'
+    >>> fd.inputs.run_ids = ['run-1', 'run-2']
+    >>> res = fd.run() # doctest: +SKIP
+
+    """
+    input_spec = BatchFramewiseDisplacementInputSpec
+    output_spec = BatchFramewiseDisplacementOutputSpec
+
+    def _run_interface(self, runtime):
+        self._fd_average = []
+        write_batch_table(
+            self.inputs.out_file, ['run', 'volume', 'framewise_displacement'],
+            self.inputs.in_files, self._run_rows, ['%d', '%.10g'],
+            ids=(self.inputs.run_ids if isdefined(self.inputs.run_ids)
+                 else None))
+        return runtime
+
+    def _run_rows(self, in_file):
+        mpars = _load_motion_params(in_file)
+        if len(mpars) < 2:
+            raise ValueError('FD needs at least two volumes, but %s has %d' % (
+                in_file, len(mpars)))
+        fd_res = compute_fd(mpars, self.inputs.parameter_source,
+                            self.inputs.radius)
+        self._fd_average.append(float(fd_res.mean()))
+        return zip(range(1, len(fd_res) + 1), fd_res)
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['out_file'] = op.abspath(self.inputs.out_file)
+        outputs['fd_average'] = self._fd_average
+        return outputs
+
+
 class CompCorInputSpec(BaseInterfaceInputSpec):
     realigned_file = File(exists=True, mandatory=True,
                           desc='already realigned brain image (4D)')
@@ -314,6 +386,16 @@ class CompCorInputSpec(BaseInterfaceInputSpec):
                                        desc='the degree polynomial to use')
     header = traits.Str(desc='the desired header for the output tsv file (one column).'
                         'If undefined, will default to "CompCor"')
+    svd_method = traits.Enum('auto', 'svd', 'gram', usedefault=True,
+                             desc='how to find the components: "svd" decomposes '
+                             'the whole voxel-by-time matrix, "gram" streams the '
+                             'data by slabs into its time-by-time Gram matrix. '
+                             '"auto" uses "gram" when the matrix would take more '
+                             'than 256 MiB')
+    positive_loadings = traits.Bool(False, usedefault=True,
+                                    desc='flip the sign of each component so '
+                                    'that its largest loading is positive, so '
+                                    'that "svd" and "gram" give the same signs')
 
 class CompCorOutputSpec(TraitedSpec):
     components_file = File(exists=True,
@@ -332,6 +414,13 @@ class CompCor(BaseInterface):
     >>> ccinterface.inputs.num_components = 1
     >>> ccinterface.inputs.use_regress_poly = True
     >>> ccinterface.inputs.regress_poly_degree = 2
+
+    Only the leading components are kept, so for large noise ROIs they are
+    found as the leading eigenvectors of :math:`MM^T`, which is accumulated
+    over a few voxels at a time. Memory then grows with the number of
+    volumes rather than with the number of voxels. The sign of a component
+    is arbitrary and may differ between the two methods, unless
+    ``positive_loadings`` makes the largest loading of each one positive.
     '''
     input_spec = CompCorInputSpec
     output_spec = CompCorOutputSpec
@@ -350,16 +439,37 @@ class CompCor(BaseInterface):
                    }]
 
     def _run_interface(self, runtime):
-        imgseries = nb.load(self.inputs.realigned_file, mmap=NUMPY_MMAP).get_data()
+        img = nb.load(self.inputs.realigned_file, mmap=NUMPY_MMAP)
         mask = nb.load(self.inputs.mask_file, mmap=NUMPY_MMAP).get_data()
 
-        if imgseries.shape[:3] != mask.shape:
+        if img.shape[:3] != mask.shape:
             raise ValueError('Inputs for CompCor, func {} and mask {}, do not have matching '
                              'spatial dimensions ({} and {}, respectively)'
                              .format(self.inputs.realigned_file, self.inputs.mask_file,
-                                     imgseries.shape[:3], mask.shape))
+                                     img.shape[:3], mask.shape))
+
+        shape = (np.count_nonzero(mask > 0), img.shape[3])
+        svd_method = self.inputs.svd_method
+        if svd_method == 'auto':
+            nbytes = 8 * shape[0] * shape[1]
+            svd_method = 'gram' if nbytes > _COMPCOR_SVD_BYTES else 'svd'
 
-        voxel_timecourses = imgseries[mask > 0]
+        if svd_method == 'svd':
+            u = self._svd_components(_masked_timecourses(
+                self.inputs.realigned_file, mask > 0, np.empty(shape)))
+        else:
+            u = self._gram_components(mask > 0, shape)
+        components = u[:, :self.inputs.num_components]
+        if self.inputs.positive_loadings:
+            components = _positive_max_loading(components)
+        components_file = os.path.join(os.getcwd(), self.inputs.components_file)
+
+        self._set_header()
+        np.savetxt(components_file, components, fmt=b"%.10f", delimiter='\t',
+                   header=self._make_headers(components.shape[1]), comments='')
+        return runtime
+
+    def _normalized_timecourses(self, voxel_timecourses):
         # Zero-out any bad values
         voxel_timecourses[np.isnan(np.sum(voxel_timecourses, axis=1)), :] = 0
 
@@ -375,18 +485,40 @@ class CompCor(BaseInterface):
         M = voxel_timecourses.T
 
         # "[... were removed] prior to column-wise variance normalization."
-        M = M / self._compute_tSTD(M, 1.)
+        return M / self._compute_tSTD(M, 1.)
+
+    def _svd_components(self, voxel_timecourses):
+        M = self._normalized_timecourses(voxel_timecourses)
 
         # "The covariance matrix C = MMT was constructed and decomposed into its
         # principal components using a singular value decomposition."
         u, _, _ = linalg.svd(M, full_matrices=False)
-        components = u[:, :self.inputs.num_components]
-        components_file = os.path.join(os.getcwd(), self.inputs.components_file)
-
-        self._set_header()
-        np.savetxt(components_file, components, fmt=b"%.10f", delimiter='\t',
-                   header=self._make_headers(components.shape[1]), comments='')
-        return runtime
+        return u
+
+    def _gram_components(self, mask, shape):
+        # The left singular vectors of M are the eigenvectors of C = MM^T,
+        # which is summed over slabs of voxels. Normalizing a voxel takes its
+        # whole time course, so the masked time courses are first gathered
+        # in a scratch file, which reads the image (and decompresses it)
+        # only once.
+        C = np.zeros((shape[1], shape[1]))
+        if shape[0]:
+            fd, scratch = tempfile.mkstemp(suffix='.dat', dir=os.getcwd())
+            os.close(fd)
+            try:
+                timecourses = _masked_timecourses(
+                    self.inputs.realigned_file, mask,
+                    np.memmap(scratch, dtype=np.float64, mode='w+',
+                              shape=shape))
+                for voxel_timecourses in _iter_slabs(timecourses):
+                    M = self._normalized_timecourses(voxel_timecourses)
+                    C += M.dot(M.T)
+                del timecourses
+            finally:
+                os.unlink(scratch)
+
+        evals, evecs = linalg.eigh(C)
+        return evecs[:, np.argsort(evals)[::-1][:min(shape[0], len(evals))]]
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -456,26 +588,28 @@ class TCompCor(CompCor):
     output_spec = TCompCorOutputSpec
 
     def _run_interface(self, runtime):
-        imgseries = nb.load(self.inputs.realigned_file, mmap=NUMPY_MMAP).get_data()
+        img = nb.load(self.inputs.realigned_file, mmap=NUMPY_MMAP)
 
-        if imgseries.ndim != 4:
+        if len(img.shape) != 4:
             raise ValueError('tCompCor expected a 4-D nifti file. Input {} has {} dimensions '
                              '(shape {})'
-                             .format(self.inputs.realigned_file, imgseries.ndim, imgseries.shape))
+                             .format(self.inputs.realigned_file, len(img.shape), img.shape))
 
         if isdefined(self.inputs.mask_file):
             in_mask_data = nb.load(self.inputs.mask_file, mmap=NUMPY_MMAP).get_data()
-            imgseries = imgseries[in_mask_data != 0, :]
+            in_mask = in_mask_data != 0
+        else:
+            in_mask = np.ones(img.shape[:3], dtype=bool)
 
         # From the paper:
         # "For each voxel time series, the temporal standard deviation is
         # defined as the standard deviation of the time series after the removal
         # of low-frequency nuisance terms (e.g., linear and quadratic drift)."
-        imgseries = regress_poly(2, imgseries)
-
+        # This is accumulated a block of volumes at a time to bound memory use.
         # "To construct the tSTD noise ROI, we sorted the voxels by their
         # temporal standard deviation ..."
-        tSTD = self._compute_tSTD(imgseries, 0, axis=-1)
+        tSTD = _detrended_std(self.inputs.realigned_file, in_mask, 2)
+        tSTD[np.isnan(tSTD)] = 0
 
         # use percentile_threshold to pick voxels
         threshold_std = np.percentile(tSTD, 100. * (1. - self.inputs.percentile_threshold))
@@ -483,14 +617,13 @@ class TCompCor(CompCor):
 
         if isdefined(self.inputs.mask_file):
             mask_data = np.zeros_like(in_mask_data)
-            mask_data[in_mask_data != 0] = mask
         else:
-            mask_data = mask.astype(int)
+            mask_data = np.zeros(in_mask.shape, dtype=int)
+        mask_data[in_mask] = mask
 
         # save mask
         mask_file = os.path.abspath('mask.nii')
-        nb.Nifti1Image(mask_data,
-                       nb.load(self.inputs.realigned_file).affine).to_filename(mask_file)
+        nb.Nifti1Image(mask_data, img.affine).to_filename(mask_file)
         IFLOG.debug('tCompcor computed and saved mask of shape {} to mask_file {}'
                    .format(mask.shape, mask_file))
         self.inputs.mask_file = mask_file
@@ -504,6 +637,44 @@ class TCompCor(CompCor):
         outputs['high_variance_mask'] = self.inputs.mask_file
         return outputs
 
+
+def _iter_volume_blocks(filenames, block_bytes=None):
+    ''' yields the volumes of a list of 3D or 4D images, in order, a block of
+    a few volumes at a time. Each file is read once from start to end, which
+    also holds for compressed files.
+    '''
+    for filename in filenames:
+        img = nb.load(filename, mmap=NUMPY_MMAP)
+        proxy = img.dataobj
+        if len(img.shape) != 4 or not isinstance(proxy, ArrayProxy) or \
+                proxy.order != 'F':
+            yield img.get_data().reshape(img.shape[:3] + (-1,))
+            continue
+
+        nvox = int(np.prod(img.shape[:3]))
+        with ImageOpener(proxy.file_like) as fobj:
+            fobj.seek(proxy.offset)
+            for volumes in iter_blocks(img.shape[3], 8 * nvox, block_bytes):
+                n = volumes.stop - volumes.start
+                block = np.frombuffer(
+                    fobj.read(nvox * n * proxy.dtype.itemsize),
+                    dtype=proxy.dtype)
+                block = block.reshape(img.shape[:3] + (n,), order='F')
+                yield apply_read_scaling(block, proxy.slope, proxy.inter)
+
+
+def _n_volumes(img):
+    return int(np.prod(img.shape[3:]))
+
+
+def _data_kind(img):
+    ''' dtype kind of img.get_data(), without reading it '''
+    if (getattr(img.dataobj, 'slope', 1.) != 1. or
+            getattr(img.dataobj, 'inter', 0.) != 0.):
+        return 'f'
+    return img.get_data_dtype().kind
+
+
 class TSNRInputSpec(BaseInterfaceInputSpec):
     in_file = InputMultiPath(File(exists=True), mandatory=True,
                              desc='realigned 4D file or a list of 3D files')
@@ -537,6 +708,9 @@ class TSNR(BaseInterface):
     >>> tsnr.inputs.in_file = 'functional.nii'
     >>> res = tsnr.run() # doctest: +SKIP
 
+    The runs are streamed a few volumes at a time, so several long runs can
+    be given at once without holding them in memory.
+
     """
     input_spec = TSNRInputSpec
     output_spec = TSNROutputSpec
@@ -544,29 +718,71 @@ class TSNR(BaseInterface):
     def _run_interface(self, runtime):
         img = nb.load(self.inputs.in_file[0], mmap=NUMPY_MMAP)
         header = img.header.copy()
+        affine = img.affine
         vollist = [nb.load(filename, mmap=NUMPY_MMAP) for filename in self.inputs.in_file]
-        data = np.concatenate([vol.get_data().reshape(
-            vol.get_shape()[:3] + (-1,)) for vol in vollist], axis=3)
-        data = np.nan_to_num(data)
+        shape = img.shape[:3] + (sum(_n_volumes(vol) for vol in vollist), )
 
-        if data.dtype.kind == 'i':
+        if _data_kind(img) == 'i':
             header.set_data_dtype(np.float32)
-            data = data.astype(np.float32)
 
+        # The runs are read a few volumes at a time, so that memory use does
+        # not grow with their number or length. A first pass estimates the
+        # polynomial trends over the concatenated runs, as regress_poly would.
+        degree = 0
         if isdefined(self.inputs.regress_poly):
-            data = regress_poly(self.inputs.regress_poly, data, remove_mean=False)
-            img = nb.Nifti1Image(data, img.get_affine(), header)
-            nb.save(img, op.abspath(self.inputs.detrended_file))
-
-        meanimg = np.mean(data, axis=3)
-        stddevimg = np.std(data, axis=3)
+            degree = self.inputs.regress_poly
+            X = _poly_design(degree, shape[3])
+            pinvX = np.linalg.pinv(X)
+            betas = np.zeros(shape[:3] + (degree + 1, ))
+            t = 0
+            for block in _iter_volume_blocks(self.inputs.in_file):
+                n = block.shape[3]
+                betas += np.nan_to_num(block).dot(pinvX[:, t:t + n].T)
+                t += n
+
+            detrended_dtype = header.get_data_dtype()
+            if detrended_dtype.kind != 'f':
+                detrended_dtype = np.dtype(np.float32)
+            detrended, detrended_dtype = open_nifti(
+                op.abspath(self.inputs.detrended_file), shape,
+                detrended_dtype, affine, header)
+
+        # Mean and variance are merged block by block (Chan et al.'s update of
+        # Welford's algorithm), which is stable in a single pass
+        count = 0
+        meanimg = np.zeros(shape[:3])
+        m2img = np.zeros(shape[:3])
+        try:
+            t = 0
+            for block in _iter_volume_blocks(self.inputs.in_file):
+                n = block.shape[3]
+                block = np.nan_to_num(block.astype(np.float64))
+                if degree:
+                    # disregard the first layer of X, which is degree 0
+                    block -= betas[..., 1:].dot(X[t:t + n, 1:].T)
+                    array_to_file(block, detrended, detrended_dtype,
+                                  offset=None)
+                t += n
+
+                block_mean = block.mean(axis=3)
+                block -= block_mean[..., np.newaxis]
+                delta = block_mean - meanimg
+                meanimg += delta * n / (count + n)
+                m2img += (np.square(block).sum(axis=3) +
+                          np.square(delta) * count * n / (count + n))
+                count += n
+        finally:
+            if degree:
+                detrended.close()
+
+        stddevimg = np.sqrt(m2img / count)
         tsnr = np.zeros_like(meanimg)
         tsnr[stddevimg > 1.e-3] = meanimg[stddevimg > 1.e-3] / stddevimg[stddevimg > 1.e-3]
-        img = nb.Nifti1Image(tsnr, img.get_affine(), header)
+        img = nb.Nifti1Image(tsnr, affine, header)
         nb.save(img, op.abspath(self.inputs.tsnr_file))
-        img = nb.Nifti1Image(meanimg, img.get_affine(), header)
+        img = nb.Nifti1Image(meanimg, affine, header)
         nb.save(img, op.abspath(self.inputs.mean_file))
-        img = nb.Nifti1Image(stddevimg, img.get_affine(), header)
+        img = nb.Nifti1Image(stddevimg, affine, header)
         nb.save(img, op.abspath(self.inputs.stddev_file))
         return runtime
 
@@ -652,6 +868,75 @@ def _is_outlier(points, thresh=3.5):
     return timepoints_to_discard
 
 
+# voxel-by-time matrices larger than this are not decomposed with a full SVD
+_COMPCOR_SVD_BYTES = 2 ** 28
+
+
+def _masked_timecourses(filename, mask, out):
+    ''' fills out, a voxels x time array (e.g., a memory map), with the time
+    courses of the voxels of mask in a 4D image, reading the image once '''
+    t = 0
+    for block in _iter_volume_blocks([filename]):
+        out[:, t:t + block.shape[3]] = block[mask]
+        t += block.shape[3]
+    return out
+
+
+def _iter_slabs(timecourses, slab_bytes=None):
+    ''' yields in-memory copies of slabs of rows of a voxels x time array '''
+    for voxels in iter_blocks(timecourses.shape[0], 8 * timecourses.shape[1],
+                              slab_bytes):
+        yield np.array(timecourses[voxels], dtype=np.float64)
+
+
+def _detrended_std(filename, mask, degree):
+    ''' temporal standard deviation of the voxels of mask in a 4D image
+    after regressing out polynomials up to degree, as
+    np.std(regress_poly(degree, data), axis=-1), accumulated a block of
+    volumes at a time
+
+    The residual sum of squares of a voxel is its sum of squares minus that
+    of its projection on an orthonormal basis of the polynomials. Both are
+    summed over blocks, once the first value of the voxel is subtracted to
+    avoid cancellation (a constant is in the span of the polynomials).
+    '''
+    nt = nb.load(filename, mmap=NUMPY_MMAP).shape[3]
+    basis = np.linalg.qr(_poly_design(degree, nt))[0]
+    n_voxels = np.count_nonzero(mask)
+    sumsq = np.zeros(n_voxels)
+    proj = np.zeros((basis.shape[1], n_voxels))
+    first = None
+    t = 0
+    for block in _iter_volume_blocks([filename]):
+        data = np.asarray(block[mask], dtype=np.float64)
+        if first is None:
+            first = data[:, :1].copy()
+        data -= first
+        sumsq += np.einsum('ij,ij->i', data, data)
+        proj += basis[t:t + data.shape[1]].T.dot(data.T)
+        t += data.shape[1]
+    var = (sumsq - np.einsum('ij,ij->j', proj, proj)) / nt
+    return np.sqrt(np.maximum(var, 0))
+
+
+def _positive_max_loading(u):
+    ''' flips the columns of u so that the largest loading of each is
+    positive, which fixes the arbitrary sign of singular vectors '''
+    signs = np.sign(u[np.argmax(np.abs(u), axis=0), np.arange(u.shape[1])])
+    return u * np.where(signs == 0, 1, signs)
+
+
+def _poly_design(degree, timepoints):
+    ''' design matrix of the Legendre polynomials up to degree, with the
+    constant term first '''
+    X = np.ones((timepoints, 1)) # quick way to calc degree 0
+    for i in range(degree):
+        polynomial_func = Legendre.basis(i + 1)
+        value_array = np.linspace(-1, 1, timepoints)
+        X = np.hstack((X, polynomial_func(value_array)[:, np.newaxis]))
+    return X
+
+
 def regress_poly(degree, data, remove_mean=True, axis=-1):
     ''' returns data with degree polynomial regressed out.
     Be default it is calculated along the last axis (usu. time).
@@ -667,11 +952,7 @@ def regress_poly(degree, data, remove_mean=True, axis=-1):
     data = data.reshape((-1, timepoints))
 
     # Generate design matrix
-    X = np.ones((timepoints, 1)) # quick way to calc degree 0
-    for i in range(degree):
-        polynomial_func = Legendre.basis(i + 1)
-        value_array = np.linspace(-1, 1, timepoints)
-        X = np.hstack((X, polynomial_func(value_array)[:, np.newaxis]))
+    X = _poly_design(degree, timepoints)
 
     # Calculate coefficients
     betas = np.linalg.pinv(X).dot(data.T)
@@ -703,11 +984,12 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
 
     .. note:: Implementation details
 
-      Uses the implementation of the `Yule-Walker equations
-      from nitime
+      The lag-1 coefficient of the :abbr:`AR (auto-regressive)` filtering
+      of the fMRI signal is the closed-form solution of the order-1
+      `Yule-Walker equations
       <http://nipy.org/nitime/api/generated/nitime.algorithms.autoregressive.html\
-#nitime.algorithms.autoregressive.AR_est_YW>`_
-      for the :abbr:`AR (auto-regressive)` filtering of the fMRI signal.
+#nitime.algorithms.autoregressive.AR_est_YW>`_, computed for all voxels
+      at once.
 
     :param numpy.ndarray func: functional data, after head-motion-correction.
     :param numpy.ndarray mask: a 3D mask of the brain
@@ -718,7 +1000,6 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
     """
     import numpy as np
     import nibabel as nb
-    from nitime.algorithms import AR_est_YW
     import warnings
 
     func = nb.load(in_file, mmap=NUMPY_MMAP).get_data().astype(np.float32)
@@ -744,12 +1025,10 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
         func_sd = func_sd[func_sd != 0]
 
     # Compute (non-robust) estimate of lag-1 autocorrelation
-    ar1 = np.apply_along_axis(AR_est_YW, 1,
-                              regress_poly(0, mfunc, remove_mean=True).astype(
-                                  np.float32), 1)[:, 0]
+    ar1 = _ar1_yule_walker(mfunc)
 
     # Compute (predicted) standard deviation of temporal difference time series
-    diff_sdhat = np.squeeze(np.sqrt(((1 - ar1) * 2).tolist())) * func_sd
+    diff_sdhat = np.sqrt((1 - ar1) * 2) * func_sd
     diff_sd_mean = diff_sdhat.mean()
 
     # Compute temporal difference time series
@@ -765,13 +1044,57 @@ research/nichols/scripts/fsl/standardizeddvars.pdf>`_, 2013.
         warnings.filterwarnings('error')
 
         # voxelwise standardization
-        diff_vx_stdz = np.square(
-            func_diff / np.array([diff_sdhat] * func_diff.shape[-1]).T)
+        diff_vx_stdz = np.square(func_diff / diff_sdhat[:, np.newaxis])
         dvars_vx_stdz = np.sqrt(diff_vx_stdz.mean(axis=0))
 
     return (dvars_stdz, dvars_nstd, dvars_vx_stdz)
 
 
+def compute_fd(mpars, source, radius=50):
+    """
+    Compute the :abbr:`FD (framewise displacement)` [Power2012]_ of a run
+    from its motion parameters.
+
+    The parameters of all timepoints are normalized at once to the SPM
+    convention, and rotations are converted to displacements on a sphere
+    of the given radius.
+
+    >>> mpars = [[0, 0, 0, 0, 0, 0],
+    ...          [0.1, 0, -0.2, 0, 0.01, 0],
+    ...          [0.1, 0, -0.2, 0, 0.01, 0]]
+    >>> compute_fd(mpars, 'SPM').tolist()
+    [0.8, 0.0]
+
+    :param numpy.ndarray mpars: [timepoints x parameters] motion
+      parameters, in the format of ``source``
+    :param str source: the package that estimated the parameters, FSL,
+      AFNI, SPM or FSFAST
+    :param float radius: radius of the sphere, in mm
+    :return: the FD of each timepoint but the first, in mm
+
+    """
+    mpars = normalize_mc_params(np.array(mpars, dtype=float, ndmin=2), source)
+    diff = mpars[:-1, :6] - mpars[1:, :6]
+    diff[:, 3:6] *= radius
+    return np.abs(diff).sum(axis=1)
+
+
+def _load_motion_params(in_file):
+    ''' [timepoints x parameters] array from a text file of motion
+    parameters, with one row per timepoint even for a single one '''
+    return np.loadtxt(in_file, ndmin=2)
+
+
+def _ar1_yule_walker(data):
+    ''' lag-1 coefficient of the order-1 Yule-Walker AR model of each row of
+    data, i.e. its demeaned lag-1 autocovariance over its variance '''
+    data = data - data.mean(axis=1, dtype=np.float64)[:, np.newaxis].astype(data.dtype)
+    rxx0 = np.einsum('ij,ij->i', data, data, dtype=np.float64)
+    rxx1 = np.einsum('ij,ij->i', data[:, 1:], data[:, :-1], dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return rxx1 / rxx0
+
+
 def plot_confound(tseries, figsize, name, units=None,
                   series_tr=None, normalize=False):
     """
@@ -1,6 +1,5 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function, division, unicode_literals, absolute_import
-from builtins import range
 import os
 import numpy as np
 from numpy import ones, kron, mean, eye, hstack, dot, tile
@@ -9,6 +8,7 @@ from scipy.linalg import pinv
 from ..interfaces.base import BaseInterfaceInputSpec, TraitedSpec, \
     BaseInterface, traits, File
 from nipype.utils import NUMPY_MMAP
+from ..utils.misc import iter_blocks
 
 
 class ICCInputSpec(BaseInterfaceInputSpec):
@@ -38,32 +38,43 @@ class ICC(BaseInterface):
         maskdata = nb.load(self.inputs.mask).get_data()
         maskdata = np.logical_not(np.logical_or(maskdata == 0, np.isnan(maskdata)))
 
-        session_datas = [[nb.load(fname, mmap=NUMPY_MMAP).get_data()[maskdata].reshape(-1, 1) for fname in sessions] for sessions in self.inputs.subjects_sessions]
-        list_of_sessions = [np.dstack(session_data) for session_data in session_datas]
-        all_data = np.hstack(list_of_sessions)
-        icc = np.zeros(session_datas[0][0].shape)
-        session_F = np.zeros(session_datas[0][0].shape)
-        session_var = np.zeros(session_datas[0][0].shape)
-        subject_var = np.zeros(session_datas[0][0].shape)
-
-        for x in range(icc.shape[0]):
-            Y = all_data[x, :, :]
-            icc[x], subject_var[x], session_var[x], session_F[x], _, _ = ICC_rep_anova(Y)
+        nb_subjects = len(self.inputs.subjects_sessions)
+        nb_sessions = len(self.inputs.subjects_sessions[0])
+        all_data = np.empty((np.count_nonzero(maskdata), nb_subjects,
+                             nb_sessions))
+        for i, sessions in enumerate(self.inputs.subjects_sessions):
+            for j, fname in enumerate(sessions):
+                all_data[:, i, j] = nb.load(
+                    fname, mmap=NUMPY_MMAP).get_data()[maskdata]
+        icc = np.zeros(all_data.shape[0])
+        session_F = np.zeros(all_data.shape[0])
+        session_var = np.zeros(all_data.shape[0])
+        subject_var = np.zeros(all_data.shape[0])
+
+        # the design, hence its projection, is the same for every voxel
+        projection = _design_projection(nb_subjects, nb_sessions)
+        for x in iter_blocks(all_data.shape[0],
+                             8 * nb_subjects * nb_sessions):
+            icc[x], subject_var[x], session_var[x], session_F[x], _, _ = \
+                ICC_rep_anova(all_data[x], projection=projection)
 
         nim = nb.load(self.inputs.subjects_sessions[0][0])
+        header = nim.header.copy()
+        if header.get_data_dtype().kind != 'f':
+            header.set_data_dtype(np.float64)
         new_data = np.zeros(nim.shape)
-        new_data[maskdata] = icc.reshape(-1,)
-        new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
+        new_data[maskdata] = icc
+        new_img = nb.Nifti1Image(new_data, nim.affine, header)
         nb.save(new_img, 'icc_map.nii')
 
         new_data = np.zeros(nim.shape)
-        new_data[maskdata] = session_var.reshape(-1,)
-        new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
+        new_data[maskdata] = session_var
+        new_img = nb.Nifti1Image(new_data, nim.affine, header)
         nb.save(new_img, 'session_var_map.nii')
 
         new_data = np.zeros(nim.shape)
-        new_data[maskdata] = subject_var.reshape(-1,)
-        new_img = nb.Nifti1Image(new_data, nim.affine, nim.header)
+        new_data[maskdata] = subject_var
+        new_img = nb.Nifti1Image(new_data, nim.affine, header)
         nb.save(new_img, 'subject_var_map.nii')
 
         return runtime
@@ -71,13 +82,24 @@ class ICC(BaseInterface):
     def _list_outputs(self):
         outputs = self._outputs().get()
         outputs['icc_map'] = os.path.abspath('icc_map.nii')
-        outputs['sessions_F_map'] = os.path.abspath('sessions_F_map.nii')
         outputs['session_var_map'] = os.path.abspath('session_var_map.nii')
         outputs['subject_var_map'] = os.path.abspath('subject_var_map.nii')
         return outputs
 
 
-def ICC_rep_anova(Y):
+def _design_projection(nb_subjects, nb_conditions):
+    '''
+    Return the projection onto the space of the repeated measure design
+    X = [FaTor / Subjects], i.e. X pinv(X'X) X', which predicts Y.flatten('F')
+    '''
+    # create the design matrix for the different levels
+    x = kron(eye(nb_conditions), ones((nb_subjects, 1)))  # sessions
+    x0 = tile(eye(nb_subjects), (nb_conditions, 1))  # subjects
+    X = hstack([x, x0])
+    return dot(dot(X, pinv(dot(X.T, X))), X.T)
+
+
+def ICC_rep_anova(Y, projection=None):
     '''
     the data Y are entered as a 'table' ie subjects are in rows and repeated
     measures in columns
@@ -85,9 +107,14 @@ def ICC_rep_anova(Y):
     One Sample Repeated measure ANOVA
 
     Y = XB + E with X = [FaTor / Subjects]
+
+    Y can also be a stack of tables (e.g. voxels x subjects x conditions),
+    every statistic is then an array with one value per table.  The
+    projection onto the design only depends on the shape of the tables and
+    can be passed in to avoid recomputing it (see _design_projection).
     '''
 
-    [nb_subjects, nb_conditions] = Y.shape
+    [nb_subjects, nb_conditions] = Y.shape[-2:]
     dfc = nb_conditions - 1
     dfe = (nb_subjects - 1) * dfc
     dfr = nb_subjects - 1
@@ -96,25 +123,22 @@ def ICC_rep_anova(Y):
     # ------------------------------------
 
     # Sum Square Total
-    mean_Y = mean(Y)
-    SST = ((Y - mean_Y) ** 2).sum()
+    mean_Y = mean(Y, axis=(-2, -1), keepdims=True)
+    SST = ((Y - mean_Y) ** 2).sum(axis=(-2, -1))
 
-    # create the design matrix for the different levels
-    x = kron(eye(nb_conditions), ones((nb_subjects, 1)))  # sessions
-    x0 = tile(eye(nb_subjects), (nb_conditions, 1))  # subjects
-    X = hstack([x, x0])
+    if projection is None:
+        projection = _design_projection(nb_subjects, nb_conditions)
 
     # Sum Square Error
-    predicted_Y = dot(dot(dot(X, pinv(dot(X.T, X))), X.T), Y.flatten('F'))
-    residuals = Y.flatten('F') - predicted_Y
-    SSE = (residuals ** 2).sum()
-
-    residuals.shape = Y.shape
+    flat_Y = np.swapaxes(Y, -2, -1).reshape(Y.shape[:-2] + (-1, ))
+    predicted_Y = dot(flat_Y, projection.T)
+    residuals = flat_Y - predicted_Y
+    SSE = (residuals ** 2).sum(axis=-1)
 
     MSE = SSE / dfe
 
     # Sum square session effect - between colums/sessions
-    SSC = ((mean(Y, 0) - mean_Y) ** 2).sum() * nb_subjects
+    SSC = ((mean(Y, -2) - mean_Y[..., 0]) ** 2).sum(axis=-1) * nb_subjects
     MSC = SSC / dfc / nb_subjects
 
     session_effect_F = MSC / MSE
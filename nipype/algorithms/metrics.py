@@ -20,12 +20,13 @@ import os.path as op
 
 import nibabel as nb
 import numpy as np
-from scipy.ndimage.morphology import binary_erosion
+from scipy.ndimage.morphology import binary_erosion, distance_transform_edt
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist, euclidean, dice, jaccard
 from scipy.ndimage.measurements import center_of_mass, label
 
 from .. import logging
-from ..utils.misc import package_check
+from ..utils.misc import package_check, write_batch_table
 
 from ..interfaces.base import (BaseInterface, traits, TraitedSpec, File,
                                InputMultiPath,
@@ -87,6 +88,27 @@ class Distance(BaseInterface):
         coordinates = np.dot(affine, indices)
         return coordinates[:3, :]
 
+    def _same_axis_aligned_grid(self, nii1, nii2, data):
+        affine = nii1.affine[:3, :3]
+        return (data.ndim == 3 and nii1.shape == nii2.shape and
+                np.array_equal(nii1.affine, nii2.affine) and
+                np.array_equal(affine, np.diag(np.diag(affine))))
+
+    def _border_distances(self, border, data, affine):
+        """Distance from every voxel of data to its closest border voxel
+
+        The closest border voxels are found with an exact euclidean
+        distance transform, which needs both on the same axis aligned grid.
+        """
+        indices = distance_transform_edt(
+            np.logical_not(border), sampling=np.abs(np.diag(affine)[:3]),
+            return_distances=False, return_indices=True)
+        closest = np.vstack((indices[:, data],
+                             np.ones(np.count_nonzero(data))))
+        closest_coordinates = np.dot(affine, closest)[:3, :]
+        coordinates = self._get_coordinates(data, affine)
+        return np.sqrt(((coordinates - closest_coordinates) ** 2).sum(axis=0))
+
     def _eucl_min(self, nii1, nii2):
         origdata1 = nii1.get_data().astype(np.bool)
         border1 = self._find_border(origdata1)
@@ -98,9 +120,12 @@ class Distance(BaseInterface):
 
         set2_coordinates = self._get_coordinates(border2, nii2.affine)
 
-        dist_matrix = cdist(set1_coordinates.T, set2_coordinates.T)
-        (point1, point2) = np.unravel_index(
-            np.argmin(dist_matrix), dist_matrix.shape)
+        # nearest border2 point of every border1 point, then the first pair
+        # at the smallest distance, as np.argmin over all pairs would pick
+        min_dists, _ = cKDTree(set2_coordinates.T).query(set1_coordinates.T)
+        point1 = np.argmin(min_dists)
+        point2 = np.argmin(cdist(set1_coordinates.T[point1:point1 + 1, :],
+                                 set2_coordinates.T))
         return (euclidean(set1_coordinates.T[point1, :],
                           set2_coordinates.T[point2, :]),
                 set1_coordinates.T[point1, :],
@@ -127,17 +152,21 @@ class Distance(BaseInterface):
 
         return np.mean(dist_matrix)
 
-    def _eucl_mean(self, nii1, nii2, weighted=False):
-        origdata1 = nii1.get_data().astype(np.bool)
-        border1 = self._find_border(origdata1)
-
+    def _min_distances(self, nii1, nii2):
+        """Distance from every voxel of volume2 to the border of volume1"""
+        border1 = self._find_border(nii1.get_data().astype(np.bool))
         origdata2 = nii2.get_data().astype(np.bool)
 
+        if self._same_axis_aligned_grid(nii1, nii2, origdata2):
+            return self._border_distances(border1, origdata2, nii1.affine)
+
         set1_coordinates = self._get_coordinates(border1, nii1.affine)
         set2_coordinates = self._get_coordinates(origdata2, nii2.affine)
+        return cKDTree(set1_coordinates.T).query(set2_coordinates.T)[0]
 
-        dist_matrix = cdist(set1_coordinates.T, set2_coordinates.T)
-        min_dist_matrix = np.amin(dist_matrix, axis=0)
+    def _eucl_mean(self, nii1, nii2, weighted=False):
+        origdata2 = nii2.get_data().astype(np.bool)
+        min_dist_matrix = self._min_distances(nii1, nii2)
         import matplotlib.pyplot as plt
         plt.figure()
         plt.hist(min_dist_matrix, 50, normed=1, facecolor='green')
@@ -176,9 +205,9 @@ class Distance(BaseInterface):
 
         set1_coordinates = self._get_coordinates(border1, nii1.affine)
         set2_coordinates = self._get_coordinates(border2, nii2.affine)
-        distances = cdist(set1_coordinates.T, set2_coordinates.T)
         mins = np.concatenate(
-            (np.amin(distances, axis=0), np.amin(distances, axis=1)))
+            (cKDTree(set1_coordinates.T).query(set2_coordinates.T)[0],
+             cKDTree(set2_coordinates.T).query(set1_coordinates.T)[0]))
 
         return np.max(mins)
 
@@ -361,6 +390,154 @@ class Overlap(BaseInterface):
         return outputs
 
 
+def _label_data(nii):
+    """Label map of an image as integers, with NaN and negative values as
+    -1, so that they are never counted as the background label 0"""
+    data = nii.get_data()
+    if data.dtype.kind == 'f':
+        data = np.where(np.logical_or(data < 0, np.isnan(data)), -1,
+                        np.rint(data))
+    return data.astype(np.intp)
+
+
+def _label_overlap(data1, data2, labels):
+    """Return the volumes (in voxels) of each label in data1 and data2,
+    and of their intersection
+
+    The labels of interest are mapped to 1..len(labels) and every other
+    value to 0, so that each volume is one pass of np.bincount.
+
+    >>> data1 = np.array([0, 1, 1, 2, 2, 2, 3])
+    >>> data2 = np.array([1, 1, 0, 2, 2, 3, 3])
+    >>> [v.tolist() for v in _label_overlap(data1, data2, [1, 2, 3])]
+    [[2, 3, 1], [2, 2, 2], [1, 2, 1]]
+
+    """
+    labels = np.asarray(labels, dtype=np.intp)
+    n_labels = len(labels)
+    lookup = np.zeros(labels.max() + 2 if n_labels else 1, dtype=np.intp)
+    lookup[labels] = np.arange(1, n_labels + 1)
+    # the last entry maps to 0, as does any value below or above the labels
+    top = len(lookup) - 1
+    index1 = lookup[np.clip(data1.ravel(), -1, top)]
+    index2 = lookup[np.clip(data2.ravel(), -1, top)]
+    volumes1 = np.bincount(index1, minlength=n_labels + 1)[1:]
+    volumes2 = np.bincount(index2, minlength=n_labels + 1)[1:]
+    both = np.bincount(index1[index1 == index2], minlength=n_labels + 1)[1:]
+    return volumes1, volumes2, both
+
+
+class BatchOverlapInputSpec(BaseInterfaceInputSpec):
+    in_ref = InputMultiPath(File(exists=True), mandatory=True,
+                            desc='reference label maps')
+    in_tst = InputMultiPath(File(exists=True), mandatory=True,
+                            desc='test label maps, one per reference map '
+                                 'and with the same dimensions')
+    labels = traits.List(traits.Range(low=0),
+                         desc='labels to evaluate (default: the labels '
+                              'found in each reference map)')
+    bg_overlap = traits.Bool(False, usedefault=True,
+                             desc='consider zeros as a label')
+    mask_volume = File(exists=True,
+                       desc='calculate overlap only within this mask.')
+    pair_ids = traits.List(traits.Str(),
+                           desc='identifiers of the pairs written in the '
+                                'first column (default: their position)')
+    vol_units = traits.Enum('voxel', 'mm', usedefault=True,
+                            desc='units for volumes')
+    out_file = File('overlap.csv', usedefault=True,
+                    desc='table with one row per pair and label')
+
+
+class BatchOverlapOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc='table with one row per pair and label')
+
+
+class BatchOverlap(BaseInterface):
+    """
+    Calculates Dice, Jaccard and volume similarity for each label of many
+    pairs of label maps, and writes them to a single table.
+
+    Each pair is read once and all its labels are counted in one pass with
+    a joint label histogram, so evaluating hundreds of subjects and labels
+    does not take one :py:class:`Overlap` node per pair.  The table has the
+    columns ``pair, label, ref_volume, tst_volume, dice, jaccard,
+    volume_similarity``, where volume similarity is
+    :math:`1 - |V_{ref} - V_{tst}| / (V_{ref} + V_{tst})`.  All three are 0
+    for a label absent from both maps.
+
+    Example
+    -------
+
+    >>> overlap = BatchOverlap()
+    >>> overlap.inputs.in_ref = ['cont1.nii', 'cont1a.nii']
+    >>> overlap.inputs.in_tst = ['cont2.nii', 'cont2a.nii']
+    >>> overlap.inputs.labels = [1, 2, 3]
+    >>> res = overlap.run() # doctest: +SKIP
+
+    """
+    input_spec = BatchOverlapInputSpec
+    output_spec = BatchOverlapOutputSpec
+
+    def _run_interface(self, runtime):
+        if len(self.inputs.in_ref) != len(self.inputs.in_tst):
+            raise ValueError('in_ref and in_tst must have the same length')
+
+        self._maskdata = None
+        if isdefined(self.inputs.mask_volume):
+            maskdata = nb.load(self.inputs.mask_volume).get_data()
+            self._maskdata = ~np.logical_or(maskdata == 0, np.isnan(maskdata))
+
+        write_batch_table(
+            self.inputs.out_file,
+            ['pair', 'label', 'ref_volume', 'tst_volume', 'dice', 'jaccard',
+             'volume_similarity'],
+            zip(self.inputs.in_ref, self.inputs.in_tst), self._pair_rows,
+            ['%d', '%.10g', '%.10g', '%.6f', '%.6f', '%.6f'],
+            ids=(self.inputs.pair_ids if isdefined(self.inputs.pair_ids)
+                 else None))
+        return runtime
+
+    def _pair_rows(self, pair):
+        ref, tst = pair
+        nii1 = nb.load(ref)
+        data1 = _label_data(nii1)
+        data2 = _label_data(nb.load(tst))
+        if data1.shape != data2.shape:
+            raise RuntimeError(
+                'Label maps %s and %s have different shapes' % (ref, tst))
+        if self._maskdata is not None:
+            data1 = data1[self._maskdata]
+            data2 = data2[self._maskdata]
+
+        if isdefined(self.inputs.labels):
+            labels = np.array(self.inputs.labels, dtype=np.intp)
+        else:
+            labels = np.flatnonzero(np.bincount(np.maximum(data1.ravel(), 0)))
+            labels = labels[labels > 0]
+        if self.inputs.bg_overlap and 0 not in labels:
+            labels = np.hstack(([0], labels))
+
+        volumes1, volumes2, both = _label_overlap(data1, data2, labels)
+        total = volumes1 + volumes2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dice = np.where(total > 0, 2.0 * both / total, 0)
+            jaccard = np.where(total > 0, both / (total - both), 0)
+            similarity = np.where(
+                total > 0, 1.0 - np.abs(volumes1 - volumes2) / total, 0)
+
+        scale = 1.0
+        if self.inputs.vol_units == 'mm':
+            scale = float(np.prod(nii1.header.get_zooms()[:3]))
+        return zip(labels, scale * volumes1, scale * volumes2, dice, jaccard,
+                   similarity)
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['out_file'] = os.path.abspath(self.inputs.out_file)
+        return outputs
+
+
 class FuzzyOverlapInputSpec(BaseInterfaceInputSpec):
     in_ref = InputMultiPath(File(exists=True), mandatory=True,
                             desc='Reference image. Requires the same dimensions as in_tst.')
@@ -15,8 +15,10 @@ from __future__ import print_function, division, unicode_literals, absolute_impo
 from builtins import str, zip, range, open
 from future.utils import raise_from
 
+import gzip
 import os
 import os.path as op
+import shutil
 
 import nibabel as nb
 import numpy as np
@@ -35,6 +37,7 @@ from ..interfaces.base import (BaseInterface, traits, TraitedSpec, File,
                                DynamicTraitedSpec, Undefined)
 from ..utils.filemanip import fname_presuffix, split_filename
 from nipype.utils import NUMPY_MMAP
+from ..utils.misc import open_nifti, iter_blocks
 
 from . import confounds
 
@@ -409,31 +412,40 @@ class Matlab2CSV(BaseInterface):
         return outputs
 
 
-def merge_csvs(in_list):
-    for idx, in_file in enumerate(in_list):
+def _load_csv_values(in_file):
+    """Read the numbers of a CSV file
+
+    Like ``np.loadtxt``, but the text is split once and converted to floats
+    in a single call. As with ``np.loadtxt``, text after a ``#`` is a
+    comment. A header line, a column of row labels and a last column of
+    labels are dropped, in that order, if they are not numeric.
+    """
+    with open(in_file, 'r') as fid:
+        lines = [line.split('#', 1)[0] for line in fid.read().splitlines()]
+    rows = [line.split(',') for line in lines if line.strip()]
+    cells = np.array(rows)
+    if cells.dtype == object:
+        raise ValueError('Rows of %s have different lengths' % in_file)
+    cells = np.atleast_2d(cells)
+    for values in [cells, cells[1:], cells[1:, 1:], cells[1:, 1:-1]]:
         try:
-            in_array = np.loadtxt(in_file, delimiter=',')
-        except ValueError as ex:
-            try:
-                in_array = np.loadtxt(in_file, delimiter=',', skiprows=1)
-            except ValueError as ex:
-                with open(in_file, 'r') as first:
-                    header_line = first.readline()
-
-                header_list = header_line.split(',')
-                n_cols = len(header_list)
-                try:
-                    in_array = np.loadtxt(
-                        in_file, delimiter=',', skiprows=1,
-                        usecols=list(range(1, n_cols))
-                    )
-                except ValueError as ex:
-                    in_array = np.loadtxt(
-                        in_file, delimiter=',', skiprows=1, usecols=list(range(1, n_cols - 1)))
-        if idx == 0:
-            out_array = in_array
-        else:
-            out_array = np.dstack((out_array, in_array))
+            return np.squeeze(values.astype(float))
+        except ValueError:
+            pass
+    raise ValueError('Could not read numbers from %s' % in_file)
+
+
+def merge_csvs(in_list):
+    arrays = [_load_csv_values(in_file) for in_file in in_list]
+    # stack along a third axis, as np.dstack would, into a single array
+    shape = np.atleast_3d(arrays[0]).shape[:2]
+    out_array = np.empty(shape + (len(arrays), ))
+    for idx, in_array in enumerate(arrays):
+        in_array = np.atleast_3d(in_array)
+        if in_array.shape[:2] != shape:
+            raise ValueError('%s does not have the shape of %s' %
+                             (in_list[idx], in_list[0]))
+        out_array[:, :, idx] = in_array[:, :, 0]
     out_array = np.squeeze(out_array)
     iflogger.info('Final output array shape:')
     iflogger.info(np.shape(out_array))
@@ -461,6 +473,12 @@ def remove_identical_paths(in_files):
 
 
 def maketypelist(rowheadings, shape, extraheadingBool, extraheading):
+    """
+    .. deprecated:: 0.13.0
+       MergeCSVFiles no longer builds a structured array to write its table.
+    """
+    warnings.warn('maketypelist has been deprecated since 0.13.0 and will '
+                  'be removed', DeprecationWarning)
     typelist = []
     if rowheadings:
         typelist.append(('heading', 'a40'))
@@ -478,6 +496,12 @@ def maketypelist(rowheadings, shape, extraheadingBool, extraheading):
 
 def makefmtlist(output_array, typelist, rowheadingsBool,
                 shape, extraheadingBool):
+    """
+    .. deprecated:: 0.13.0
+       MergeCSVFiles no longer builds a structured array to write its table.
+    """
+    warnings.warn('makefmtlist has been deprecated since 0.13.0 and will '
+                  'be removed', DeprecationWarning)
     fmtlist = []
     if rowheadingsBool:
         fmtlist.append('%s')
@@ -596,40 +620,33 @@ class MergeCSVFiles(BaseInterface):
         _, name, ext = split_filename(self.inputs.out_file)
         if not ext == '.csv':
             ext = '.csv'
-
         out_file = op.abspath(name + ext)
-        with open(out_file, 'w') as file_handle:
-            file_handle.write(csv_headings)
 
-        shape = np.shape(output_array)
-        typelist = maketypelist(
-            rowheadingsBool, shape, extraheadingBool, extraheading)
-        fmt, output = makefmtlist(
-            output_array, typelist, rowheadingsBool, shape, extraheadingBool)
+        # a single file, or files of a single value, make a single row
+        if output_array.ndim > 2:
+            raise ValueError('Input files must hold a single column of values')
+        output_array = np.atleast_2d(output_array)
+        n_rows, n_cols = output_array.shape
 
+        fmtlist = ['%f'] * n_cols
+        columns = []
         if rowheadingsBool:
-            row_heading_list = self.inputs.row_headings
-            row_heading_list_with_quotes = []
-            for row_heading in row_heading_list:
-                row_heading_with_quotes = '"' + row_heading + '"'
-                row_heading_list_with_quotes.append(row_heading_with_quotes)
-            row_headings = np.array(row_heading_list_with_quotes, dtype='|S40')
-            output['heading'] = row_headings
-
-        if isdefined(self.inputs.extra_field):
-            extrafieldlist = []
-            if len(shape) > 1:
-                mx = shape[0]
-            else:
-                mx = 1
-            for idx in range(0, mx):
-                extrafieldlist.append(self.inputs.extra_field)
-            iflogger.info(len(extrafieldlist))
-            output[extraheading] = extrafieldlist
-        iflogger.info(output)
+            if len(self.inputs.row_headings) != n_rows:
+                raise ValueError('%d row headings were given for %d rows' %
+                                 (len(self.inputs.row_headings), n_rows))
+            fmtlist.insert(0, '"%s"')
+            columns.append(self.inputs.row_headings)
+        columns.extend(output_array.T.tolist())
+        if extraheadingBool:
+            fmtlist.append('%s')
+            columns.append([self.inputs.extra_field] * n_rows)
+        fmt = ','.join(fmtlist)
         iflogger.info(fmt)
-        with open(out_file, 'a') as file_handle:
-            np.savetxt(file_handle, output, fmt, delimiter=',')
+
+        lines = [csv_headings]
+        lines.extend(fmt % row + '\n' for row in zip(*columns))
+        with open(out_file, 'w') as file_handle:
+            file_handle.write(''.join(lines))
 
         return runtime
 
@@ -709,6 +726,10 @@ class AddCSVColumn(BaseInterface):
 class AddCSVRowInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     in_file = traits.File(mandatory=True,
                           desc='Input comma-separated value (CSV) files')
+    append = traits.Bool(False, usedefault=True,
+                         desc='Append the row to the end of the file instead '
+                              'of rewriting it, when its columns are those '
+                              'already in the file')
     _outputs = traits.Dict(traits.Any, value={}, usedefault=True)
 
     def __setattr__(self, key, value):
@@ -750,6 +771,14 @@ class AddCSVRow(BaseInterface):
     >>> addrow.inputs.subject_id = 'S400'
     >>> addrow.inputs.list_of_values = [ 0.4, 0.7, 0.3 ]
     >>> addrow.run() # doctest: +SKIP
+
+    By default the whole file is read and written back for every row, which
+    makes building large tables quadratic. With ``append`` only the header
+    and the last line are read, and the row is written at the end of the
+    file. A row with new columns still rewrites the file.
+
+    >>> addrow.inputs.append = True
+    >>> addrow.run() # doctest: +SKIP
     """
     input_spec = AddCSVRowInputSpec
     output_spec = AddCSVRowOutputSpec
@@ -806,12 +835,13 @@ class AddCSVRow(BaseInterface):
             # Acquire lock
             self._lock.acquire()
 
-        if op.exists(self.inputs.in_file):
-            formerdf = pd.read_csv(self.inputs.in_file, index_col=0)
-            df = pd.concat([formerdf, df], ignore_index=True)
+        if not (self.inputs.append and self._append_row(df)):
+            if op.exists(self.inputs.in_file):
+                formerdf = pd.read_csv(self.inputs.in_file, index_col=0)
+                df = pd.concat([formerdf, df], ignore_index=True)
 
-        with open(self.inputs.in_file, 'w') as f:
-            df.to_csv(f)
+            with open(self.inputs.in_file, 'w') as f:
+                df.to_csv(f)
 
         if self._have_lock:
             self._lock.release()
@@ -825,6 +855,31 @@ class AddCSVRow(BaseInterface):
 
         return runtime
 
+    def _append_row(self, df):
+        """Write df at the end of the file, returns False if it cannot"""
+        if not op.exists(self.inputs.in_file) or \
+                not op.getsize(self.inputs.in_file):
+            return False
+
+        with open(self.inputs.in_file, 'rb') as f:
+            columns = f.readline().decode('utf-8').rstrip('\r\n')
+            last = _last_line(f).decode('utf-8')
+
+        columns = columns.split(',')[1:]
+        if sorted(columns) != sorted(str(c) for c in df.columns):
+            return False
+        try:
+            df.index = [int(last.split(',')[0]) + 1]
+        except ValueError:
+            # header only, or an index that is not a row count
+            if last.rstrip('\r\n').split(',')[1:] != columns:
+                return False
+            df.index = [0]
+
+        with open(self.inputs.in_file, 'a') as f:
+            df[columns].to_csv(f, header=False)
+        return True
+
     def _list_outputs(self):
         outputs = self.output_spec().get()
         outputs['csv_file'] = self.inputs.in_file
@@ -837,6 +892,22 @@ class AddCSVRow(BaseInterface):
         return base
 
 
+def _last_line(f, blocksize=4096):
+    """Return the last non-empty line of a file open in binary mode"""
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    data = b''
+    while end > 0:
+        start = max(0, end - blocksize)
+        f.seek(start)
+        data = f.read(end - start) + data
+        lines = data.rstrip(b'\r\n').rsplit(b'\n', 1)
+        if len(lines) == 2 or start == 0:
+            return lines[-1]
+        end = start
+    return data
+
+
 class CalculateNormalizedMomentsInputSpec(TraitedSpec):
     timeseries_file = File(
         exists=True, mandatory=True,
@@ -1058,6 +1129,10 @@ class SplitROIsInputSpec(TraitedSpec):
     in_mask = File(exists=True, desc='only process files inside mask')
     roi_size = traits.Tuple(traits.Int, traits.Int, traits.Int,
                             desc='desired ROI size')
+    compress = traits.Bool(True, usedefault=True,
+                           desc=('gzip the ROIs, otherwise they are left as '
+                                 'uncompressed NIfTI files that can be '
+                                 'memory mapped'))
 
 
 class SplitROIsOutputSpec(TraitedSpec):
@@ -1098,7 +1173,7 @@ class SplitROIs(BaseInterface):
             roisize = self.inputs.roi_size
 
         res = split_rois(self.inputs.in_file,
-                         mask, roisize)
+                         mask, roisize, self.inputs.compress)
         self._outnames['out_files'] = res[0]
         self._outnames['out_masks'] = res[1]
         self._outnames['out_index'] = res[2]
@@ -1117,6 +1192,8 @@ class MergeROIsInputSpec(TraitedSpec):
     in_index = InputMultiPath(File(exists=True, mandatory=True),
                               desc='array keeping original locations')
     in_reference = File(exists=True, desc='reference file')
+    compress = traits.Bool(True, usedefault=True,
+                           desc='gzip the merged file')
 
 
 class MergeROIsOutputSpec(TraitedSpec):
@@ -1143,9 +1220,13 @@ class MergeROIs(BaseInterface):
     output_spec = MergeROIsOutputSpec
 
     def _run_interface(self, runtime):
+        out_file = op.abspath('merged.nii')
+        if self.inputs.compress:
+            out_file += '.gz'
         res = merge_rois(self.inputs.in_files,
                          self.inputs.in_index,
-                         self.inputs.in_reference)
+                         self.inputs.in_reference,
+                         out_file=out_file)
         self._merged = res
         return runtime
 
@@ -1215,13 +1296,20 @@ def normalize_tpms(in_files, in_mask=None, out_files=[]):
     return out_files
 
 
-def split_rois(in_file, mask=None, roishape=None):
+def split_rois(in_file, mask=None, roishape=None, compress=True,
+               block_bytes=None):
     """
     Splits an image in ROIs for parallel processing
+
+    The image is read a block of volumes at a time, and each block is
+    written into every ROI through a memory map of an uncompressed NIfTI
+    file, so neither the image nor the ROIs are ever loaded in memory.
+    Those files are the ROIs unless ``compress`` is set, in which case
+    they are gzipped once filled.
     """
     import nibabel as nb
     import numpy as np
-    from math import sqrt, ceil
+    from math import ceil
     import os.path as op
 
     if roishape is None:
@@ -1230,26 +1318,19 @@ def split_rois(in_file, mask=None, roishape=None):
     im = nb.load(in_file, mmap=NUMPY_MMAP)
     imshape = im.shape
     dshape = imshape[:3]
-    nvols = imshape[-1]
+    nvols = imshape[3] if len(imshape) > 3 else 1
     roisize = roishape[0] * roishape[1] * roishape[2]
     droishape = (roishape[0], roishape[1], roishape[2], nvols)
 
     if mask is not None:
-        mask = nb.load(mask, mmap=NUMPY_MMAP).get_data()
-        mask[mask > 0] = 1
-        mask[mask < 1] = 0
+        mask = nb.load(mask, mmap=NUMPY_MMAP).get_data() > 0
     else:
-        mask = np.ones(dshape)
+        mask = np.ones(dshape, dtype=bool)
 
-    mask = mask.reshape(-1).astype(np.uint8)
-    nzels = np.nonzero(mask)
-    els = np.sum(mask)
+    nzels = np.flatnonzero(mask)
+    els = len(nzels)
     nrois = int(ceil(els / float(roisize)))
 
-    data = im.get_data().reshape((mask.size, -1))
-    data = np.squeeze(data.take(nzels, axis=0))
-    nvols = data.shape[-1]
-
     roidefname = op.abspath('onesmask.nii.gz')
     nb.Nifti1Image(np.ones(roishape, dtype=np.uint8), None,
                    None).to_filename(roidefname)
@@ -1257,23 +1338,19 @@ def split_rois(in_file, mask=None, roishape=None):
     out_files = []
     out_mask = []
     out_idxs = []
+    offsets = []
+    dtype = np.asanyarray(im.dataobj[:1, :1, :1]).dtype
 
     for i in range(nrois):
         first = i * roisize
-        last = (i + 1) * roisize
-        fill = 0
+        last = min((i + 1) * roisize, els)
+        fill = (i + 1) * roisize - last
 
-        if last > els:
-            fill = last - els
-            last = els
-
-        droi = data[first:last, ...]
         iname = op.abspath('roi%010d_idx' % i)
         out_idxs.append(iname + '.npz')
-        np.savez(iname, (nzels[0][first:last],))
+        np.savez(iname, (nzels[first:last],))
 
         if fill > 0:
-            droi = np.vstack((droi, np.zeros((int(fill), int(nvols)), dtype=np.float32)))
             partialmsk = np.ones((roisize,), dtype=np.uint8)
             partialmsk[-int(fill):] = 0
             partname = op.abspath('partialmask.nii.gz')
@@ -1283,10 +1360,38 @@ def split_rois(in_file, mask=None, roishape=None):
         else:
             out_mask.append(roidefname)
 
-        fname = op.abspath('roi%010d.nii.gz' % i)
-        nb.Nifti1Image(droi.reshape(droishape),
-                       None, None).to_filename(fname)
+        fname = op.abspath('roi%010d.nii' % i)
+        offset, dtype = _create_nifti(fname, droishape, dtype)
         out_files.append(fname)
+        offsets.append(offset)
+
+    # voxels of a ROI are laid out in C order within roishape, as when
+    # ROIs were built by reshaping (roisize, nvols) arrays
+    coords = np.unravel_index(nzels, dshape)
+    roicoords = np.unravel_index(np.arange(roisize), roishape)
+    for volumes in iter_blocks(nvols, mask.size * dtype.itemsize,
+                               block_bytes):
+        start, stop = volumes.start, volumes.stop
+        if len(imshape) > 3:
+            block = np.asanyarray(im.dataobj[..., start:stop])
+        else:
+            block = np.asanyarray(im.dataobj)[..., np.newaxis]
+        values = block[coords]
+        del block
+
+        for i, (fname, offset) in enumerate(zip(out_files, offsets)):
+            first = i * roisize
+            last = min((i + 1) * roisize, els)
+            droi = np.memmap(fname, dtype=dtype, mode='r+',
+                             offset=offset + start * roisize * dtype.itemsize,
+                             shape=droishape[:3] + (stop - start, ),
+                             order='F')
+            droi[tuple(c[:last - first] for c in roicoords)] = \
+                values[first:last]
+            del droi
+
+    if compress:
+        out_files = [_gzip_file(fname) for fname in out_files]
     return out_files, out_mask, out_idxs
 
 
@@ -1294,11 +1399,14 @@ def merge_rois(in_files, in_idxs, in_ref,
                dtype=None, out_file=None):
     """
     Re-builds an image resulting from a parallelized processing
+
+    Each ROI is written, as it is read, into a memory map of the
+    uncompressed output file.  When ``out_file`` is gzipped, the image is
+    compressed from that file once all ROIs are in place.
     """
     import nibabel as nb
     import numpy as np
     import os.path as op
-    import subprocess as sp
 
     if out_file is None:
         out_file = op.abspath('merged.nii.gz')
@@ -1306,80 +1414,79 @@ def merge_rois(in_files, in_idxs, in_ref,
     if dtype is None:
         dtype = np.float32
 
-    # if file is compressed, uncompress using os
-    # to avoid memory errors
-    if op.splitext(in_ref)[1] == '.gz':
-        try:
-            iflogger.info('uncompress %i' % in_ref)
-            sp.check_call(['gunzip', in_ref], stdout=sp.PIPE, shell=True)
-            in_ref = op.splitext(in_ref)[0]
-        except:
-            pass
-
+    # only the header of the reference and the first ROI are read
     ref = nb.load(in_ref, mmap=NUMPY_MMAP)
-    aff = ref.affine
+    rsh = ref.shape[:3]
     hdr = ref.header.copy()
-    rsh = ref.shape
-    del ref
-    npix = rsh[0] * rsh[1] * rsh[2]
-    fcdata = nb.load(in_files[0]).get_data()
+    hdr.set_xyzt_units('mm', 'sec')
+    fcshape = nb.load(in_files[0], mmap=NUMPY_MMAP).shape
 
-    if fcdata.ndim == 4:
-        ndirs = fcdata.shape[-1]
+    if len(fcshape) == 4:
+        ndirs = fcshape[-1]
     else:
         ndirs = 1
     newshape = (rsh[0], rsh[1], rsh[2], ndirs)
-    hdr.set_data_dtype(dtype)
-    hdr.set_xyzt_units('mm', 'sec')
 
-    if ndirs < 300:
-        data = np.zeros((npix, ndirs))
-        for cname, iname in zip(in_files, in_idxs):
-            f = np.load(iname)
-            idxs = np.squeeze(f['arr_0'])
-            cdata = nb.load(cname, mmap=NUMPY_MMAP).get_data().reshape(-1, ndirs)
-            nels = len(idxs)
-            idata = (idxs, )
-            try:
-                data[idata, ...] = cdata[0:nels, ...]
-            except:
-                print(('Consistency between indexes and chunks was '
-                       'lost: data=%s, chunk=%s') % (str(data.shape),
-                                                     str(cdata.shape)))
-                raise
-
-        hdr.set_data_shape(newshape)
-        nb.Nifti1Image(data.reshape(newshape).astype(dtype),
-                       aff, hdr).to_filename(out_file)
+    raw_file = out_file
+    if out_file.endswith('.gz'):
+        raw_file = out_file[:-3]
+    offset, dtype = _create_nifti(raw_file, newshape, dtype, ref.affine, hdr)
+    del ref
+    data = np.memmap(raw_file, dtype=dtype, mode='r+', offset=offset,
+                     shape=newshape, order='F')
+
+    for cname, iname in zip(in_files, in_idxs):
+        f = np.load(iname)
+        idxs = np.ravel(f['arr_0'])
+        cdata = nb.load(cname, mmap=NUMPY_MMAP).get_data()
+        nels = len(idxs)
+        try:
+            croi = np.unravel_index(np.arange(nels), cdata.shape[:3])
+            data[np.unravel_index(idxs, rsh)] = \
+                cdata[croi].reshape(nels, ndirs)
+        except:
+            print(('Consistency between indexes and chunks was '
+                   'lost: data=%s, chunk=%s') % (str(newshape),
+                                                 str(cdata.shape)))
+            raise
+        del cdata
 
-    else:
-        hdr.set_data_shape(rsh[:3])
-        nii = []
-        for d in range(ndirs):
-            fname = op.abspath('vol%06d.nii' % d)
-            nb.Nifti1Image(np.zeros(rsh[:3]), aff, hdr).to_filename(fname)
-            nii.append(fname)
-
-        for cname, iname in zip(in_files, in_idxs):
-            f = np.load(iname)
-            idxs = np.squeeze(f['arr_0'])
-
-            for d, fname in enumerate(nii):
-                data = nb.load(fname, mmap=NUMPY_MMAP).get_data().reshape(-1)
-                cdata = nb.load(cname, mmap=NUMPY_MMAP).get_data().reshape(-1, ndirs)[:, d]
-                nels = len(idxs)
-                idata = (idxs, )
-                data[idata] = cdata[0:nels]
-                nb.Nifti1Image(data.reshape(rsh[:3]),
-                               aff, hdr).to_filename(fname)
-
-        imgs = [nb.load(im, mmap=NUMPY_MMAP) for im in nii]
-        allim = nb.concat_images(imgs)
-        allim.to_filename(out_file)
+    data.flush()
+    del data
 
+    if raw_file != out_file:
+        _gzip_file(raw_file)
     return out_file
 
 
+def _create_nifti(fname, shape, dtype, affine=None, header=None):
+    """
+    Writes the header of a NIfTI file with data of the given shape and
+    type, and grows the file to its full size without writing the data,
+    which is left to be filled through a memory map.
+
+    Returns the offset and byte ordered type of the data in the file.
+    """
+    fobj, dtype = open_nifti(fname, shape, dtype, affine, header)
+    with fobj:
+        offset = fobj.tell()
+        fobj.seek(offset + int(np.prod(shape)) * dtype.itemsize - 1)
+        fobj.write(b'\x00')
+    return offset, dtype
+
+
+def _gzip_file(fname):
+    """
+    Replaces a file by its gzipped copy, compressed at the same level as
+    nibabel uses, and returns the name of the copy.
+    """
+    with open(fname, 'rb') as fin, \
+            gzip.open(fname + '.gz', 'wb', compresslevel=1) as fout:
+        shutil.copyfileobj(fin, fout)
+    os.remove(fname)
+    return fname + '.gz'
+
+
 # Deprecated interfaces ------------------------------------------------------
 
 class Distance(nam.Distance):
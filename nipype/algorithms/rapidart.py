@@ -34,7 +34,7 @@ from ..interfaces.base import (BaseInterface, traits, InputMultiPath,
                                OutputMultiPath, TraitedSpec, File,
                                BaseInterfaceInputSpec, isdefined)
 from ..utils.filemanip import filename_to_list, save_json, split_filename
-from ..utils.misc import find_indices, normalize_mc_params
+from ..utils.misc import find_indices, normalize_mc_params, iter_blocks
 from .. import logging, config
 iflogger = logging.getLogger('interface')
 
@@ -50,34 +50,58 @@ def _get_affine_matrix(params, source):
         # nipy does not store typical euler angles, use nipy to convert
         from nipy.algorithms.registration import to_matrix44
         return to_matrix44(params)
+    return _get_affine_matrices(np.atleast_2d(params), source)[0]
+
+
+def _get_affine_matrices(params, source):
+    """Return one affine matrix per row of motion parameters
+
+    params : np.array [timepoints x parameters] in native package format
+    source : the package that generated the parameters
+             supports SPM, AFNI, FSFAST, FSL, NIPY
+
+    Returns a [timepoints x 4 x 4] array, matrix ``i`` being
+    ``_get_affine_matrix(params[i], source)``.
+    """
+    params = np.array(params, dtype=float, ndmin=2)
+    if source == 'NIPY':
+        return np.array([_get_affine_matrix(row, source) for row in params])
 
     params = normalize_mc_params(params, source)
     # process for FSL, SPM, AFNI and FSFAST
-    rotfunc = lambda x: np.array([[np.cos(x), np.sin(x)],
-                                  [-np.sin(x), np.cos(x)]])
+    n_rows, n_params = params.shape
     q = np.array([0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 0])
-    if len(params) < 12:
-        params = np.hstack((params, q[len(params):]))
-    params.shape = (len(params),)
+    if n_params < 12:
+        params = np.hstack((params, np.tile(q[n_params:], (n_rows, 1))))
+
+    def eye():
+        return np.tile(np.eye(4), (n_rows, 1, 1))
+
+    def rotation(x, i, j):
+        R = eye()
+        R[:, i, i] = R[:, j, j] = np.cos(x)
+        R[:, i, j] = np.sin(x)
+        R[:, j, i] = -np.sin(x)
+        return R
+
     # Translation
-    T = np.eye(4)
-    T[0:3, -1] = params[0:3]
+    T = eye()
+    T[:, 0:3, -1] = params[:, 0:3]
     # Rotation
-    Rx = np.eye(4)
-    Rx[1:3, 1:3] = rotfunc(params[3])
-    Ry = np.eye(4)
-    Ry[(0, 0, 2, 2), (0, 2, 0, 2)] = rotfunc(params[4]).ravel()
-    Rz = np.eye(4)
-    Rz[0:2, 0:2] = rotfunc(params[5])
+    Rx = rotation(params[:, 3], 1, 2)
+    Ry = rotation(params[:, 4], 0, 2)
+    Rz = rotation(params[:, 5], 0, 1)
     # Scaling
-    S = np.eye(4)
-    S[0:3, 0:3] = np.diag(params[6:9])
+    S = eye()
+    S[:, (0, 1, 2), (0, 1, 2)] = params[:, 6:9]
     # Shear
-    Sh = np.eye(4)
-    Sh[(0, 0, 1), (1, 2, 2)] = params[9:12]
+    Sh = eye()
+    Sh[:, (0, 0, 1), (1, 2, 2)] = params[:, 9:12]
     if source in ('AFNI', 'FSFAST'):
-        return np.dot(T, np.dot(Ry, np.dot(Rx, np.dot(Rz, np.dot(S, Sh)))))
-    return np.dot(T, np.dot(Rx, np.dot(Ry, np.dot(Rz, np.dot(S, Sh)))))
+        return np.matmul(T, np.matmul(Ry, np.matmul(
+            Rx, np.matmul(Rz, np.matmul(S, Sh)))))
+    return np.matmul(T, np.matmul(Rx, np.matmul(Ry, np.matmul(
+        Rz, np.matmul(S, Sh)))))
 
 
 def _calc_norm(mc, use_differences, source, brain_pts=None):
@@ -106,31 +130,24 @@ def _calc_norm(mc, use_differences, source, brain_pts=None):
         displacement = None
     else:
         all_pts = brain_pts
-    n_pts = all_pts.size - all_pts.shape[1]
-    newpos = np.zeros((mc.shape[0], n_pts))
+    timepoints = mc.shape[0]
+    # [timepoints x 3 x n_points] positions of the points in every volume
+    affines = _get_affine_matrices(mc, source)[:, 0:3, :]
+    newpos = np.dot(affines.reshape(-1, 4), all_pts).reshape(
+        timepoints, 3, all_pts.shape[1])
     if brain_pts is not None:
-        displacement = np.zeros((mc.shape[0], int(n_pts / 3)))
-    for i in range(mc.shape[0]):
-        affine = _get_affine_matrix(mc[i, :], source)
-        newpos[i, :] = np.dot(affine,
-                              all_pts)[0:3, :].ravel()
-        if brain_pts is not None:
-            displacement[i, :] = \
-                np.sqrt(np.sum(np.power(np.reshape(newpos[i, :],
-                                                   (3, all_pts.shape[1])) -
-                                        all_pts[0:3, :],
-                                        2),
-                               axis=0))
+        delta = newpos - all_pts[0:3]
+        displacement = np.sqrt(np.einsum('tin,tin->tn', delta, delta))
+        del delta
     # np.savez('displacement.npz', newpos=newpos, pts=all_pts)
-    normdata = np.zeros(mc.shape[0])
+    normdata = np.zeros(timepoints)
     if use_differences:
-        newpos = np.concatenate((np.zeros((1, n_pts)),
-                                 np.diff(newpos, n=1, axis=0)), axis=0)
-        for i in range(newpos.shape[0]):
-            normdata[i] = \
-                np.max(np.sqrt(np.sum(np.reshape(np.power(np.abs(newpos[i, :]), 2),
-                                                 (3, all_pts.shape[1])), axis=0)))
+        newpos = np.diff(newpos, n=1, axis=0)
+        if timepoints > 1:
+            normdata[1:] = np.sqrt(
+                np.einsum('tin,tin->tn', newpos, newpos)).max(axis=1)
     else:
+        newpos = newpos.reshape(timepoints, -1)
         newpos = np.abs(signal.detrend(newpos, axis=0, type='constant'))
         normdata = np.sqrt(np.mean(np.power(newpos, 2), axis=1))
     return normdata, displacement
@@ -145,9 +162,58 @@ def _nanmean(a, axis=None):
 
     """
     if axis:
-        return np.nansum(a, axis) / np.sum(1 - np.isnan(a), axis)
+        return np.nansum(a, axis) / np.sum(~np.isnan(a), axis)
     else:
-        return np.nansum(a) / np.sum(1 - np.isnan(a))
+        return np.nansum(a) / np.sum(~np.isnan(a))
+
+
+def _volume_blocks(data, block_bytes=None):
+    """Yield (slice, block) over the volumes of a 4D array
+
+    Each block holds as many whole volumes as fit in about `block_bytes`,
+    so that per volume statistics can be computed with array operations
+    without making temporary copies of a whole (possibly memory mapped)
+    series.
+    """
+    volume_bytes = data.dtype.itemsize * int(np.prod(data.shape[:-1]))
+    for volumes in iter_blocks(data.shape[-1], volume_bytes, block_bytes):
+        yield volumes, data[..., volumes]
+
+
+def _volume_means(data, mask=None, block_bytes=None):
+    """Return the mean of each volume of a 4D array, excluding items that
+    are nan
+
+    mask : boolean array selecting the voxels to average, either 3D (the
+           same voxels in every volume) or 4D (one mask per volume)
+
+    >>> data = np.arange(16.).reshape((2, 2, 1, 4))
+    >>> data[0, 0, 0, 0] = np.nan
+    >>> _volume_means(data).tolist()
+    [8.0, 7.0, 8.0, 9.0]
+    >>> _volume_means(data, data > 6).tolist()
+    [10.0, 11.0, 12.0, 11.0]
+
+    """
+    means = np.zeros(data.shape[-1])
+    for volumes, block in _volume_blocks(data, block_bytes):
+        if mask is not None and mask.ndim == 3:
+            block = block[mask]
+        keep = None
+        if mask is not None and mask.ndim == 4:
+            keep = mask[..., volumes]
+        if block.dtype.kind == 'f':
+            nans = np.isnan(block)
+            if nans.any():
+                keep = ~nans if keep is None else keep & ~nans
+        axes = tuple(range(block.ndim - 1))
+        if keep is None:
+            means[volumes] = (block.sum(axis=axes, dtype=np.float64) /
+                              (block.size // block.shape[-1]))
+        else:
+            means[volumes] = (np.where(keep, block, 0).sum(
+                axis=axes, dtype=np.float64) / keep.sum(axis=axes))
+    return means
 
 
 class ArtifactDetectInputSpec(BaseInterfaceInputSpec):
@@ -209,6 +275,11 @@ class ArtifactDetectInputSpec(BaseInterfaceInputSpec):
                                                   "for SPM and Nipy - currently"
                                                   "inaccurate for FSL, AFNI"),
                                      usedefault=True)
+    displacement_dtype = traits.Enum('float64', 'float32',
+                                     desc=("data type of the voxel "
+                                           "displacement images written "
+                                           "when bound_by_brainmask is True"),
+                                     usedefault=True)
     global_threshold = traits.Float(8.0, desc=("use this threshold when mask "
                                                "type equal's spm_global"),
                                     usedefault=True)
@@ -368,42 +439,30 @@ class ArtifactDetect(BaseInterface):
         if masktype == 'spm_global':  # spm_global like calculation
             iflogger.debug('art: using spm global')
             intersect_mask = self.inputs.intersect_mask
+            # Use an SPM like approach
+            thresholds = _volume_means(data) / self.inputs.global_threshold
             if intersect_mask:
                 mask = np.ones((x, y, z), dtype=bool)
-                for t0 in range(timepoints):
-                    vol = data[:, :, :, t0]
-                    # Use an SPM like approach
-                    mask_tmp = vol > \
-                        (_nanmean(vol) / self.inputs.global_threshold)
-                    mask = mask * mask_tmp
-                for t0 in range(timepoints):
-                    vol = data[:, :, :, t0]
-                    g[t0] = _nanmean(vol[mask])
-                if len(find_indices(mask)) < (np.prod((x, y, z)) / 10):
+                for volumes, block in _volume_blocks(data):
+                    mask &= np.all(block > thresholds[volumes], axis=3)
+                g[:, 0] = _volume_means(data, mask)
+                if np.count_nonzero(mask) < (np.prod((x, y, z)) / 10):
                     intersect_mask = False
                     g = np.zeros((timepoints, 1))
             if not intersect_mask:
                 iflogger.info('not intersect_mask is True')
-                mask = np.zeros((x, y, z, timepoints))
-                for t0 in range(timepoints):
-                    vol = data[:, :, :, t0]
-                    mask_tmp = vol > \
-                        (_nanmean(vol) / self.inputs.global_threshold)
-                    mask[:, :, :, t0] = mask_tmp
-                    g[t0] = np.nansum(vol * mask_tmp) / np.nansum(mask_tmp)
+                mask = data > thresholds
+                g[:, 0] = _volume_means(data, mask)
         elif masktype == 'file':  # uses a mask image to determine intensity
             maskimg = load(self.inputs.mask_file, mmap=NUMPY_MMAP)
             mask = maskimg.get_data()
             affine = maskimg.affine
             mask = mask > 0.5
-            for t0 in range(timepoints):
-                vol = data[:, :, :, t0]
-                g[t0] = _nanmean(vol[mask])
+            g[:, 0] = _volume_means(data, mask)
         elif masktype == 'thresh':  # uses a fixed signal threshold
-            for t0 in range(timepoints):
-                vol = data[:, :, :, t0]
-                mask = vol > self.inputs.mask_threshold
-                g[t0] = _nanmean(vol[mask])
+            g[:, 0] = _volume_means(data, data > self.inputs.mask_threshold)
+            # the mask written out is that of the last volume
+            mask = data[:, :, :, -1] > self.inputs.mask_threshold
         else:
             mask = np.ones((x, y, z))
             g = _nanmean(data[mask > 0, :], 1)
@@ -443,11 +502,9 @@ class ArtifactDetect(BaseInterface):
             tidx = find_indices(normval > self.inputs.norm_threshold)
             ridx = find_indices(normval < 0)
             if displacement is not None:
-                dmap = np.zeros((x, y, z, timepoints), dtype=np.float)
-                for i in range(timepoints):
-                    dmap[voxel_coords[0],
-                         voxel_coords[1],
-                         voxel_coords[2], i] = displacement[i, :]
+                dmap = np.zeros((x, y, z, timepoints),
+                                dtype=self.inputs.displacement_dtype)
+                dmap[voxel_coords[0:3]] = displacement.T
                 dimg = Nifti1Image(dmap, affine)
                 dimg.to_filename(displacementfile)
         else:
@@ -13,10 +13,14 @@ def test_ACompCor_inputs():
     mask_file=dict(),
     num_components=dict(usedefault=True,
     ),
+    positive_loadings=dict(usedefault=True,
+    ),
     realigned_file=dict(mandatory=True,
     ),
     regress_poly_degree=dict(usedefault=True,
     ),
+    svd_method=dict(usedefault=True,
+    ),
     use_regress_poly=dict(usedefault=True,
     ),
     )
@@ -6,6 +6,8 @@ from ..rapidart import ArtifactDetect
 def test_ArtifactDetect_inputs():
     input_map = dict(bound_by_brainmask=dict(usedefault=True,
     ),
+    displacement_dtype=dict(usedefault=True,
+    ),
     global_threshold=dict(usedefault=True,
     ),
     ignore_exception=dict(nohash=True,
@@ -0,0 +1,38 @@
+# AUTO-GENERATED by tools/checkspecs.py - DO NOT EDIT
+from __future__ import unicode_literals
+from ..metrics import BatchOverlap
+
+
+def test_BatchOverlap_inputs():
+    input_map = dict(bg_overlap=dict(usedefault=True,
+    ),
+    ignore_exception=dict(nohash=True,
+    usedefault=True,
+    ),
+    in_ref=dict(mandatory=True,
+    ),
+    in_tst=dict(mandatory=True,
+    ),
+    labels=dict(),
+    mask_volume=dict(),
+    out_file=dict(usedefault=True,
+    ),
+    pair_ids=dict(),
+    vol_units=dict(usedefault=True,
+    ),
+    )
+    inputs = BatchOverlap.input_spec()
+
+    for key, metadata in list(input_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(inputs.traits()[key], metakey) == value
+
+
+def test_BatchOverlap_outputs():
+    output_map = dict(out_file=dict(),
+    )
+    outputs = BatchOverlap.output_spec()
+
+    for key, metadata in list(output_map.items()):
+        for metakey, value in list(metadata.items()):
+            assert getattr(outputs.traits()[key], metakey) == value
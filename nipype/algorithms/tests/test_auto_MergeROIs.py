@@ -4,7 +4,9 @@ from ..misc import MergeROIs
 
 
 def test_MergeROIs_inputs():
-    input_map = dict(in_files=dict(),
+    input_map = dict(compress=dict(usedefault=True,
+    ),
+    in_files=dict(),
     in_index=dict(),
     in_reference=dict(),
     )
@@ -4,7 +4,9 @@ from ..misc import SplitROIs
 
 
 def test_SplitROIs_inputs():
-    input_map = dict(in_file=dict(mandatory=True,
+    input_map = dict(compress=dict(usedefault=True,
+    ),
+    in_file=dict(mandatory=True,
     ),
     in_mask=dict(),
     roi_size=dict(),
@@ -15,10 +15,14 @@ def test_TCompCor_inputs():
     ),
     percentile_threshold=dict(usedefault=True,
     ),
+    positive_loadings=dict(usedefault=True,
+    ),
     realigned_file=dict(mandatory=True,
     ),
     regress_poly_degree=dict(usedefault=True,
     ),
+    svd_method=dict(usedefault=True,
+    ),
     use_regress_poly=dict(usedefault=True,
     ),
     )
@@ -40,10 +44,14 @@ def test_TCompCor_outputs():
     mask_file=dict(),
     num_components=dict(usedefault=True,
     ),
+    positive_loadings=dict(usedefault=True,
+    ),
     realigned_file=dict(mandatory=True,
     ),
     regress_poly_degree=dict(usedefault=True,
     ),
+    svd_method=dict(usedefault=True,
+    ),
     use_regress_poly=dict(usedefault=True,
     ),
     )
@@ -7,6 +7,7 @@ import numpy as np
 
 import pytest
 from ...testing import utils
+from .. import confounds
 from ..confounds import CompCor, TCompCor, ACompCor
 
 
@@ -69,6 +70,41 @@ class TestCompCor():
                                                       ['-0.5367548139', '0.0059943226'],
                                                       ['-0.0520809054', '0.2940637551']])
 
+    def test_compcor_gram(self, monkeypatch):
+        # stream the data through the Gram matrix a few voxels at a time
+        iter_slabs = confounds._iter_slabs
+        monkeypatch.setattr(confounds, '_iter_slabs',
+                            lambda timecourses: iter_slabs(timecourses, 8 * 40 * 50))
+        rng = np.random.RandomState(0)
+        signals = rng.randn(40, 3)
+        data = rng.randn(10, 10, 12, 40) + rng.randn(10, 10, 12, 3).dot(signals.T) * 3
+        realigned_file = utils.save_toy_nii(data, 'large.nii')
+        mask_file = utils.save_toy_nii((rng.rand(10, 10, 12) > .3).astype(np.uint8),
+                                       'large_mask.nii')
+
+        components = []
+        for svd_method in ['svd', 'gram']:
+            CompCor(realigned_file=realigned_file, mask_file=mask_file,
+                    components_file=svd_method + '.txt', svd_method=svd_method,
+                    positive_loadings=True).run()
+            components.append(np.loadtxt(svd_method + '.txt', skiprows=1))
+        assert components[1].shape == (40, 6)
+        # with positive_loadings, both methods give the components the same sign
+        assert np.allclose(components[0], components[1], atol=1e-6)
+
+    def test_tcompcor_detrended_std(self, monkeypatch):
+        # accumulate the standard deviations a few volumes at a time
+        iter_volume_blocks = confounds._iter_volume_blocks
+        monkeypatch.setattr(confounds, '_iter_volume_blocks',
+                            lambda filenames: iter_volume_blocks(filenames, 8 * 1000 * 3))
+        rng = np.random.RandomState(0)
+        data = 1000 + rng.randn(10, 10, 10, 20) + np.arange(20) * .5
+        realigned_file = utils.save_toy_nii(data, 'drift.nii')
+        mask = rng.rand(10, 10, 10) > .5
+        expected = np.std(confounds.regress_poly(2, data[mask]), axis=-1)
+        assert np.allclose(confounds._detrended_std(realigned_file, mask, 2),
+                           expected)
+
     def test_tcompcor_asymmetric_dim(self):
         asymmetric_shape = (2, 3, 4, 5)
         asymmetric_data = utils.save_toy_nii(np.zeros(asymmetric_shape), 'asymmetric.nii')
@@ -7,7 +7,9 @@ from io import open
 import pytest
 from nipype.testing import example_data
 from nipype.algorithms.confounds import FramewiseDisplacement, ComputeDVARS, \
-    _is_outlier
+    BatchFramewiseDisplacement, _is_outlier, _ar1_yule_walker, compute_fd, \
+    _load_motion_params
+from nipype.utils.misc import normalize_mc_params
 import numpy as np
 
 
@@ -36,7 +38,77 @@ def test_fd(tmpdir):
     assert np.abs(ground_truth.mean() - res.outputs.fd_average) < 1e-2
 
 
-@pytest.mark.skipif(nonitime, reason="nitime is not installed")
+@pytest.mark.parametrize('source, n_params',
+                         [('FSL', 6), ('SPM', 6), ('AFNI', 6), ('AFNI', 7),
+                          ('FSFAST', 10)])
+def test_compute_fd(source, n_params):
+    mpars = np.random.RandomState(0).randn(40, n_params)
+    normalized = np.array([normalize_mc_params(row, source)
+                           for row in mpars])
+    diff = normalized[:-1, :6] - normalized[1:, :6]
+    diff[:, 3:6] *= 40
+    assert np.allclose(compute_fd(mpars, source, 40),
+                       np.abs(diff).sum(axis=1))
+
+
+def test_batch_fd(tmpdir):
+    tmpdir.chdir()
+    movpar = np.loadtxt(example_data('fsl_mcflirt_movpar.txt'))
+    in_files = []
+    for i, rows in enumerate([slice(None), slice(100), slice(100, 102)]):
+        in_files.append('run%d.par' % i)
+        np.savetxt(in_files[-1], movpar[rows])
+    # comments are left to np.loadtxt
+    with open(in_files[0], 'a') as fid:
+        fid.write('# end of run\n')
+
+    res = BatchFramewiseDisplacement(in_files=in_files, parameter_source='FSL',
+                                     run_ids=['a', 'b', 'c']).run()
+    with open(res.outputs.out_file) as fid:
+        assert next(fid) == 'run,volume,framewise_displacement\n'
+        table = [line.strip().split(',') for line in fid]
+    assert [row[0] for row in table] == ['a'] * 364 + ['b'] * 99 + ['c']
+    assert [row[1] for row in table[364:366]] == ['1', '2']
+
+    for i, in_file in enumerate(in_files):
+        single = FramewiseDisplacement(in_file=in_file, parameter_source='FSL',
+                                       out_file='fd%d.txt' % i).run()
+        fd = np.loadtxt(single.outputs.out_file, skiprows=1, ndmin=1)
+        run = [float(row[2]) for row in table if row[0] == 'abc'[i]]
+        assert np.allclose(run, fd)
+        assert np.isclose(res.outputs.fd_average[i],
+                          single.outputs.fd_average)
+
+    np.savetxt('single.par', movpar[:1])
+    with pytest.raises(ValueError):
+        BatchFramewiseDisplacement(in_files=['single.par'],
+                                   parameter_source='FSL').run()
+
+
+def test_batch_fd_quoting(tmpdir):
+    import csv
+    tmpdir.chdir()
+    movpar = np.loadtxt(example_data('fsl_mcflirt_movpar.txt'))
+    np.savetxt('run.par', movpar[:3])
+    res = BatchFramewiseDisplacement(in_files=['run.par'],
+                                     parameter_source='FSL',
+                                     run_ids=['sub-01, run 1']).run()
+    with open(res.outputs.out_file) as fid:
+        table = list(csv.reader(fid))
+    assert [row[:2] for row in table[1:]] == [['sub-01, run 1', '1'],
+                                              ['sub-01, run 1', '2']]
+
+
+def test_load_motion_params(tmpdir):
+    tmpdir.chdir()
+    movpar = np.loadtxt(example_data('fsl_mcflirt_movpar.txt'))
+    # a commented header line is skipped
+    np.savetxt('movpar.txt', movpar[:5], header='rx ry rz tx ty tz')
+    assert np.allclose(_load_motion_params('movpar.txt'), movpar[:5])
+    np.savetxt('movpar.txt', movpar[:1])
+    assert _load_motion_params('movpar.txt').shape == (1, 6)
+
+
 def test_dvars(tmpdir):
     ground_truth = np.loadtxt(example_data('ds003_sub-01_mc.DVARS'))
     dvars = ComputeDVARS(in_file=example_data('ds003_sub-01_mc.nii.gz'),
@@ -66,6 +138,17 @@ def test_dvars(tmpdir):
 
     assert (np.abs(dv1[:, 2] - ground_truth[:, 2]).sum() / len(dv1)) < 0.05
 
+
+@pytest.mark.skipif(nonitime, reason="nitime is not installed")
+def test_ar1_yule_walker():
+    from nitime.algorithms import AR_est_YW
+    np.random.seed(0)
+    data = np.random.randn(50, 200).astype(np.float32)
+    data[:, 1:] += 0.6 * data[:, :-1]
+    expected = [AR_est_YW(row - row.mean(), 1)[0][0] for row in data]
+    assert np.allclose(_ar1_yule_walker(data), expected, rtol=1e-5)
+
+
 def test_outliers(tmpdir):
     np.random.seed(0)
     in_data = np.random.randn(100)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+import nibabel as nb
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+from nipype.algorithms.metrics import Distance
+
+
+@pytest.fixture(params=['diagonal', 'oblique'])
+def masks(request, tmpdir):
+    tmpdir.chdir()
+    rng = np.random.RandomState(0)
+    data1 = np.zeros((12, 14, 10), dtype=np.uint8)
+    data1[2:6, 3:10, 2:8] = 1
+    data2 = (rng.rand(12, 14, 10) > 0.9).astype(np.uint8)
+    data2[7:11, 4:12, 3:9] = 1
+    data2[2:6, 3:10, 2:8] = 0
+    data2 *= rng.randint(1, 4, size=data2.shape).astype(np.uint8)
+    if request.param == 'diagonal':
+        affine = np.diag([2., -1.5, 3., 1.])
+    else:
+        affine = np.array([[1.5, 0.2, 0., -10.], [0., 2., 0.3, 4.],
+                           [0.1, 0., 2.5, 0.], [0., 0., 0., 1.]])
+    nb.Nifti1Image(data1, affine).to_filename('mask1.nii')
+    nb.Nifti1Image(data2, affine).to_filename('mask2.nii')
+    return 'mask1.nii', 'mask2.nii'
+
+
+def _coordinates(dist, fname, border=True):
+    nii = nb.load(fname)
+    data = nii.get_data().astype(bool)
+    if border:
+        data = dist._find_border(data)
+    return dist._get_coordinates(data, nii.affine).T
+
+
+def test_distance_min_max(masks):
+    dist = Distance()
+    set1 = _coordinates(dist, masks[0])
+    set2 = _coordinates(dist, masks[1])
+    distances = cdist(set1, set2)
+
+    res = Distance(volume1=masks[0], volume2=masks[1],
+                   method='eucl_min').run()
+    assert res.outputs.distance == distances.min()
+    point1, point2 = np.unravel_index(np.argmin(distances), distances.shape)
+    assert np.array_equal(res.outputs.point1, set1[point1])
+    assert np.array_equal(res.outputs.point2, set2[point2])
+
+    res = Distance(volume1=masks[0], volume2=masks[1],
+                   method='eucl_max').run()
+    assert res.outputs.distance == max(distances.min(axis=0).max(),
+                                       distances.min(axis=1).max())
+
+
+def test_distance_min_distances(masks):
+    dist = Distance()
+    distances = cdist(_coordinates(dist, masks[0]),
+                      _coordinates(dist, masks[1], border=False))
+    mins = dist._min_distances(nb.load(masks[0]), nb.load(masks[1]))
+    assert np.allclose(mins, distances.min(axis=0))
+
+
+def test_distance_eucl_mean(masks):
+    pytest.importorskip('matplotlib')
+    dist = Distance()
+    distances = cdist(_coordinates(dist, masks[0]),
+                      _coordinates(dist, masks[1], border=False))
+    mins = distances.min(axis=0)
+
+    res = Distance(volume1=masks[0], volume2=masks[1],
+                   method='eucl_mean').run()
+    assert np.isclose(res.outputs.distance, mins.mean())
+
+    data2 = nb.load(masks[1]).get_data()
+    res = Distance(volume1=masks[0], volume2=masks[1],
+                   method='eucl_wmean').run()
+    assert np.isclose(res.outputs.distance,
+                      np.average(mins, weights=data2[data2 > 0]))
+
+
+@pytest.mark.parametrize('masks', ['diagonal'], indirect=True)
+def test_distance_border_distances(masks):
+    dist = Distance()
+    nii1, nii2 = nb.load(masks[0]), nb.load(masks[1])
+    data1 = nii1.get_data().astype(bool)
+    data2 = nii2.get_data().astype(bool)
+    assert dist._same_axis_aligned_grid(nii1, nii2, data2)
+    mins = dist._border_distances(dist._find_border(data1), data2,
+                                  nii1.affine)
+    distances = cdist(_coordinates(dist, masks[0]),
+                      _coordinates(dist, masks[1], border=False))
+    assert np.array_equal(mins, distances.min(axis=0))
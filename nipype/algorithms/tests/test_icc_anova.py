@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 import numpy as np
-from nipype.algorithms.icc import ICC_rep_anova
+import nibabel as nb
+from nipype.algorithms.icc import ICC, ICC_rep_anova
 
 
 def test_ICC_rep_anova():
@@ -20,3 +21,41 @@ def test_ICC_rep_anova():
     assert dfc == 3
     assert dfe == 15
     assert np.isclose(r_var / (r_var + e_var), icc)
+
+
+def test_ICC_rep_anova_stack():
+    rng = np.random.RandomState(0)
+    Y = rng.randn(50, 6, 3) + rng.randn(50, 6, 1)
+    stats = ICC_rep_anova(Y)
+    assert stats[4:] == (2, 10)
+    for x in range(Y.shape[0]):
+        single = ICC_rep_anova(Y[x])
+        assert np.allclose([stat[x] for stat in stats[:4]], single[:4])
+
+
+def test_ICC(tmpdir):
+    tmpdir.chdir()
+    rng = np.random.RandomState(0)
+    subject = rng.randn(4, 5, 3)
+    subjects_sessions = []
+    for i in range(6):
+        subjects_sessions.append([])
+        for j in range(2):
+            fname = 'sub%d_ses%d.nii' % (i, j)
+            data = subject + rng.randn(4, 5, 3)
+            if i == j == 0:
+                # an integer first session must not truncate the others
+                data = np.round(data).astype(np.int16)
+            nb.Nifti1Image(data, np.eye(4)).to_filename(fname)
+            subjects_sessions[-1].append(fname)
+    mask = np.ones((4, 5, 3), dtype=np.uint8)
+    mask[0] = 0
+    nb.Nifti1Image(mask, np.eye(4)).to_filename('mask.nii')
+
+    res = ICC(subjects_sessions=subjects_sessions, mask='mask.nii').run()
+    icc_map = nb.load(res.outputs.icc_map).get_data()
+    assert np.all(icc_map[0] == 0)
+    Y = np.stack([np.stack([nb.load(f).get_data() for f in sessions], -1)
+                  for sessions in subjects_sessions], -2)
+    for voxel in zip(*np.nonzero(mask)):
+        assert np.isclose(icc_map[voxel], ICC_rep_anova(Y[voxel])[0])
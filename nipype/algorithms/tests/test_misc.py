@@ -32,3 +32,64 @@ def test_CreateNifti(create_analyze_pair_file_in_directory):
 
     assert os.path.exists(result.outputs.nifti_file)
     assert nb.load(result.outputs.nifti_file)
+
+
+def test_AddCSVRow_append(tmpdir):
+    pd = pytest.importorskip('pandas')
+    tmpdir.chdir()
+    for append in [False, True]:
+        in_file = str(tmpdir.join('scores_%s.csv' % append))
+        for i in range(5):
+            addrow = misc.AddCSVRow(in_file=in_file, append=append)
+            addrow.inputs.subject_id = 'S%d' % i
+            addrow.inputs.values = [i, 0.5 * i]
+            addrow.run()
+        # a row with a new column rewrites the file
+        addrow = misc.AddCSVRow(in_file=in_file, append=append)
+        addrow.inputs.subject_id = 'S5'
+        addrow.inputs.extra = 1
+        addrow.run()
+
+    rewritten = pd.read_csv(str(tmpdir.join('scores_False.csv')), index_col=0)
+    appended = pd.read_csv(str(tmpdir.join('scores_True.csv')), index_col=0)
+    assert list(appended.index) == list(range(6))
+    assert appended.equals(rewritten)
+
+
+def test_MergeCSVFiles(tmpdir):
+    tmpdir.chdir()
+    in_files = []
+    for i in range(3):
+        in_files.append(str(tmpdir.join('sub%d.csv' % i)))
+        with open(in_files[-1], 'w') as fid:
+            if i == 2:
+                # headers and row labels are skipped
+                fid.write('roi,value\n')
+                fid.writelines('r%d,%d.25\n' % (j, j + i) for j in range(4))
+            else:
+                # comments are skipped, as by np.loadtxt
+                fid.write('# values of sub%d\n' % i)
+                fid.writelines('%d.25  # roi %d\n' % (j + i, j)
+                               for j in range(4))
+
+    merge = misc.MergeCSVFiles(in_files=in_files,
+                               column_headings=['a', 'b', 'c'],
+                               row_headings=['w', 'x', 'y', 'z'],
+                               extra_field='ctrl')
+    res = merge.run()
+    with open(res.outputs.csv_file) as fid:
+        lines = fid.read().splitlines()
+    assert lines[0] == '"label","a","b","c","type"'
+    assert lines[1] == '"w",0.250000,1.250000,2.250000,ctrl'
+    assert lines[4] == '"z",3.250000,4.250000,5.250000,ctrl'
+
+    merge = misc.MergeCSVFiles(in_files=in_files[:2],
+                               row_headings=['w', 'x'])
+    with pytest.raises(ValueError):
+        merge.run()
+
+
+def test_maketypelist_deprecated():
+    with pytest.deprecated_call():
+        typelist = misc.maketypelist(True, (4, 2), True, 'type')
+    assert [name for name, _ in typelist] == ['heading', '1', '2', 'type']
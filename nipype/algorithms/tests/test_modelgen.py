@@ -157,3 +157,17 @@ def test_modelgen_sparse(tmpdir):
     npt.assert_almost_equal(res.outputs.session_info[0]['regress'][0]['val'][0], 0.016675298129743384)
     npt.assert_almost_equal(res.outputs.session_info[1]['regress'][1]['val'][5], 0.007671459162258378)
 
+
+def test_modelgen_sparse_boxcars():
+    s = SpecifySparseModel(time_repetition=6, time_acquisition=2,
+                           stimuli_as_impulses=False, model_hrf=False,
+                           scale_regressors=False)
+    # 200 ms time bins: overlapping boxcars in the first scan, a boxcar
+    # of default duration (one acquisition) starting at 6.4 s in the
+    # second one and a boxcar running past the end of the run in the last
+    reg = s._gen_regress([0, 1, 6.5, 13], [4, 2, 0, 10], [1, 2, 3, 1], 3)
+    npt.assert_almost_equal(reg, [2.0, 2.4, 0.5])
+
+    s.inputs.stimuli_as_impulses = True
+    reg = s._gen_regress([0, 0, 1.7, 6.5], [1], [2], 2)
+    npt.assert_almost_equal(reg, [0.6, 0.2])
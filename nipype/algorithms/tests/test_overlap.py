@@ -5,9 +5,12 @@
 
 import os
 
+import pytest
+from nipype.interfaces.base import TraitError
 from nipype.testing import (example_data)
 
 import numpy as np
+import numpy.testing as npt
 
 
 def test_overlap(tmpdir):
@@ -42,3 +45,71 @@ def test_overlap(tmpdir):
     check_close(res.outputs.roi_voldiff,
                 np.array([0.0063086, -0.0025506, 0.0]))
 
+
+def test_batch_overlap(tmpdir):
+    from nipype.algorithms.metrics import Overlap, BatchOverlap
+
+    in1 = example_data('segmentation0.nii.gz')
+    in2 = example_data('segmentation1.nii.gz')
+
+    os.chdir(str(tmpdir))
+    res = Overlap(volume1=in1, volume2=in2).run()
+    batch = BatchOverlap(in_ref=[in1, in2], in_tst=[in2, in2],
+                         pair_ids=['sub-01', 'sub-02']).run()
+    with open(batch.outputs.out_file) as fid:
+        pairs = [line.split(',')[0] for line in fid.readlines()[1:]]
+    assert pairs == ['sub-01'] * 3 + ['sub-02'] * 3
+    table = np.genfromtxt(batch.outputs.out_file, delimiter=',', names=True)
+    assert table['label'].tolist() == res.outputs.labels * 2
+    npt.assert_almost_equal(table['dice'][:3], res.outputs.roi_di, 6)
+    npt.assert_almost_equal(table['jaccard'][:3], res.outputs.roi_ji, 6)
+    npt.assert_almost_equal(
+        (table['ref_volume'] - table['tst_volume'])[:3] /
+        table['ref_volume'][:3], res.outputs.roi_voldiff)
+    npt.assert_equal(table['dice'][3:], 1)
+    npt.assert_equal(table['volume_similarity'][3:], 1)
+
+    batch = BatchOverlap(in_ref=[in1], in_tst=[in2], labels=[1, 7],
+                         bg_overlap=True).run()
+    table = np.genfromtxt(batch.outputs.out_file, delimiter=',', names=True)
+    assert table['label'].tolist() == [0, 1, 7]
+    npt.assert_almost_equal(table['dice'][1], res.outputs.roi_di[0], 6)
+    npt.assert_equal(table[2].tolist()[2:], [0] * 5)
+
+    with pytest.raises(TraitError):
+        BatchOverlap(labels=[-1])
+
+
+def test_batch_overlap_quoting(tmpdir):
+    import csv
+    from nipype.algorithms.metrics import BatchOverlap
+
+    tmpdir.chdir()
+    in1 = example_data('segmentation0.nii.gz')
+    batch = BatchOverlap(in_ref=[in1], in_tst=[in1], labels=[1],
+                         pair_ids=['sub-01, "ses" 1']).run()
+    with open(batch.outputs.out_file) as fid:
+        table = list(csv.reader(fid))
+    assert table[1][:2] == ['sub-01, "ses" 1', '1']
+
+
+def test_label_overlap():
+    from nipype.algorithms.metrics import _label_overlap
+
+    # negative values are not label 0
+    data1 = np.array([-1, 0, 0, 1, 2, 5])
+    data2 = np.array([0, -1, 0, 1, 1, 5])
+    volumes1, volumes2, both = _label_overlap(data1, data2, [0, 1, 2])
+    npt.assert_equal(volumes1, [2, 1, 1])
+    npt.assert_equal(volumes2, [2, 2, 0])
+    npt.assert_equal(both, [1, 1, 0])
+
+
+def test_label_data():
+    import nibabel as nb
+    from nipype.algorithms.metrics import _label_data
+
+    # negative and NaN values of float maps are not label 0 either
+    data = np.array([[[-0.4, 0., np.nan, 1., 2.9999]]], dtype=np.float32)
+    nii = nb.Nifti1Image(data, np.eye(4))
+    npt.assert_equal(_label_data(nii).ravel(), [-1, 0, -1, 1, 3])
@@ -3,7 +3,9 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 from __future__ import division
 
+import nibabel as nb
 import numpy as np
+import pytest
 
 import numpy.testing as npt
 from .. import rapidart as ra
@@ -67,6 +69,100 @@ def test_ad_get_norm():
     npt.assert_almost_equal(norm, np.array([0., 143.72192614, 173.92527131]))
 
 
+def test_ad_get_affine_matrices():
+    rng = np.random.RandomState(0)
+    for source, n_params in [('SPM', 6), ('FSL', 6), ('AFNI', 6),
+                             ('AFNI', 7), ('FSFAST', 6), ('SPM', 12)]:
+        params = rng.randn(5, n_params)
+        matrices = ra._get_affine_matrices(params, source)
+        assert matrices.shape == (5, 4, 4)
+        for row, matrix in zip(params, matrices):
+            npt.assert_equal(matrix, ra._get_affine_matrix(row, source))
+
+
+def test_ad_get_norm_sources():
+    params = np.array([[0.1, -0.2, 0.3, 0.01, -0.02, 0.03],
+                       [0.5, 0.1, -0.4, -0.03, 0.02, 0.01],
+                       [-0.3, 0.6, 0.2, 0.02, 0.04, -0.05]])
+    # reference values from the per-timepoint implementation
+    norm, _ = ra._calc_norm(params, False, 'FSL')
+    npt.assert_almost_equal(norm, [16.48385806, 19.29158094, 17.28357275])
+    norm, _ = ra._calc_norm(params, True, 'FSL')
+    npt.assert_almost_equal(norm, [0., 86.05164815, 90.20645281])
+    norm, _ = ra._calc_norm(params, False, 'AFNI')
+    npt.assert_almost_equal(norm, [0.27551074, 0.36124173, 0.40177656])
+    norm, _ = ra._calc_norm(params, True, 'AFNI')
+    npt.assert_almost_equal(norm, [0., 1.01270636, 1.86279238])
+
+    brain_pts = np.array([[10., -20., 0.], [30., 5., -40.], [0., 12., 25.],
+                          [1., 1., 1.]])
+    norm, displacement = ra._calc_norm(params, True, 'SPM',
+                                       brain_pts=brain_pts)
+    npt.assert_almost_equal(norm, [0., 3.2427108, 3.72131219])
+    npt.assert_almost_equal(displacement,
+                            [[1.13938219, 0.53698302, 1.73543439],
+                             [0.84889586, 0.8118589, 1.82828825],
+                             [2.22916399, 0.92948985, 3.06772333]])
+
+
+@pytest.mark.parametrize('mask_type, intersect_mask', [
+    ('spm_global', True), ('spm_global', False), ('file', True),
+    ('thresh', True)])
+def test_ad_global_intensity(tmpdir, mask_type, intersect_mask):
+    tmpdir.chdir()
+    rng = np.random.RandomState(0)
+    data = 100 + 10 * rng.randn(6, 5, 4, 12)
+    data[:2] = rng.rand(2, 5, 4, 12)
+    data[3, 2, 1, 4] = np.nan
+    nb.Nifti1Image(data, np.eye(4)).to_filename('func.nii')
+    mask = rng.rand(6, 5, 4) > 0.5
+    nb.Nifti1Image(mask.astype(np.uint8), np.eye(4)).to_filename('mask.nii')
+    np.savetxt('func.par', 0.01 * rng.randn(12, 6))
+
+    ad = ra.ArtifactDetect(realigned_files='func.nii',
+                           realignment_parameters='func.par',
+                           parameter_source='FSL', norm_threshold=1,
+                           zintensity_threshold=3, save_plot=False,
+                           mask_type=mask_type, mask_file='mask.nii',
+                           mask_threshold=50., intersect_mask=intersect_mask,
+                           bound_by_brainmask=True,
+                           displacement_dtype='float32')
+    res = ad.run()
+
+    # per volume computation the vectorized one replaced
+    g = np.zeros(12)
+    masks = []
+    for t in range(12):
+        vol = data[..., t]
+        if mask_type == 'spm_global':
+            masks.append(vol > ra._nanmean(vol) / 8.)
+        elif mask_type == 'thresh':
+            masks.append(vol > 50.)
+        else:
+            masks.append(mask)
+    if intersect_mask:
+        expected_mask = np.all(masks, axis=0) if mask_type == 'spm_global' \
+            else masks[-1]
+        if mask_type == 'spm_global':
+            masks = [expected_mask] * 12
+    else:
+        expected_mask = np.stack(masks, axis=-1)
+    for t in range(12):
+        g[t] = ra._nanmean(data[..., t][masks[t]])
+
+    npt.assert_allclose(np.loadtxt(res.outputs.intensity_files), g,
+                        atol=0.006)
+    out_mask = nb.load(res.outputs.mask_files).get_data()
+    npt.assert_equal(out_mask, expected_mask.astype(np.uint8))
+    dmap = nb.load(res.outputs.displacement_files).get_data()
+    assert dmap.dtype == np.float32
+    assert dmap.shape == data.shape
+    if out_mask.ndim == 4:
+        out_mask = out_mask.any(axis=3)
+    assert np.all(dmap[out_mask == 0] == 0)
+    assert np.all(dmap[out_mask > 0].any(axis=1))
+
+
 def test_sc_init():
     sc = ra.StimulusCorrelation(concatenated_design=True)
     assert sc.inputs.concatenated_design
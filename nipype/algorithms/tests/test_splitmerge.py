@@ -1,11 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-
+import pytest
 from nipype.testing import example_data
 from nipype.utils import NUMPY_MMAP
 
 
-def test_split_and_merge(tmpdir):
+@pytest.mark.parametrize('compress', [True, False])
+def test_split_and_merge(tmpdir, compress):
     import numpy as np
     import nibabel as nb
     import os.path as op
@@ -24,10 +25,61 @@ def test_split_and_merge(tmpdir):
     nb.Nifti1Image(dwdata.astype(np.float32),
                    aff, None).to_filename(dwfile)
 
-    resdw, resmsk, resid = split_rois(dwfile, in_mask, roishape=(20, 20, 2))
+    resdw, resmsk, resid = split_rois(dwfile, in_mask, roishape=(20, 20, 2),
+                                      compress=compress)
+    assert all(f.endswith('.nii.gz') == compress for f in resdw)
     merged = merge_rois(resdw, resid, in_mask)
     dwmerged = nb.load(merged, mmap=NUMPY_MMAP).get_data()
 
     dwmasked = dwdata * mskdata[:, :, :, np.newaxis]
 
     assert np.allclose(dwmasked, dwmerged)
+
+
+def test_split_and_merge_blocks(tmpdir):
+    import numpy as np
+    import nibabel as nb
+
+    from nipype.algorithms.misc import SplitROIs, MergeROIs, split_rois
+
+    tmpdir.chdir()
+    rng = np.random.RandomState(0)
+    data = rng.randint(0, 1000, size=(7, 6, 5, 10)).astype(np.int16)
+    mask = rng.rand(7, 6, 5) > 0.3
+    affine = np.diag([2., 2., 2., 1.])
+    nb.Nifti1Image(data, affine).to_filename('dwi.nii')
+    nb.Nifti1Image(mask.astype(np.uint8), affine).to_filename('mask.nii')
+
+    # blocks of three volumes
+    resdw, resmsk, resid = split_rois('dwi.nii', 'mask.nii', (3, 2, 2),
+                                      block_bytes=3 * 7 * 6 * 5 * 2)
+    for fname, mname in zip(resdw, resmsk):
+        roi = nb.load(fname).get_data()
+        assert roi.dtype == np.int16
+        assert roi.shape == (3, 2, 2, 10)
+        assert np.all(roi[nb.load(mname).get_data() == 0] == 0)
+
+    # ROIs holding a single value per voxel are merged into a 4D image
+    means = []
+    for i, fname in enumerate(resdw):
+        means.append('mean%d.nii' % i)
+        nb.Nifti1Image(nb.load(fname).get_data().mean(-1),
+                       None).to_filename(means[-1])
+
+    res = MergeROIs(in_files=means, in_index=resid, in_reference='mask.nii',
+                    compress=False).run()
+    merged = nb.load(res.outputs.merged_file)
+    assert res.outputs.merged_file.endswith('merged.nii')
+    assert np.allclose(merged.affine, affine)
+    assert merged.shape == (7, 6, 5, 1)
+    assert np.allclose(merged.get_data()[..., 0],
+                       np.where(mask, data.mean(-1), 0))
+
+    res = SplitROIs(in_file='dwi.nii', in_mask='mask.nii', roi_size=(3, 2, 2),
+                    compress=False).run()
+    res = MergeROIs(in_files=res.outputs.out_files,
+                    in_index=res.outputs.out_index,
+                    in_reference='mask.nii').run()
+    assert res.outputs.merged_file.endswith('merged.nii.gz')
+    assert np.array_equal(nb.load(res.outputs.merged_file).get_data(),
+                          np.where(mask[..., np.newaxis], data, 0))
@@ -2,7 +2,8 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 
 from ...testing import utils
-from ..confounds import TSNR
+from .. import confounds
+from ..confounds import TSNR, regress_poly
 from .. import misc
 
 import pytest
@@ -85,6 +86,21 @@ class TestTSNR():
             'tsnr_file': (2.6, 57.3)
         })
 
+    def test_tsnr_runs_in_blocks(self, monkeypatch):
+        # read a couple of volumes at a time
+        iter_volume_blocks = confounds._iter_volume_blocks
+        monkeypatch.setattr(confounds, '_iter_volume_blocks',
+                            lambda files: iter_volume_blocks(files, 8 * 8 * 2))
+        rng = np.random.RandomState(0)
+        runs = [rng.randn(2, 2, 2, 7) * 3 + 10 + np.arange(7), rng.randn(2, 2, 2, 4) * 3]
+        in_files = [utils.save_toy_nii(run, 'run%d.nii.gz' % i) for i, run in enumerate(runs)]
+
+        TSNR(in_file=in_files, regress_poly=2).run()
+        data = regress_poly(2, np.concatenate(runs, axis=3), remove_mean=False)
+        npt.assert_allclose(nb.load('detrend.nii.gz').get_data(), data, rtol=1e-5)
+        npt.assert_allclose(nb.load('mean.nii.gz').get_data(), data.mean(axis=3), rtol=1e-5)
+        npt.assert_allclose(nb.load('stdev.nii.gz').get_data(), data.std(axis=3), rtol=1e-5)
+
     @mock.patch('warnings.warn')
     def test_warning(self, mock_warn):
         ''' test that usage of misc.TSNR trips a warning to use confounds.TSNR instead '''
@@ -18,7 +18,10 @@ import pickle
 import time
 import shutil
 import glob
+from collections import OrderedDict
+from contextlib import contextmanager
 
+from ..external import portalocker
 from ..interfaces.base import BaseInterface
 from ..pipeline.engine import Node
 from ..pipeline.engine.utils import modify_paths
@@ -37,7 +40,7 @@ class PipeFunc(object):
             out = fsl_merge(in_files=files, dimension='t')
     """
 
-    def __init__(self, interface, base_dir, callback=None):
+    def __init__(self, interface, base_dir, callback=None, memory=None):
         """
 
             Parameters
@@ -50,6 +53,10 @@ class PipeFunc(object):
             callback: a callable
                 An optional callable called each time after the function
                 is called.
+            memory: a Memory object, optional
+                If given, results are looked up in (and added to) the
+                in-process memo table of this Memory before running a
+                node.
         """
         if not (isinstance(interface, type) and
                 issubclass(interface, BaseInterface)):
@@ -65,6 +72,7 @@ class PipeFunc(object):
                           self.interface.help(returnhelp=True))
         self.__doc__ = doc
         self.callback = callback
+        self.memory = memory
 
     def __call__(self, **kwargs):
         kwargs = modify_paths(kwargs, relative=False)
@@ -78,16 +86,27 @@ class PipeFunc(object):
         dir_name = '%s-%s' % (interface.__class__.__module__.replace('.', '-'),
                               interface.__class__.__name__)
         job_name = hasher.hexdigest()
-        node = Node(interface, name=job_name)
-        node.base_dir = os.path.join(self.base_dir, dir_name)
-
-        cwd = os.getcwd()
-        try:
-            out = node.run()
-        finally:
-            # node.run() changes to the node directory - if something goes wrong
-            # before it cds back you would end up in strange places
-            os.chdir(cwd)
+        use_memo = self.memory is not None and not interface.always_run
+        out = None
+        if use_memo:
+            out = self.memory._get_cached(dir_name, job_name, interface,
+                                          inputs[1])
+        if out is None:
+            node = Node(interface, name=job_name)
+            node.base_dir = os.path.join(self.base_dir, dir_name)
+
+            cwd = os.getcwd()
+            try:
+                out = node.run()
+            finally:
+                # node.run() changes to the node directory - if something
+                # goes wrong before it cds back you would end up in strange
+                # places
+                os.chdir(cwd)
+            if use_memo:
+                self.memory._memoize(dir_name, job_name, out)
+            if self.memory is not None:
+                self.memory._record_run(dir_name, job_name, out)
         if self.callback is not None:
             self.callback(dir_name, job_name)
         return out
@@ -115,6 +134,69 @@ def read_log(filename, run_dict=None):
     return run_dict
 
 
+def read_usage(filename, usage=None):
+    """ Read a usage log into a dictionary mapping 'dir_name/job_name' to
+        a [size, atime, cost] list. Later records override earlier ones;
+        unknown fields are recorded as '-', and a size that was never
+        recorded is returned as None.
+    """
+    if usage is None:
+        usage = dict()
+    if not os.path.exists(filename):
+        return usage
+
+    with open(filename, 'r') as logfile:
+        for line in logfile:
+            fields = line[:-1].split('\t')
+            if len(fields) != 4:
+                "Truncated line"
+                continue
+            record = usage.setdefault(fields[0], [None, 0., 0.])
+            for i, (field, convert) in enumerate(zip(fields[1:],
+                                                     (int, float, float))):
+                if field != '-':
+                    record[i] = convert(field)
+    return usage
+
+
+def _format_usage(key, size=None, atime=None, cost=None):
+    return '\t'.join([key] + ['-' if val is None else repr(val)
+                              for val in (size, atime, cost)]) + '\n'
+
+
+def _dir_size(path):
+    """ Return the total size in bytes of the files under path
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                size += os.lstat(os.path.join(root, file_name)).st_size
+            except OSError:
+                "File has been deleted"
+    return size
+
+
+def _lru_priority(record):
+    # Least recently used first
+    return record[1]
+
+
+def _cost_priority(record):
+    # Cheapest to recompute per byte first, then least recently used
+    return record[2] / max(record[0], 1), record[1]
+
+
+EVICTION_POLICIES = dict(lru=_lru_priority, cost=_cost_priority)
+
+# Seconds between two writes of the access times of a Memory object to the
+# usage log
+ATIME_INTERVAL = 60.
+# Seconds between two enforcements of max_bytes while the runs recorded
+# since the last one keep the cache within budget
+TRIM_INTERVAL = 60.
+
+
 def rm_all_but(base_dir, dirs_to_keep, warn=False):
     """ Remove all the sub-directories of base_dir, but those listed
 
@@ -157,6 +239,20 @@ class Memory(object):
         ==========
         base_dir: string
             The directory name of the location for the caching
+        memo_size: integer, optional
+            The maximum number of results kept in the in-process memo
+            table. Results found there are returned without running a
+            node or touching the disk. The least recently used results
+            (as recorded by the run logs) are evicted first. Set to 0 to
+            disable the memo table.
+        max_bytes: integer, optional
+            If given, the disk usage of the cache is brought back below
+            this budget after each new run, removing cached runs in the
+            order given by policy.
+        policy: 'lru' or 'cost', optional
+            The eviction policy used to enforce max_bytes: 'lru' removes
+            the least recently used runs first, 'cost' removes the runs
+            that are the cheapest to recompute per byte first.
 
         Methods
         =======
@@ -168,15 +264,39 @@ class Memory(object):
         clear_previous_runs
             Removes from the disk all the runs that where not used after
             the given time
+        cache_usage
+            Reports the size, last access time and cost of each cached run
+        trim
+            Removes cached runs until the cache fits in a given size
     """
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, memo_size=1000, max_bytes=None,
+                 policy='lru'):
         base_dir = os.path.join(os.path.abspath(base_dir), 'nipype_mem')
         if not os.path.exists(base_dir):
             os.mkdir(base_dir)
         elif not os.path.isdir(base_dir):
             raise ValueError('base_dir should be a directory')
         self.base_dir = base_dir
+        if policy not in EVICTION_POLICIES:
+            raise ValueError('policy should be one of %s' %
+                             ', '.join(sorted(EVICTION_POLICIES)))
+        self.memo_size = memo_size
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # (dir_name, job_name) -> InterfaceResult, least recently used first
+        self._memo = OrderedDict()
+        # Jobs already written to today's run logs by this object
+        self._logged = dict()
+        # 'dir_name/job_name' -> access time not yet in the usage log
+        self._atimes = dict()
+        self._atimes_written = 0.
+        # Disk usage of the cache as of the last trim, plus the runs
+        # recorded since
+        self._usage_total = None
+        self._trimmed = 0.
+        # dir_name -> set of job_names, read lazily from log.current
+        self._index = None
         open(os.path.join(base_dir, 'log.current'), 'a').close()
 
     def cache(self, interface):
@@ -218,11 +338,84 @@ class Memory(object):
             >>> results.outputs.merged_file # doctest: +SKIP
             '...'
         """
-        return PipeFunc(interface, self.base_dir, _MemoryCallback(self))
+        return PipeFunc(interface, self.base_dir, _MemoryCallback(self),
+                        memory=self)
+
+    def _get_index(self):
+        """ Return the on-disk index of finished jobs, as recorded in
+            the log.current run log.
+        """
+        if self._index is None:
+            self._index = read_log(os.path.join(self.base_dir, 'log.current'))
+        return self._index
+
+    def _get_cached(self, dir_name, job_name, interface, hashvalue):
+        """ Return the cached result of a job, or None if the job has
+            to be run.
+
+            The in-process memo table is looked up first, and its entries
+            are only trusted while their result and hash files are still
+            on disk, since another process may have cleared the cache.
+            Jobs recorded in the on-disk index are loaded from their result
+            file, provided the node hash file shows that they finished.
+        """
+        key = (dir_name, job_name)
+        result = self._memo.get(key)
+        if result is not None:
+            outdir = os.path.join(self.base_dir, dir_name, job_name)
+            if all(os.path.exists(os.path.join(outdir, fname)) for fname in
+                   ('result_%s.pklz' % job_name, '_0x%s.json' % hashvalue)):
+                return result
+            del self._memo[key]
+        if job_name not in self._get_index().get(dir_name, ()):
+            return None
+        node = Node(interface, name=job_name)
+        node.base_dir = os.path.join(self.base_dir, dir_name)
+        outdir = node.output_dir()
+        if not os.path.exists(os.path.join(outdir, '_0x%s.json' % hashvalue)):
+            return None
+        result, aggregate, _ = node._load_resultfile(outdir)
+        if aggregate or result is None:
+            # Let the node decide how to recover
+            return None
+        self._memoize(dir_name, job_name, result)
+        return result
+
+    def _memoize(self, dir_name, job_name, result):
+        """ Add a result to the in-process memo table, evicting the
+            least recently used entries beyond memo_size.
+        """
+        if not self.memo_size:
+            return
+        key = (dir_name, job_name)
+        self._memo.pop(key, None)
+        self._memo[key] = result
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
 
     def _log_name(self, dir_name, job_name):
         """ Increment counters tracking which cached function get executed.
+
+            Each job is written to the run logs once per day by a given
+            Memory object, and its access time to the usage log at most
+            every ATIME_INTERVAL seconds; every call marks its memoized
+            result as most recently used.
         """
+        key = (dir_name, job_name)
+        result = self._memo.pop(key, None)
+        if result is not None:
+            self._memo[key] = result
+        if self._index is not None:
+            self._index.setdefault(dir_name, set()).add(job_name)
+        self._atimes['%s/%s' % key] = time.time()
+        self._write_atimes()
+
+        t = time.localtime()
+        today = (t.tm_year, t.tm_mon, t.tm_mday)
+        if self._logged.get(key) == today:
+            return
+        self._logged[key] = today
+
         base_dir = self.base_dir
         # Every counter is a file opened in append mode and closed
         # immediately to avoid race conditions in parallel computing:
@@ -245,6 +438,173 @@ class Memory(object):
         with open(os.path.join(month_dir, '%02i.log' % t.tm_mday), 'a') as rotatefile:
             rotatefile.write('%s/%s\n' % (dir_name, job_name))
 
+    def _write_atimes(self, force=False):
+        """ Append the pending access times to the usage log, if the last
+            write is more than ATIME_INTERVAL seconds old or force is true.
+            Must not be called holding the usage lock.
+        """
+        now = time.time()
+        if not self._atimes or (not force and
+                                now - self._atimes_written < ATIME_INTERVAL):
+            return
+        self._log_usage(''.join(_format_usage(key, atime=atime) for key, atime
+                                in sorted(self._atimes.items())))
+        self._atimes = dict()
+        self._atimes_written = now
+
+    @contextmanager
+    def _usage_lock(self):
+        """ Hold an exclusive lock on the usage log, shared by all the
+            processes using this cache directory.
+        """
+        with open(os.path.join(self.base_dir, 'log.lock'), 'a') as lockfile:
+            portalocker.lock(lockfile, portalocker.LOCK_EX)
+            try:
+                yield
+            finally:
+                portalocker.unlock(lockfile)
+
+    def _log_usage(self, line):
+        """ Append a record to the usage log
+        """
+        with self._usage_lock():
+            with open(os.path.join(self.base_dir, 'log.usage'), 'a') as usagelog:
+                usagelog.write(line)
+
+    def _record_run(self, dir_name, job_name, result):
+        """ Record the size and cost of a job that has just been run, and
+            enforce the max_bytes budget.
+
+            The whole cache is only measured again when the runs recorded
+            since the last trim may have taken it over budget, or every
+            TRIM_INTERVAL seconds to account for other processes.
+        """
+        key = '%s/%s' % (dir_name, job_name)
+        cost = getattr(result.runtime, 'duration', None) or 0.
+        size = _dir_size(os.path.join(self.base_dir, dir_name, job_name))
+        self._log_usage(_format_usage(key, size, time.time(), float(cost)))
+        if self.max_bytes is None:
+            return
+        if self._usage_total is not None:
+            self._usage_total += size
+        if (self._usage_total is None or
+                self._usage_total > self.max_bytes or
+                time.time() - self._trimmed >= TRIM_INTERVAL):
+            self.trim(self.max_bytes, policy=self.policy, keep=[key],
+                      warn=False)
+
+    def _sync_usage(self):
+        """ Reconcile the usage log with the content of the cache
+            directory and compact it. Must be called holding the usage lock.
+
+            Runs that are missing from the log are added if they finished,
+            using their directory modification time as access time, and
+            runs logged without a size, such as runs only ever read, are
+            measured. Runs that were removed from the disk are dropped.
+        """
+        usage_file = os.path.join(self.base_dir, 'log.usage')
+        usage = read_usage(usage_file)
+        on_disk = set()
+        for dir_name in os.listdir(self.base_dir):
+            dir_path = os.path.join(self.base_dir, dir_name)
+            if dir_name.startswith('log.') or not os.path.isdir(dir_path):
+                continue
+            for job_name in os.listdir(dir_path):
+                job_path = os.path.join(dir_path, job_name)
+                key = '%s/%s' % (dir_name, job_name)
+                if key not in usage:
+                    hashfiles = [hashfile for hashfile in
+                                 glob.glob(os.path.join(job_path, '_0x*.json'))
+                                 if not hashfile.endswith('_unfinished.json')]
+                    if not hashfiles:
+                        "Running or failed job"
+                        continue
+                    usage[key] = [_dir_size(job_path),
+                                  os.path.getmtime(job_path), 0.]
+                elif usage[key][0] is None:
+                    usage[key][0] = _dir_size(job_path)
+                on_disk.add(key)
+        usage = dict((key, record) for key, record in usage.items()
+                     if key in on_disk)
+        tmp_file = usage_file + '.tmp'
+        with open(tmp_file, 'w') as usagelog:
+            for key, record in sorted(usage.items()):
+                usagelog.write(_format_usage(key, *record))
+        os.rename(tmp_file, usage_file)
+        return usage
+
+    def cache_usage(self):
+        """ Return the disk usage of the cached runs
+
+            Returns
+            =======
+            usage: dict
+                A dictionary mapping 'dir_name/job_name' to a [size, atime,
+                cost] list: the size in bytes of the run directory, the time
+                it was last accessed (in seconds since the epoch, with a
+                resolution of ATIME_INTERVAL seconds per Memory object) and
+                the time it took to run (in seconds).
+        """
+        self._write_atimes(force=True)
+        with self._usage_lock():
+            return self._sync_usage()
+
+    def trim(self, max_bytes, policy='lru', keep=(), dry_run=False,
+             warn=True):
+        """ Remove cached runs until the cache uses at most max_bytes
+
+            Parameters
+            ==========
+            max_bytes: integer
+                The disk budget of the cache, in bytes
+            policy: 'lru' or 'cost', optional
+                The eviction policy: 'lru' removes the least recently used
+                runs first, 'cost' removes the runs that are the cheapest to
+                recompute per byte first.
+            keep: list of strings, optional
+                'dir_name/job_name' runs that should not be removed
+            dry_run: boolean, optional
+                If true, only report the runs that would be removed
+            warn: boolean, optional
+                If true, echoes warning messages for all directory
+                removed
+
+            Returns
+            =======
+            removed: list
+                The 'dir_name/job_name' runs removed
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError('policy should be one of %s' %
+                             ', '.join(sorted(EVICTION_POLICIES)))
+        priority = EVICTION_POLICIES[policy]
+        removed = list()
+        self._write_atimes(force=True)
+        with self._usage_lock():
+            usage = self._sync_usage()
+            total = sum(record[0] for record in usage.values())
+            for key in sorted(usage, key=lambda k: priority(usage[k])):
+                if total <= max_bytes:
+                    break
+                if key in keep:
+                    continue
+                total -= usage[key][0]
+                removed.append(key)
+                if dry_run:
+                    continue
+                dir_name = os.path.join(self.base_dir, key)
+                if warn:
+                    print('removing directory: %s' % dir_name)
+                shutil.rmtree(dir_name, ignore_errors=True)
+            if removed and not dry_run:
+                self._sync_usage()
+        if not dry_run:
+            self._usage_total = total
+            self._trimmed = time.time()
+            for key in removed:
+                self._memo.pop(tuple(key.split('/')), None)
+        return removed
+
     def clear_previous_runs(self, warn=True):
         """ Remove all the cache that where not used in the latest run of
             the memory object: i.e. since the corresponding Python object
@@ -299,6 +659,12 @@ class Memory(object):
         for dir_name, job_names in list(runs.items()):
             rm_all_but(os.path.join(self.base_dir, dir_name),
                        job_names, warn=warn)
+        for key in list(self._memo.keys()):
+            if key[1] not in runs.get(key[0], ()):
+                del self._memo[key]
+        self._logged = dict()
+        self._index = None
+        self._usage_total = None
 
     def __repr__(self):
         return '{}(base_dir={})'.format(self.__class__.__name__, self.base_dir)
@@ -2,6 +2,9 @@
 """ Test the nipype interface caching mechanism
 """
 
+import os
+import shutil
+
 from .. import Memory
 from ...pipeline.engine.tests.test_engine import EngineTestInterface
 
@@ -41,3 +44,76 @@ def test_caching(tmpdir):
     finally:
         config.set('execution', 'stop_on_first_rerun', old_rerun)
 
+
+def test_caching_memo(tmpdir):
+    old_rerun = config.get('execution', 'stop_on_first_rerun')
+    try:
+        config.set('execution', 'stop_on_first_rerun', 'true')
+        mem = Memory(str(tmpdir), memo_size=1)
+        first_nb_run = nb_runs
+        results = mem.cache(SideEffectInterface)(input1=2, input2=1)
+        assert len(mem._memo) == 1
+        # A memoized result is returned as is, without loading it again
+        assert mem.cache(SideEffectInterface)(input1=2, input2=1) is results
+        results2 = mem.cache(SideEffectInterface)(input1=1, input2=1)
+        assert nb_runs == first_nb_run + 2
+        # The least recently used result has been evicted
+        assert list(mem._memo.values()) == [results2]
+
+        # A new session finds the results through the on-disk index
+        mem2 = Memory(str(tmpdir))
+        results = mem2.cache(SideEffectInterface)(input1=2, input2=1)
+        assert nb_runs == first_nb_run + 2
+        assert results.outputs.output1 == [1, 2]
+        assert len(mem2._memo) == 1
+
+        # Cleared runs are dropped from the memo table
+        mem2.clear_runs_since(year=3000, warn=False)
+        assert len(mem2._memo) == 0
+        results = mem2.cache(SideEffectInterface)(input1=2, input2=1)
+        assert nb_runs == first_nb_run + 3
+
+        # Memoized results removed from disk by another process are rerun
+        assert len(mem2._memo) == 1
+        for dir_name in os.listdir(mem2.base_dir):
+            path = os.path.join(mem2.base_dir, dir_name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+        results = mem2.cache(SideEffectInterface)(input1=2, input2=1)
+        assert nb_runs == first_nb_run + 4
+        assert results.outputs.output1 == [1, 2]
+    finally:
+        config.set('execution', 'stop_on_first_rerun', old_rerun)
+
+
+def test_caching_trim(tmpdir):
+    mem = Memory(str(tmpdir))
+    for input1 in range(3):
+        mem.cache(SideEffectInterface)(input1=input1, input2=1)
+    usage = mem.cache_usage()
+    assert len(usage) == 3
+    total = sum(record[0] for record in usage.values())
+    assert total > 0
+
+    # Oldest runs go first with the LRU policy
+    oldest = sorted(usage, key=lambda key: usage[key][1])
+    assert mem.trim(total, warn=False) == []
+    assert mem.trim(total - 1, dry_run=True, warn=False) == oldest[:1]
+    assert len(mem.cache_usage()) == 3
+    assert mem.trim(total - 1, warn=False) == oldest[:1]
+    usage = mem.cache_usage()
+    assert sorted(usage) == sorted(oldest[1:])
+    assert not tmpdir.join('nipype_mem', oldest[0]).check()
+
+    # A budget enforced after each run never removes the new run
+    mem = Memory(str(tmpdir), max_bytes=0)
+    mem.cache(SideEffectInterface)(input1=5, input2=1)
+    assert len(mem.cache_usage()) == 1
+
+    # Runs only ever read by a Memory object are measured too
+    tmpdir.join('nipype_mem', 'log.usage').remove()
+    mem = Memory(str(tmpdir))
+    mem.cache(SideEffectInterface)(input1=5, input2=1)
+    usage = mem.cache_usage()
+    assert len(usage) == 1
+    assert list(usage.values())[0][0] > 0
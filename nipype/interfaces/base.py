@@ -24,6 +24,7 @@ import re
 import platform
 from string import Template
 import select
+from stat import S_ISREG
 import subprocess
 import sys
 import time
@@ -60,6 +61,9 @@ if runtime_profile:
 
 __docformat__ = 'restructuredtext'
 
+# Per-class cache of the hashing-related metadata of input traits
+_hash_metadata_cache = {}
+
 
 class Str(traits.Unicode):
     pass
@@ -555,6 +559,11 @@ class BaseTraitedSpec(traits.HasTraits):
         value of a file. The path and name of the file are not used in
         the overall hash calculation.
 
+        The result is memoized on the spec, provided that trait
+        notifications see every change of the inputs (see
+        :func:`_tracks_changes`), and reused until a trait changes or one of
+        the files that were hashed (or found missing) changes on disk.
+
         Returns
         -------
         dict_withhash : dict
@@ -564,48 +573,121 @@ class BaseTraitedSpec(traits.HasTraits):
             The md5 hash value of the traited spec
 
         """
+        if hash_method is None:
+            hash_method = config.get('execution', 'hash_method')
+
+        cached = self.__dict__.get('_hashval_cache')
+        if cached is not None:
+            cached_method, filestats, result = cached
+            if (cached_method == hash_method and
+                    all(_file_signature(afile) == signature
+                        for afile, signature in filestats)):
+                return list(result[0]), result[1]
+
+        values = super(BaseTraitedSpec, self).get()
+        inputs = self._clean_container(values, Undefined)
 
         dict_withhash = []
         dict_nofilename = []
-        for name, val in sorted(self.get().items()):
-            if not isdefined(val) or self.has_metadata(name, "nohash", True):
-                # skip undefined traits and traits with nohash=True
+        filestats = []
+        for name, val in sorted(inputs.items()):
+            if not isdefined(val):
                 continue
-
-            hash_files = (not self.has_metadata(name, "hash_files", False) and not
-                          self.has_metadata(name, "name_source"))
-            dict_nofilename.append((name,
-                                    self._get_sorteddict(val, hash_method=hash_method,
-                                                         hash_files=hash_files)))
-            dict_withhash.append((name,
-                                  self._get_sorteddict(val, True, hash_method=hash_method,
-                                                       hash_files=hash_files)))
-        return dict_withhash, md5(to_str(dict_nofilename).encode()).hexdigest()
-
+            nohash, hash_files = self._get_hash_metadata(name)
+            if nohash:
+                # skip traits with nohash=True
+                continue
+            withhash, nofilename = self._get_sorteddict_pair(
+                val, hash_method=hash_method, hash_files=hash_files,
+                filestats=filestats)
+            dict_nofilename.append((name, nofilename))
+            dict_withhash.append((name, withhash))
+        hashvalue = md5(to_str(dict_nofilename).encode()).hexdigest()
+        if all(_tracks_changes(val) for val in values.values()):
+            if not self.__dict__.get('_hashval_listener'):
+                # a static _anytrait_changed handler would break specs with
+                # List(minlen=1) traits, while __init__ sets them Undefined
+                self.on_trait_change(self._drop_hashval_cache)
+                self.__dict__['_hashval_listener'] = True
+            self.__dict__['_hashval_cache'] = (hash_method, filestats,
+                                               (dict_withhash, hashvalue))
+        return list(dict_withhash), hashvalue
+
+    def _drop_hashval_cache(self):
+        """Drop the memoized hash of the inputs on any trait change,
+        including in-place changes of list and dict traits"""
+        self.__dict__.pop('_hashval_cache', None)
+
+    def __getstate__(self):
+        """Leave the memoized hash out of pickles, as its trait listener
+        is not restored with them"""
+        state = super(BaseTraitedSpec, self).__getstate__()
+        state.pop('_hashval_cache', None)
+        state.pop('_hashval_listener', None)
+        return state
+
+    def _get_hash_metadata(self, name):
+        """Return the ``(nohash, hash_files)`` flags of trait ``name``
+
+        Lookups are cached per spec class; the cached entry is reused only
+        while the trait type is the one it was computed for, so traits
+        added or replaced on an instance are handled correctly.
+        """
+        trait_type = self.trait(name).trait_type
+        class_cache = _hash_metadata_cache.setdefault(self.__class__, {})
+        cached = class_cache.get(name)
+        if cached is None or cached[0] is not trait_type:
+            nohash = self.has_metadata(name, "nohash", True)
+            hash_files = (not self.has_metadata(name, "hash_files", False) and
+                          not self.has_metadata(name, "name_source"))
+            cached = class_cache[name] = (trait_type, nohash, hash_files)
+        return cached[1], cached[2]
 
     def _get_sorteddict(self, objekt, dictwithhash=False, hash_method=None,
                         hash_files=True):
+        withhash, nofilename = self._get_sorteddict_pair(
+            objekt, hash_method=hash_method, hash_files=hash_files)
+        if dictwithhash:
+            return withhash
+        return nofilename
+
+    def _get_sorteddict_pair(self, objekt, hash_method=None, hash_files=True,
+                             filestats=None):
+        """Build the ``dictwithhash`` and ``nofilename`` views in one pass
+
+        Every string tested for being a file is appended to ``filestats``
+        together with its :func:`_file_signature`.
+        """
         if isinstance(objekt, dict):
-            out = []
+            withhash = []
+            nofilename = []
             for key, val in sorted(objekt.items()):
                 if isdefined(val):
-                    out.append((key,
-                                self._get_sorteddict(val, dictwithhash,
-                                                     hash_method=hash_method,
-                                                     hash_files=hash_files)))
+                    val_withhash, val_nofilename = self._get_sorteddict_pair(
+                        val, hash_method=hash_method, hash_files=hash_files,
+                        filestats=filestats)
+                    withhash.append((key, val_withhash))
+                    nofilename.append((key, val_nofilename))
         elif isinstance(objekt, (list, tuple)):
-            out = []
+            withhash = []
+            nofilename = []
             for val in objekt:
                 if isdefined(val):
-                    out.append(self._get_sorteddict(val, dictwithhash,
-                                                    hash_method=hash_method,
-                                                    hash_files=hash_files))
+                    val_withhash, val_nofilename = self._get_sorteddict_pair(
+                        val, hash_method=hash_method, hash_files=hash_files,
+                        filestats=filestats)
+                    withhash.append(val_withhash)
+                    nofilename.append(val_nofilename)
             if isinstance(objekt, tuple):
-                out = tuple(out)
+                withhash = tuple(withhash)
+                nofilename = tuple(nofilename)
         else:
-            if isdefined(objekt):
-                if (hash_files and isinstance(objekt, (str, bytes)) and
-                        os.path.isfile(objekt)):
+            withhash = nofilename = objekt
+            if hash_files and isinstance(objekt, (str, bytes)):
+                signature = _file_signature(objekt)
+                if filestats is not None:
+                    filestats.append((objekt, signature))
+                if signature is not None:
                     if hash_method is None:
                         hash_method = config.get('execution', 'hash_method')
 
@@ -615,15 +697,35 @@ class BaseTraitedSpec(traits.HasTraits):
                         hash = hash_infile(objekt)
                     else:
                         raise Exception("Unknown hash method: %s" % hash_method)
-                    if dictwithhash:
-                        out = (objekt, hash)
-                    else:
-                        out = hash
-                elif isinstance(objekt, float):
-                    out = FLOAT_FORMAT(objekt)
-                else:
-                    out = objekt
-        return out
+                    withhash = (objekt, hash)
+                    nofilename = hash
+            elif isinstance(objekt, float):
+                withhash = nofilename = FLOAT_FORMAT(objekt)
+        return withhash, nofilename
+
+
+def _file_signature(afile):
+    """Return a stat-based signature of ``afile``, or None if it is not a file
+    """
+    try:
+        stat = os.stat(afile)
+    except (OSError, ValueError, TypeError):
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime
+
+
+def _tracks_changes(value):
+    """Whether trait notifications see every change of a trait value: it
+    only holds immutable values and the lists and dicts traits wraps, not
+    e.g. a list held by an Any trait, which can change silently"""
+    if isinstance(value, (TraitListObject, tuple)):
+        return all(_tracks_changes(val) for val in value)
+    if isinstance(value, TraitDictObject):
+        return all(_tracks_changes(val) for val in value.values())
+    return value is None or isinstance(value, (str, bytes, int, float,
+                                               type(Undefined)))
 
 
 class DynamicTraitedSpec(BaseTraitedSpec):
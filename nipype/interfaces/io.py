@@ -21,78 +21,220 @@
 from __future__ import print_function, division, unicode_literals, absolute_import
 from builtins import object, zip, filter, range, open, str
 
-import glob
+import atexit
+import errno
 import fnmatch
 import string
 import os
 import os.path as op
+import posixpath
 import shutil
 import subprocess
 import re
 import tempfile
+import hashlib
+import math
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 from warnings import warn
 
 import sqlite3
 
 from .. import config, logging
-from ..utils.filemanip import copyfile, list_to_filename, filename_to_list
+from ..utils.filemanip import (copyfile, list_to_filename, filename_to_list,
+                               get_related_files, indexed_glob, indexed_walk,
+                               clone_file)
 from ..utils.misc import human_order_sorted, str2bool
 from .base import (
     TraitedSpec, traits, Str, File, Directory, BaseInterface, InputMultiPath,
     isdefined, OutputMultiPath, DynamicTraitedSpec, Undefined, BaseInterfaceInputSpec)
 
 try:
-    import pyxnat
-except:
-    pass
+    from os import scandir
+except ImportError:
+    scandir = None
 
 try:
-    import paramiko
+    import pyxnat
 except:
     pass
 
 try:
-    import boto
-    from boto.s3.connection import S3Connection, OrdinaryCallingFormat
+    import paramiko
 except:
     pass
 
 iflogger = logging.getLogger('interface')
 
-def copytree(src, dst, use_hardlink=False):
-    """Recursively copy a directory tree using
-    nipype.utils.filemanip.copyfile()
 
-    This is not a thread-safe routine. However, in the case of creating new
-    directories, it checks to see if a particular directory has already been
-    created by another process.
+def _mtime_ns(st):
+    """Return the mtime of a stat result in nanoseconds"""
+    try:
+        return st.st_mtime_ns
+    except AttributeError:
+        # Python 2
+        return int(st.st_mtime * 1e9)
+
+
+def _copy_times(src_st, dst):
+    """Give ``dst`` the atime and mtime of the stat result ``src_st``,
+    to the nanosecond where the platform allows it"""
+    try:
+        os.utime(dst, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+    except (AttributeError, TypeError):
+        # Python 2
+        os.utime(dst, (src_st.st_atime, src_st.st_mtime))
+
+
+def _copytree_file(src, dst, use_hardlink=False):
+    """Bring ``dst`` up to date with ``src``
+
+    Size and mtime are compared first, as rsync does. Otherwise ``dst`` is
+    hardlinked if asked to, else cloned where the filesystem supports
+    it, else copied, keeping the mtime of ``src``. Returns the size of
+    ``src`` and whether ``dst`` was up to date.
     """
-    names = os.listdir(src)
+    src_st = os.stat(src)
     try:
-        os.makedirs(dst)
-    except OSError as why:
-        if 'File exists' in why:
-            pass
-        else:
-            raise why
-    errors = []
-    for name in names:
-        srcname = os.path.join(src, name)
-        dstname = os.path.join(dst, name)
+        dst_st = os.lstat(dst)
+    except OSError:
+        dst_st = None
+    else:
+        if (src_st.st_dev, src_st.st_ino) == (dst_st.st_dev, dst_st.st_ino) \
+                or (not os.path.islink(dst) and
+                    src_st.st_size == dst_st.st_size and
+                    _mtime_ns(src_st) == _mtime_ns(dst_st)):
+            return src_st.st_size, True
+        # never write through a link into another file
+        os.unlink(dst)
+
+    if use_hardlink:
+        try:
+            os.link(src, dst)
+            return src_st.st_size, False
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+    clone_file(src, dst)
+    _copy_times(src_st, dst)
+    return src_st.st_size, False
+
+
+def _walk_tree(src, dst, errors):
+    """Create the directories of ``dst`` and yield the (src, dst) file pairs
+
+    The walk uses a stack rather than recursion. Symlinked directories are
+    followed, except those that loop back to one of their own ancestors.
+    """
+    stack = [(src, dst, frozenset())]
+    while stack:
+        src_dir, dst_dir, ancestors = stack.pop()
         try:
-            if os.path.isdir(srcname):
-                copytree(srcname, dstname, use_hardlink)
+            st = os.stat(src_dir)
+            if (st.st_dev, st.st_ino) in ancestors:
+                continue
+            ancestors = ancestors | {(st.st_dev, st.st_ino)}
+            if scandir is not None:
+                entries = [(entry.name, entry.is_dir())
+                           for entry in scandir(src_dir)]
+            else:
+                entries = [(name, os.path.isdir(os.path.join(src_dir, name)))
+                           for name in os.listdir(src_dir)]
+            try:
+                os.makedirs(dst_dir)
+            except OSError as why:
+                if why.errno != errno.EEXIST:
+                    raise
+        except (IOError, OSError) as why:
+            errors.append((src_dir, dst_dir, str(why)))
+            continue
+        for name, is_dir in sorted(entries, reverse=True):
+            pair = (os.path.join(src_dir, name), os.path.join(dst_dir, name))
+            if is_dir:
+                stack.append(pair + (ancestors,))
             else:
-                copyfile(srcname, dstname, True, hashmethod='content',
-                         use_hardlink=use_hardlink)
-        except (IOError, os.error) as why:
-            errors.append((srcname, dstname, str(why)))
-        # catch the Error from the recursive copytree so that we can
-        # continue with other files
-        except Exception as err:
-            errors.extend(err.args[0])
+                yield pair
+
+
+def copytree(src, dst, use_hardlink=False, n_procs=1):
+    """Recursively copy a directory tree
+
+    Files whose size and mtime already match are left alone. The others
+    are hardlinked when ``use_hardlink`` is set, cloned on copy-on-write
+    filesystems, or copied, ``n_procs`` at a time. Errors are collected and
+    raised together once the rest of the tree is copied.
+
+    Directories are created even if another process has just created
+    them. Returns the number of bytes in the tree and whether every file
+    was already up to date.
+    """
+    errors = []
+
+    def copy(pair):
+        try:
+            return _copytree_file(pair[0], pair[1], use_hardlink)
+        except (IOError, OSError) as why:
+            errors.append((pair[0], pair[1], str(why)))
+            return 0, False
+
+    pairs = _walk_tree(src, dst, errors)
+    if n_procs > 1:
+        pool = ThreadPool(n_procs)
+        try:
+            results = list(pool.imap_unordered(copy, pairs, chunksize=16))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [copy(pair) for pair in pairs]
+
     if errors:
         raise Exception(errors)
+    return (sum(nbytes for nbytes, _ in results),
+            all(up_to_date for _, up_to_date in results))
+
+
+def _sink_up_to_date(src, dst):
+    """Whether ``dst`` and its related files are copies of ``src`` and its
+    related files, judging by size and mtime like rsync does"""
+    for src_f, dst_f in zip(get_related_files(src), get_related_files(dst)):
+        if src_f != src and not os.path.exists(src_f):
+            continue
+        try:
+            src_st, dst_st = os.stat(src_f), os.lstat(dst_f)
+        except OSError:
+            return False
+        if os.path.islink(dst_f) or src_st.st_size != dst_st.st_size or \
+                _mtime_ns(src_st) != _mtime_ns(dst_st):
+            return False
+    return True
+
+
+def _sink_file(src, dst, use_hardlink=False):
+    """Copy ``src`` to ``dst`` unless it is already there
+
+    The copies get the mtime of their source, so that the next time the
+    same file is sunk a stat is enough to tell that it is up to date.
+    Otherwise the contents are compared as before. Returns the number of
+    bytes sunk and whether ``dst`` was up to date.
+    """
+    if _sink_up_to_date(src, dst):
+        iflogger.debug('copyfile: %s is up to date' % dst)
+        return os.path.getsize(src), True
+    iflogger.debug('copyfile: %s %s' % (src, dst))
+    copyfile(src, dst, copy=True, hashmethod='content',
+             use_hardlink=use_hardlink)
+    nbytes = 0
+    for src_f, dst_f in zip(get_related_files(src), get_related_files(dst)):
+        if not (os.path.exists(src_f) and os.path.exists(dst_f)):
+            continue
+        src_st = os.stat(src_f)
+        nbytes += src_st.st_size
+        if not os.path.samefile(src_f, dst_f):
+            _copy_times(src_st, dst_f)
+    return nbytes, False
 
 
 def add_traits(base, names, trait_type=None):
@@ -170,6 +312,222 @@ class ProgressPercentage(object):
             sys.stdout.flush()
 
 
+_MiB = 1024 * 1024
+
+
+def _s3_etag(filename, part_size=None):
+    """Return the ETag S3 gives ``filename`` once uploaded
+
+    With ``part_size`` the ETag of a multipart upload in parts of that many
+    bytes is computed, otherwise the plain md5 of a single-part upload.
+    The file is read in blocks, never in one go.
+    """
+    if part_size is None:
+        digest = hashlib.md5()
+        with open(filename, 'rb') as fp:
+            for block in iter(lambda: fp.read(_MiB), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    digests = []
+    with open(filename, 'rb') as fp:
+        while True:
+            digest = hashlib.md5()
+            left = part_size
+            while left:
+                block = fp.read(min(left, _MiB))
+                if not block:
+                    break
+                digest.update(block)
+                left -= len(block)
+            if left == part_size:
+                break
+            digests.append(digest.digest())
+    return '%s-%d' % (hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+def _s3_etag_matches(filename, etag, part_sizes=()):
+    """Check whether ``filename`` has the contents behind an S3 ETag
+
+    The part size of a multipart ETag is not recorded by S3, so it is taken
+    from ``part_sizes`` or guessed from the number of parts. Returns None
+    when no part size fits that number of parts.
+    """
+    etag = etag.strip('"')
+    if '-' not in etag:
+        return _s3_etag(filename) == etag
+    n_parts = int(etag.rsplit('-', 1)[1])
+    size = os.path.getsize(filename)
+    guess = int(math.ceil(size / float(n_parts) / _MiB)) * _MiB
+    candidates = [part_size for part_size in list(part_sizes) + [guess]
+                  if part_size and -(-size // part_size) == n_parts]
+    if not candidates:
+        return None
+    for part_size in sorted(set(candidates), key=candidates.index):
+        if _s3_etag(filename, part_size) == etag:
+            return True
+    return False
+
+
+def _regex_prefix(pattern):
+    """Return the literal text every re.match of ``pattern`` starts with"""
+    if '|' in pattern:
+        return ''
+    prefix = []
+    for char in pattern.lstrip('^'):
+        if char in '.^$*+?{}[]\\()':
+            if char in '*?{' and prefix:
+                prefix.pop()
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+class S3TransferManager(object):
+    """Move files between local disk and an S3 bucket
+
+    Files are transferred ``n_procs`` at a time from a thread pool, files
+    larger than ``chunksize`` go up in parts of that size. Uploads are
+    skipped when the object already holds the same contents, which is
+    checked against single-part and multipart ETags alike by streaming the
+    local file. Downloads go to a ``.part`` file named after the object's
+    ETag, so an interrupted download resumes where it stopped as long as
+    the object did not change in between.
+
+    Parameters
+    ----------
+    client : botocore.client.S3
+        boto3 S3 client (clients, unlike resources, are thread safe)
+    bucket_name : str
+        the bucket to transfer to and from
+    n_procs : int
+        maximum number of files transferred at the same time
+    chunksize : int
+        multipart threshold and part size, in bytes
+    extra_args : dict
+        ExtraArgs passed along with every upload
+    """
+
+    def __init__(self, client, bucket_name, n_procs=4, chunksize=8 * _MiB,
+                 extra_args=None):
+        from boto3.s3.transfer import TransferConfig
+
+        self.client = client
+        self.bucket_name = bucket_name
+        self.n_procs = max(1, n_procs)
+        self.chunksize = chunksize
+        self.extra_args = extra_args or {}
+        self.config = TransferConfig(multipart_threshold=chunksize,
+                                     multipart_chunksize=chunksize,
+                                     max_concurrency=self.n_procs)
+
+    def _map(self, func, items):
+        items = list(items)
+        if self.n_procs == 1 or len(items) < 2:
+            return [func(item) for item in items]
+        pool = ThreadPool(min(self.n_procs, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=key)
+        except ClientError:
+            return None
+
+    def _matches(self, filename, head):
+        if head['ContentLength'] != os.path.getsize(filename):
+            return False
+        return _s3_etag_matches(filename, head['ETag'], (self.chunksize,))
+
+    def list(self, prefix=''):
+        """Return the keys of the bucket that start with ``prefix``"""
+        paginator = self.client.get_paginator('list_objects')
+        keys = []
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        return keys
+
+    def upload(self, pairs):
+        """Upload (filename, key) pairs, returns which ones were sent"""
+        return self._map(self._upload, pairs)
+
+    def download(self, pairs):
+        """Download (key, filename) pairs, returns which ones were fetched"""
+        return self._map(self._download, pairs)
+
+    def _upload(self, pair):
+        src, key = pair
+        head = self._head(key)
+        if head is None:
+            iflogger.info('New file to S3')
+        elif self._matches(src, head):
+            iflogger.info('File %s already exists on S3, skipping...' % key)
+            return False
+        else:
+            iflogger.info('Overwriting previous S3 file...')
+
+        iflogger.info('Uploading %s to S3 bucket, %s, as %s...'
+                      % (src, self.bucket_name, key))
+        callback = None
+        if self.n_procs == 1:
+            callback = ProgressPercentage(src)
+        self.client.upload_file(src, self.bucket_name, key,
+                                ExtraArgs=self.extra_args,
+                                Callback=callback, Config=self.config)
+        return True
+
+    def _download(self, pair):
+        key, filename = pair
+        head = self.client.head_object(Bucket=self.bucket_name, Key=key)
+        size = head['ContentLength']
+        etag = head['ETag'].strip('"')
+        verify = head.get('ServerSideEncryption') != 'aws:kms'
+        if os.path.isfile(filename) and verify and \
+                self._matches(filename, head):
+            iflogger.info('File %s already downloaded, skipping...'
+                          % filename)
+            return False
+
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname):
+                    raise
+        partial = '%s.%s.part' % (filename, etag.replace('-', '_'))
+        offset = 0
+        if os.path.exists(partial):
+            offset = os.path.getsize(partial)
+            if offset > size:
+                offset = 0
+        if offset < size or not os.path.exists(partial):
+            kwargs = dict(Bucket=self.bucket_name, Key=key,
+                          IfMatch=head['ETag'])
+            if offset:
+                iflogger.info('Resuming download of %s at byte %d'
+                              % (key, offset))
+                kwargs['Range'] = 'bytes=%d-' % offset
+            body = self.client.get_object(**kwargs)['Body']
+            with open(partial, 'ab' if offset else 'wb') as fp:
+                for block in iter(lambda: body.read(_MiB), b''):
+                    fp.write(block)
+
+        if os.path.getsize(partial) != size or (
+                verify and self._matches(partial, head) is False):
+            os.remove(partial)
+            raise IOError('Download of s3://%s/%s does not match its ETag'
+                          % (self.bucket_name, key))
+        os.rename(partial, filename)
+        return True
+
+
 # DataSink inputs
 class DataSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     '''
@@ -208,6 +566,12 @@ class DataSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     bucket = traits.Any(desc='Boto3 S3 bucket for manual override of bucket')
     # Set this if user wishes to have local copy of files as well
     local_copy = Str(desc='Copy files locally as well as to S3 bucket')
+    s3_transfers = traits.Int(4, usedefault=True,
+                              desc='Number of files uploaded to the S3 '
+                                   'bucket at the same time')
+    copy_threads = traits.Int(4, usedefault=True,
+                              desc='Number of files copied locally at the '
+                                   'same time')
 
     # Set call-able inputs attributes
     def __setattr__(self, key, value):
@@ -559,74 +923,89 @@ class DataSink(IOBase):
         return bucket
 
     # Send up to S3 method
-    def _upload_to_s3(self, bucket, src, dst):
+    def _upload_to_s3(self, bucket, transfers):
         '''
         Method to upload outputs to S3 bucket instead of on local disk
-        '''
 
-        # Import packages
-        import hashlib
-        import logging
-        import os
-
-        from botocore.exceptions import ClientError
+        Parameters
+        ----------
+        bucket : boto3.resources.factory.s3.Bucket
+            bucket to upload to
+        transfers : list of tuples
+            (src, dst) pairs, src being a file or a directory and dst its
+            's3://bucket_name/...' destination
+        '''
 
         # Init variables
-        iflogger = logging.getLogger('interface')
         s3_str = 's3://'
         s3_prefix = s3_str + bucket.name
 
-        # Explicitly lower-case the "s3"
-        if dst.lower().startswith(s3_str):
-            dst_sp = dst.split('/')
-            dst_sp[0] = dst_sp[0].lower()
-            dst = '/'.join(dst_sp)
-
-        # If src is a directory, collect files (this assumes dst is a dir too)
-        if os.path.isdir(src):
-            src_files = []
-            for root, dirs, files in os.walk(src):
-                src_files.extend([os.path.join(root, fil) for fil in files])
-            # Make the dst files have the dst folder as base dir
-            dst_files = [os.path.join(dst, src_f.split(src)[1]) \
-                         for src_f in src_files]
-        else:
-            src_files = [src]
-            dst_files = [dst]
+        pairs = []
+        for src, dst in transfers:
+            # Explicitly lower-case the "s3"
+            if dst.lower().startswith(s3_str):
+                dst_sp = dst.split('/')
+                dst_sp[0] = dst_sp[0].lower()
+                dst = '/'.join(dst_sp)
+
+            # If src is a directory, collect files (this assumes dst is a
+            # dir too)
+            if os.path.isdir(src):
+                src_files = []
+                for root, dirs, files in os.walk(src):
+                    src_files.extend([os.path.join(root, fil)
+                                      for fil in files])
+                # Make the dst files have the dst folder as base dir
+                dst_files = [os.path.join(dst, src_f.split(src)[1])
+                             for src_f in src_files]
+            else:
+                src_files = [src]
+                dst_files = [dst]
 
-        # Iterate over src and copy to dst
-        for src_idx, src_f in enumerate(src_files):
-            # Get destination filename/keyname
-            dst_f = dst_files[src_idx]
-            dst_k = dst_f.replace(s3_prefix, '').lstrip('/')
+            pairs.extend((src_f, dst_f.replace(s3_prefix, '').lstrip('/'))
+                         for src_f, dst_f in zip(src_files, dst_files))
 
-            # See if same file is already up there
+        # Copy files up to S3 (either encrypted or not)
+        if self.inputs.encrypt_bucket_keys:
+            extra_args = {'ServerSideEncryption': 'AES256'}
+        else:
+            extra_args = {}
+        S3TransferManager(bucket.meta.client, bucket.name,
+                          n_procs=self.inputs.s3_transfers,
+                          extra_args=extra_args).upload(pairs)
+
+    # Copy files and directories to their local destination
+    def _copy_locally(self, copies, use_hardlink):
+        # Copies are independent, except that the last one to a destination
+        # has to win as it did when copying one after the other
+        last = dict((dst, idx) for idx, (_, dst) in enumerate(copies))
+        copies = [pair for idx, pair in enumerate(copies)
+                  if last[pair[1]] == idx]
+
+        def copy(pair):
+            src, dst = pair
+            if os.path.isfile(src):
+                return _sink_file(src, dst, use_hardlink)
+            iflogger.debug('copydir: %s %s' % (src, dst))
+            # directories are copied, as they always were, whatever
+            # try_hard_link_datasink says
+            return copytree(src, dst, n_procs=self.inputs.copy_threads)
+
+        start = time.time()
+        n_procs = max(1, min(self.inputs.copy_threads, len(copies)))
+        if n_procs == 1:
+            results = [copy(pair) for pair in copies]
+        else:
+            pool = ThreadPool(n_procs)
             try:
-                dst_obj = bucket.Object(key=dst_k)
-                dst_md5 = dst_obj.e_tag.strip('"')
-
-                # See if same file is already there
-                src_read = open(src_f, 'rb').read()
-                src_md5 = hashlib.md5(src_read).hexdigest()
-                # Move to next loop iteration
-                if dst_md5 == src_md5:
-                    iflogger.info('File %s already exists on S3, skipping...' % dst_f)
-                    continue
-                else:
-                    iflogger.info('Overwriting previous S3 file...')
-
-            except ClientError:
-                iflogger.info('New file to S3')
-
-            # Copy file up to S3 (either encrypted or not)
-            iflogger.info('Uploading %s to S3 bucket, %s, as %s...'\
-                          % (src_f, bucket.name, dst_f))
-            if self.inputs.encrypt_bucket_keys:
-                extra_args = {'ServerSideEncryption' : 'AES256'}
-            else:
-                extra_args = {}
-            bucket.upload_file(src_f, dst_k, ExtraArgs=extra_args,
-                               Callback=ProgressPercentage(src_f))
+                results = pool.map(copy, copies)
+            finally:
+                pool.close()
+                pool.join()
+        iflogger.info('DataSink: %d outputs (%.1f MB) sunk in %.2fs, %d '
+                      'already up to date'
+                      % (len(copies), sum(r[0] for r in results) / 1e6,
+                         time.time() - start, sum(r[1] for r in results)))
 
     # List outputs, main run routine
     def _list_outputs(self):
@@ -637,6 +1016,8 @@ class DataSink(IOBase):
         iflogger = logging.getLogger('interface')
         outputs = self.output_spec().get()
         out_files = []
+        s3_transfers = []
+        local_copies = []
         # Use hardlink
         use_hardlink = str2bool(config.get('execution', 'try_hard_link_datasink'))
 
@@ -729,7 +1110,7 @@ class DataSink(IOBase):
 
                 # If we're uploading to S3
                 if s3_flag:
-                    self._upload_to_s3(bucket, src, s3dst)
+                    s3_transfers.append((src, s3dst))
                     out_files.append(s3dst)
                 # Otherwise, copy locally src -> dst
                 if not s3_flag or isdefined(self.inputs.local_copy):
@@ -744,19 +1125,24 @@ class DataSink(IOBase):
                                 raise(inst)
                     # If src is a file, copy it to dst
                     if os.path.isfile(src):
-                        iflogger.debug('copyfile: %s %s' % (src, dst))
-                        copyfile(src, dst, copy=True, hashmethod='content',
-                                 use_hardlink=use_hardlink)
+                        local_copies.append((src, dst))
                         out_files.append(dst)
                     # If src is a directory, copy entire contents to dst dir
                     elif os.path.isdir(src):
                         if os.path.exists(dst) and self.inputs.remove_dest_dir:
                             iflogger.debug('removing: %s' % dst)
                             shutil.rmtree(dst)
-                        iflogger.debug('copydir: %s %s' % (src, dst))
-                        copytree(src, dst)
+                        local_copies.append((src, dst))
                         out_files.append(dst)
 
+        # Copy everything locally at once
+        if local_copies:
+            self._copy_locally(local_copies, use_hardlink)
+
+        # Upload everything to S3 at once
+        if s3_transfers:
+            self._upload_to_s3(bucket, s3_transfers)
+
         # Return outputs dictionary
         outputs['out_file'] = out_files
 
@@ -786,6 +1172,9 @@ class S3DataGrabberInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     template_args = traits.Dict(key_trait=Str,
                                 value_trait=traits.List(traits.List),
                                 desc='Information to plug into template')
+    s3_transfers = traits.Int(4, usedefault=True,
+                              desc='Number of files downloaded at the same '
+                                   'time')
 
 
 class S3DataGrabber(IOBase):
@@ -800,6 +1189,11 @@ class S3DataGrabber(IOBase):
         "template" uses regex style formatting, rather than the
         glob-style found in the original DataGrabber.
 
+        Only the part of the bucket under the literal beginning of each
+        template is listed. Files already present in "local_directory" with
+        the same contents are not downloaded again, and interrupted
+        downloads are resumed on the next run.
+
     """
     input_spec = S3DataGrabberInputSpec
     output_spec = DynamicTraitedSpec
@@ -866,10 +1260,10 @@ class S3DataGrabber(IOBase):
                     raise ValueError(msg)
 
         outputs = {}
-        # get list of all files in s3 bucket
-        conn = boto.connect_s3(anon=self.inputs.anon)
-        bkt = conn.get_bucket(self.inputs.bucket)
-        bkt_files = list(k.key for k in bkt.list())
+        transfers = S3TransferManager(self._s3_client(), self.inputs.bucket,
+                                      n_procs=self.inputs.s3_transfers)
+        # bucket listings by key prefix
+        listings = {}
 
         # keys are outfields, args are template args for the outfield
         for key, args in list(self.inputs.template_args.items()):
@@ -882,10 +1276,7 @@ class S3DataGrabber(IOBase):
             if isdefined(self.inputs.bucket_path):
                 template = os.path.join(self.inputs.bucket_path, template)
             if not args:
-                filelist = []
-                for fname in bkt_files:
-                    if re.match(template, fname):
-                        filelist.append(fname)
+                filelist = self._match_keys(transfers, listings, template)
                 if len(filelist) == 0:
                     msg = 'Output key: %s Template: %s returned no files' % (
                         key, template)
@@ -923,10 +1314,8 @@ class S3DataGrabber(IOBase):
                             filledtemplate = template % tuple(argtuple)
                         except TypeError as e:
                             raise TypeError(e.message + ": Template %s failed to convert with args %s" % (template, str(tuple(argtuple))))
-                    outfiles = []
-                    for fname in bkt_files:
-                        if re.match(filledtemplate, fname):
-                            outfiles.append(fname)
+                    outfiles = self._match_keys(transfers, listings,
+                                                filledtemplate)
                     if len(outfiles) == 0:
                         msg = 'Output key: %s Template: %s returned no files' % (key, filledtemplate)
                         if self.inputs.raise_on_empty:
@@ -947,23 +1336,45 @@ class S3DataGrabber(IOBase):
         # Outputs are currently stored as locations on S3.
         # We must convert to the local location specified
         # and download the files.
-        for key,val in outputs.items():
-            #This will basically be either list-like or string-like:
-            #if it has the __iter__ attribute, it's list-like (list,
-            #tuple, numpy array) and we iterate through each of its
-            #values. If it doesn't, it's string-like (string,
-            #unicode), and we convert that value directly.
-            if hasattr(val,'__iter__'):
-                for i,path in enumerate(val):
-                    outputs[key][i] = self.s3tolocal(path, bkt)
-            else:
-                outputs[key] = self.s3tolocal(val, bkt)
+        downloads = []
+        for key, val in list(outputs.items()):
+            outputs[key] = self._localize(val, downloads)
+        transfers.download(downloads)
 
         return outputs
 
-    # Takes an s3 address and downloads the file to a local
-    # directory, returning the local path.
-    def s3tolocal(self, s3path, bkt):
+    def _s3_client(self):
+        import boto3
+        from botocore import UNSIGNED
+        from botocore.client import Config
+
+        session = boto3.session.Session(region_name=self.inputs.region)
+        if self.inputs.anon:
+            return session.client('s3',
+                                  config=Config(signature_version=UNSIGNED))
+        return session.client('s3')
+
+    # Only list the part of the bucket a template can match, and reuse
+    # listings that already cover it.
+    def _match_keys(self, transfers, listings, template):
+        prefix = _regex_prefix(template)
+        for listed, keys in list(listings.items()):
+            if prefix.startswith(listed):
+                break
+        else:
+            keys = listings[prefix] = transfers.list(prefix)
+        return [key for key in keys if re.match(template, key)]
+
+    def _localize(self, val, downloads):
+        if isinstance(val, list):
+            return [self._localize(item, downloads) for item in val]
+        if val is None:
+            return val
+        localpath = self._local_path(val)
+        downloads.append((val, localpath))
+        return localpath
+
+    def _local_path(self, s3path):
         # path formatting
         if not os.path.split(self.inputs.local_directory)[1] == '':
             self.inputs.local_directory += '/'
@@ -972,13 +1383,26 @@ class S3DataGrabber(IOBase):
         if self.inputs.template[0] == '/':
             self.inputs.template = self.inputs.template[1:]
 
-        localpath = s3path.replace(self.inputs.bucket_path, self.inputs.local_directory)
+        return s3path.replace(self.inputs.bucket_path,
+                              self.inputs.local_directory)
+
+    # Takes an s3 address and downloads the file to a local
+    # directory, returning the local path. bkt is an S3TransferManager, or,
+    # as before, a boto or boto3 bucket, or None for the input bucket.
+    def s3tolocal(self, s3path, bkt=None):
+        localpath = self._local_path(s3path)
+        if bkt is None:
+            bkt = S3TransferManager(self._s3_client(), self.inputs.bucket)
+        if isinstance(bkt, S3TransferManager):
+            bkt.download([(s3path, localpath)])
+            return localpath
         localdir = os.path.split(localpath)[0]
         if not os.path.exists(localdir):
             os.makedirs(localdir)
-        k = boto.s3.key.Key(bkt)
-        k.key = s3path
-        k.get_contents_to_filename(localpath)
+        if hasattr(bkt, 'download_file'):
+            bkt.download_file(s3path, localpath)
+        else:
+            bkt.get_key(s3path).get_contents_to_filename(localpath)
         return localpath
 
 
@@ -1124,7 +1548,7 @@ class DataGrabber(IOBase):
             else:
                 template = os.path.abspath(template)
             if not args:
-                filelist = glob.glob(template)
+                filelist = indexed_glob(template)
                 if len(filelist) == 0:
                     msg = 'Output key: %s Template: %s returned no files' % (
                         key, template)
@@ -1162,7 +1586,7 @@ class DataGrabber(IOBase):
                             filledtemplate = template % tuple(argtuple)
                         except TypeError as e:
                             raise TypeError(e.message + ": Template %s failed to convert with args %s" % (template, str(tuple(argtuple))))
-                    outfiles = glob.glob(filledtemplate)
+                    outfiles = indexed_glob(filledtemplate)
                     if len(outfiles) == 0:
                         msg = 'Output key: %s Template: %s returned no files' % (key, filledtemplate)
                         if self.inputs.raise_on_empty:
@@ -1303,7 +1727,7 @@ class SelectFiles(IOBase):
 
             # Fill in the template and glob for files
             filled_template = template.format(**info)
-            filelist = glob.glob(filled_template)
+            filelist = indexed_glob(filled_template)
 
             # Handle the case where nothing matched
             if not filelist:
@@ -1433,7 +1857,7 @@ class DataFinder(IOBase):
                     self._match_path(root_path)
                 continue
             # Walk through directory structure checking paths
-            for curr_dir, sub_dirs, files in os.walk(root_path):
+            for curr_dir, sub_dirs, files in indexed_walk(root_path):
                 # Determine the current depth from the root_path
                 curr_depth = (curr_dir.count(os.sep) -
                               root_path.count(os.sep))
@@ -1622,7 +2046,7 @@ class FreeSurferSource(IOBase):
             key = altkey
         globpattern = os.path.join(
             keydir, ''.join((globprefix, key, globsuffix)))
-        return [os.path.abspath(f) for f in glob.glob(globpattern)]
+        return [os.path.abspath(f) for f in indexed_glob(globpattern)]
 
     def _list_outputs(self):
         subjects_dir = self.inputs.subjects_dir
@@ -1638,6 +2062,46 @@ class FreeSurferSource(IOBase):
         return outputs
 
 
+class _XNATInterfaces(object):
+    """Hand out one pyxnat Interface per thread
+
+    pyxnat interfaces are not safe to share between threads, so each worker
+    of the XNAT interfaces' thread pools logs in on its own.
+    """
+
+    def __init__(self, inputs):
+        self._inputs = inputs
+        self._local = threading.local()
+
+    def get(self):
+        xnat = getattr(self._local, 'xnat', None)
+        if xnat is None:
+            cache_dir = self._inputs.cache_dir or tempfile.gettempdir()
+            if self._inputs.config:
+                xnat = pyxnat.Interface(config=self._inputs.config)
+            else:
+                xnat = pyxnat.Interface(self._inputs.server,
+                                        self._inputs.user,
+                                        self._inputs.pwd,
+                                        cache_dir
+                                        )
+            self._local.xnat = xnat
+        return xnat
+
+    def map(self, func, items, n_procs):
+        """Apply ``func(xnat, item)`` to items, ``n_procs`` at a time"""
+        items = list(items)
+        n_procs = max(1, min(n_procs, len(items)))
+        if n_procs == 1:
+            return [func(self.get(), item) for item in items]
+        pool = ThreadPool(n_procs)
+        try:
+            return pool.map(lambda item: func(self.get(), item), items)
+        finally:
+            pool.close()
+            pool.join()
+
+
 class XNATSourceInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
 
     query_template = Str(
@@ -1665,6 +2129,10 @@ class XNATSourceInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
 
     cache_dir = Directory(desc='Cache directory')
 
+    xnat_transfers = traits.Int(4, usedefault=True,
+                                desc='Number of queries and downloads run '
+                                     'at the same time')
+
 
 class XNATSource(IOBase):
     """ Generic XNATSource module that wraps around the pyxnat module in
@@ -1697,6 +2165,8 @@ class XNATSource(IOBase):
         >>> dg.inputs.query_template_args['func'] = [['sid','EPI_faces']]
         >>> dg.inputs.sid = 'IMAGEN_000000001274'
 
+        Each distinct query is sent once per run, and queries with their
+        downloads run ``xnat_transfers`` at a time.
 
     """
     input_spec = XNATSourceInputSpec
@@ -1751,17 +2221,6 @@ class XNATSource(IOBase):
         # infields are mandatory, however I could not figure out
         # how to set 'mandatory' flag dynamically, hence manual check
 
-        cache_dir = self.inputs.cache_dir or tempfile.gettempdir()
-
-        if self.inputs.config:
-            xnat = pyxnat.Interface(config=self.inputs.config)
-        else:
-            xnat = pyxnat.Interface(self.inputs.server,
-                                    self.inputs.user,
-                                    self.inputs.pwd,
-                                    cache_dir
-                                    )
-
         if self._infields:
             for key in self._infields:
                 value = getattr(self.inputs, key)
@@ -1772,25 +2231,19 @@ class XNATSource(IOBase):
                            )
                     raise ValueError(msg)
 
-        outputs = {}
+        # Gather the queries of all the outputs first, so that each one is
+        # sent once and they can run concurrently
+        queries = {}
         for key, args in list(self.inputs.query_template_args.items()):
-            outputs[key] = []
             template = self.inputs.query_template
             if hasattr(self.inputs, 'field_template') and \
                     isdefined(self.inputs.field_template) and \
                     key in self.inputs.field_template:
                 template = self.inputs.field_template[key]
             if not args:
-                file_objects = xnat.select(template).get('obj')
-                if file_objects == []:
-                    raise IOError('Template %s returned no files'
-                                  % template
-                                  )
-                outputs[key] = list_to_filename(
-                    [str(file_object.get())
-                     for file_object in file_objects
-                     if file_object.exists()
-                     ])
+                queries[key] = template
+                continue
+            queries[key] = []
             for argnum, arglist in enumerate(args):
                 maxlen = 1
                 for arg in arglist:
@@ -1803,7 +2256,6 @@ class XNATSource(IOBase):
                                              )
                         if len(arg) > maxlen:
                             maxlen = len(arg)
-                outfiles = []
                 for i in range(maxlen):
                     argtuple = []
                     for arg in arglist:
@@ -1815,36 +2267,25 @@ class XNATSource(IOBase):
                         else:
                             argtuple.append(arg)
                     if argtuple:
-                        target = template % tuple(argtuple)
-                        file_objects = xnat.select(target).get('obj')
-
-                        if file_objects == []:
-                            raise IOError('Template %s '
-                                          'returned no files' % target
-                                          )
-
-                        outfiles = list_to_filename(
-                            [str(file_object.get())
-                             for file_object in file_objects
-                             if file_object.exists()
-                             ]
-                        )
+                        queries[key].insert(i, template % tuple(argtuple))
                     else:
-                        file_objects = xnat.select(template).get('obj')
+                        queries[key].insert(i, template)
 
-                        if file_objects == []:
-                            raise IOError('Template %s '
-                                          'returned no files' % template
-                                          )
+        targets = []
+        for query in queries.values():
+            for target in filename_to_list(query):
+                if target not in targets:
+                    targets.append(target)
+        files = dict(zip(targets, _XNATInterfaces(self.inputs).map(
+            _xnat_fetch, targets, self.inputs.xnat_transfers)))
 
-                        outfiles = list_to_filename(
-                            [str(file_object.get())
-                             for file_object in file_objects
-                             if file_object.exists()
-                             ]
-                        )
-
-                    outputs[key].insert(i, outfiles)
+        outputs = {}
+        for key, query in list(queries.items()):
+            if not isinstance(query, list):
+                outputs[key] = list_to_filename(files[query])
+                continue
+            outputs[key] = [list_to_filename(files[target])
+                            for target in query]
             if len(outputs[key]) == 0:
                 outputs[key] = None
             elif len(outputs[key]) == 1:
@@ -1852,6 +2293,14 @@ class XNATSource(IOBase):
         return outputs
 
 
+def _xnat_fetch(xnat, target):
+    """Download the files matching an XNAT query, returns their paths"""
+    file_objects = xnat.select(target).get('obj')
+    if file_objects == []:
+        raise IOError('Template %s returned no files' % target)
+    return [str(file_object.get()) for file_object in file_objects]
+
+
 class XNATSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
 
     _outputs = traits.Dict(Str, value={}, usedefault=True)
@@ -1894,6 +2343,10 @@ class XNATSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
                               ),
                         usedefault=True)
 
+    xnat_transfers = traits.Int(4, usedefault=True,
+                                desc='Number of files uploaded at the same '
+                                     'time')
+
     def __setattr__(self, key, value):
         if key not in self.copyable_trait_names():
             self._outputs[key] = value
@@ -1905,6 +2358,9 @@ class XNATSink(IOBase):
     """ Generic datasink module that takes a directory containing a
         list of nifti files and provides a set of structured output
         fields.
+
+        Files are uploaded ``xnat_transfers`` at a time, once the first
+        file of each container has created it.
     """
     input_spec = XNATSinkInputSpec
 
@@ -1913,16 +2369,8 @@ class XNATSink(IOBase):
         """
 
         # setup XNAT connection
-        cache_dir = self.inputs.cache_dir or tempfile.gettempdir()
-
-        if self.inputs.config:
-            xnat = pyxnat.Interface(config=self.inputs.config)
-        else:
-            xnat = pyxnat.Interface(self.inputs.server,
-                                    self.inputs.user,
-                                    self.inputs.pwd,
-                                    cache_dir
-                                    )
+        interfaces = _XNATInterfaces(self.inputs)
+        xnat = interfaces.get()
 
         # if possible share the subject from the original project
         if self.inputs.share:
@@ -1971,18 +2419,57 @@ class XNATSink(IOBase):
             uri_template_args['reconstruction_id'] = quote_id(self.inputs.reconstruction_id)
 
         # gather outputs and upload them
+        uploads = []
         for key, files in list(self.inputs._outputs.items()):
 
             for name in filename_to_list(files):
 
                 if isinstance(name, list):
                     for i, file_name in enumerate(name):
-                        push_file(self, xnat, file_name,
-                                  '%s_' % i + key,
-                                  uri_template_args
-                                  )
+                        uploads.append(_xnat_file_uri(
+                            self, file_name, '%s_' % i + key,
+                            dict(uri_template_args)))
                 else:
-                    push_file(self, xnat, name, key, uri_template_args)
+                    uploads.append(_xnat_file_uri(
+                        self, name, key, dict(uri_template_args)))
+
+        first, rest = _xnat_first_uploads(uploads)
+        interfaces.map(_xnat_insert, first, 1)
+        interfaces.map(_xnat_insert, rest, self.inputs.xnat_transfers)
+
+        # shares the experiments back to the original project if relevant
+        shared = set()
+        for _, _, args in uploads:
+            if 'original_project' in args:
+                experiment = _XNAT_EXPERIMENT % args
+                if experiment not in shared:
+                    xnat.select(experiment).share(args['original_project'])
+                    shared.add(experiment)
+
+
+_XNAT_EXPERIMENT = ('/project/%(original_project)s'
+                    '/subject/%(subject_id)s/experiment/%(experiment_id)s')
+
+
+def _xnat_first_uploads(uploads):
+    """Split uploads into the first one to each resource, which creates
+    the resource (and its container) and must go one at a time, and the
+    others, which can then go concurrently"""
+    resources = set()
+    first, rest = [], []
+    for upload in uploads:
+        resource = upload[1].split('/file/')[0]
+        (rest if resource in resources else first).append(upload)
+        resources.add(resource)
+    return first, rest
+
+
+def _xnat_insert(xnat, upload):
+    file_name, uri, _ = upload
+    xnat.select(uri).insert(file_name,
+                            experiments='xnat:imageSessionData',
+                            use_label=True
+                            )
 
 
 def quote_id(string):
@@ -1993,7 +2480,8 @@ def unquote_id(string):
     return str(string).replace('---', '_')
 
 
-def push_file(self, xnat, file_name, out_key, uri_template_args):
+def _xnat_file_uri(self, file_name, out_key, uri_template_args):
+    """Return (file_name, uri, uri_template_args) of an upload"""
 
     # grab info from output file names
     val_list = [unquote_id(val)
@@ -2052,22 +2540,16 @@ def push_file(self, xnat, file_name, out_key, uri_template_args):
     for key in list(uri_template_args.keys()):
         uri_template_args[key] = unquote_id(uri_template_args[key])
 
-    # upload file
-    remote_file = xnat.select(uri_template % uri_template_args)
-    remote_file.insert(file_name,
-                       experiments='xnat:imageSessionData',
-                       use_label=True
-                       )
+    return file_name, uri_template % uri_template_args, uri_template_args
 
-    # shares the experiment back to the original project if relevant
-    if 'original_project' in uri_template_args:
 
-        experiment_template = (
-            '/project/%(original_project)s'
-            '/subject/%(subject_id)s/experiment/%(experiment_id)s'
-        )
+def push_file(self, xnat, file_name, out_key, uri_template_args):
+    upload = _xnat_file_uri(self, file_name, out_key, uri_template_args)
+    _xnat_insert(xnat, upload)
 
-        xnat.select(experiment_template % uri_template_args
+    # shares the experiment back to the original project if relevant
+    if 'original_project' in uri_template_args:
+        xnat.select(_XNAT_EXPERIMENT % uri_template_args
                     ).share(uri_template_args['original_project'])
 
 
@@ -2079,14 +2561,69 @@ def push_provenance():
     pass
 
 
+# Database connections kept open by the SQL sinks until the process exits,
+# keyed by process and database, each with the lock serializing its writes.
+_sql_connections = {}
+_sql_connections_lock = threading.Lock()
+
+
+def _close_sql_connections():
+    """Close the connections the SQL sinks of this process opened, which
+    also checkpoints the write-ahead logs of SQLite databases"""
+    with _sql_connections_lock:
+        for key in list(_sql_connections):
+            conn = _sql_connections.pop(key)[0]
+            # connections inherited through a fork belong to the parent
+            if key[0] == os.getpid():
+                conn.close()
+
+
+atexit.register(_close_sql_connections)
+
+
+def _sql_rows(inputs, input_names, batch):
+    """Return the rows a SQL sink writes for its current inputs
+
+    In batch mode list inputs hold one value per row, other inputs are
+    repeated on every row.
+    """
+    values = [getattr(inputs, name) for name in input_names]
+    if not batch:
+        return [values]
+    lengths = set(len(value) for value in values
+                  if isinstance(value, (list, tuple)))
+    if len(lengths) > 1:
+        raise ValueError('batch inputs must all have the same length, got '
+                         'lengths %s' % sorted(lengths))
+    n_rows = lengths.pop() if lengths else 1
+    columns = [value if isinstance(value, (list, tuple)) else [value] * n_rows
+               for value in values]
+    return list(zip(*columns))
+
+
 class SQLiteSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     database_file = File(exists=True, mandatory=True)
     table_name = Str(mandatory=True)
+    batch = traits.Bool(False, usedefault=True,
+                        desc='Inputs given as lists hold one value per row '
+                             '(e.g. joined by a JoinNode); all rows are '
+                             'written in one transaction')
+    wal = traits.Bool(False, usedefault=True,
+                      desc='Put the database in write-ahead logging mode, so '
+                           'that concurrent writers do not block readers. '
+                           'The mode is stored in the database file, and '
+                           'does not work on network filesystems')
 
 
 class SQLiteSink(IOBase):
     """ Very simple frontend for storing values into SQLite database.
 
+        The sinks of a process writing to the same database share one
+        connection, which is kept open until the process exits. With
+        ``batch`` set, list inputs are
+        written as one row per element with a single ``executemany``, which
+        is how results gathered by a JoinNode should be stored.
+
         .. warning::
 
             This is not a thread-safe node because it can write to a common
@@ -2102,6 +2639,11 @@ class SQLiteSink(IOBase):
         >>> sql.inputs.some_measurement = 11.4
         >>> sql.run() # doctest: +SKIP
 
+        >>> sql.inputs.batch = True
+        >>> sql.inputs.subject_id = ['s1', 's2', 's3']
+        >>> sql.inputs.some_measurement = [11.4, 10.2, 12.9]
+        >>> sql.run() # doctest: +SKIP
+
     """
     input_spec = SQLiteSinkInputSpec
 
@@ -2112,18 +2654,32 @@ class SQLiteSink(IOBase):
         self._input_names = filename_to_list(input_names)
         add_traits(self.inputs, [name for name in self._input_names])
 
+    def _connection(self):
+        """Return the shared connection to the database and its lock"""
+        stat = os.stat(self.inputs.database_file)
+        key = (os.getpid(), op.abspath(self.inputs.database_file),
+               stat.st_dev, stat.st_ino)
+        with _sql_connections_lock:
+            if key not in _sql_connections:
+                conn = sqlite3.connect(self.inputs.database_file, timeout=60,
+                                       check_same_thread=False)
+                _sql_connections[key] = (conn, threading.Lock())
+            return _sql_connections[key]
+
     def _list_outputs(self):
         """Execute this module.
         """
-        conn = sqlite3.connect(self.inputs.database_file,
-                               check_same_thread=False)
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO %s (" % self.inputs.table_name +
-                  ",".join(self._input_names) + ") VALUES (" +
-                  ",".join(["?"] * len(self._input_names)) + ")",
-                  [getattr(self.inputs, name) for name in self._input_names])
-        conn.commit()
-        c.close()
+        rows = _sql_rows(self.inputs, self._input_names, self.inputs.batch)
+        conn, lock = self._connection()
+        with lock:
+            if self.inputs.wal:
+                conn.execute('PRAGMA journal_mode=WAL')
+            # commits, or rolls back on error, as one transaction
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO %s (" % self.inputs.table_name +
+                    ",".join(self._input_names) + ") VALUES (" +
+                    ",".join(["?"] * len(self._input_names)) + ")", rows)
         return None
 
 
@@ -2138,11 +2694,18 @@ class MySQLSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     table_name = Str(mandatory=True)
     username = Str()
     password = Str()
+    batch = traits.Bool(False, usedefault=True,
+                        desc='Inputs given as lists hold one value per row '
+                             '(e.g. joined by a JoinNode); all rows are '
+                             'written in one transaction')
 
 
 class MySQLSink(IOBase):
     """ Very simple frontend for storing values into MySQL database.
 
+        Connections are kept open and reused by all the sinks of a process
+        writing to the same database, see SQLiteSink for ``batch``.
+
         Examples
         --------
 
@@ -2165,25 +2728,51 @@ class MySQLSink(IOBase):
         self._input_names = filename_to_list(input_names)
         add_traits(self.inputs, [name for name in self._input_names])
 
-    def _list_outputs(self):
-        """Execute this module.
-        """
+    def _connection(self):
         import MySQLdb
         if isdefined(self.inputs.config):
-            conn = MySQLdb.connect(db=self.inputs.database_name,
-                                   read_default_file=self.inputs.config)
+            key = (os.getpid(), op.abspath(self.inputs.config),
+                   self.inputs.database_name)
         else:
-            conn = MySQLdb.connect(host=self.inputs.host,
-                                   user=self.inputs.username,
-                                   passwd=self.inputs.password,
-                                   db=self.inputs.database_name)
-        c = conn.cursor()
-        c.execute("REPLACE INTO %s (" % self.inputs.table_name +
-                  ",".join(self._input_names) + ") VALUES (" +
-                  ",".join(["%s"] * len(self._input_names)) + ")",
-                  [getattr(self.inputs, name) for name in self._input_names])
-        conn.commit()
-        c.close()
+            key = (os.getpid(), self.inputs.host, self.inputs.username,
+                   self.inputs.database_name)
+        with _sql_connections_lock:
+            if key in _sql_connections:
+                conn, lock = _sql_connections[key]
+                try:
+                    conn.ping()
+                    return conn, lock
+                except MySQLdb.Error:
+                    "Connection dropped, open a new one"
+            if isdefined(self.inputs.config):
+                conn = MySQLdb.connect(db=self.inputs.database_name,
+                                       read_default_file=self.inputs.config)
+            else:
+                conn = MySQLdb.connect(host=self.inputs.host,
+                                       user=self.inputs.username,
+                                       passwd=self.inputs.password,
+                                       db=self.inputs.database_name)
+            _sql_connections[key] = (conn, threading.Lock())
+            return _sql_connections[key]
+
+    def _list_outputs(self):
+        """Execute this module.
+        """
+        conn, lock = self._connection()
+        rows = _sql_rows(self.inputs, self._input_names, self.inputs.batch)
+        with lock:
+            c = conn.cursor()
+            try:
+                c.executemany("REPLACE INTO %s (" % self.inputs.table_name +
+                              ",".join(self._input_names) + ") VALUES (" +
+                              ",".join(["%s"] * len(self._input_names)) + ")",
+                              rows)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                c.close()
         return None
 
 
@@ -2199,6 +2788,59 @@ class SSHDataGrabberInputSpec(DataGrabberInputSpec):
                                       desc='Use either fnmatch or regexp to express templates')
     ssh_log_to_file = Str('', usedefault=True,
                                  desc='If set SSH commands will be logged to the given file')
+    ssh_transfers = traits.Int(4, usedefault=True,
+                               desc='Number of files downloaded at the same '
+                                    'time')
+
+
+# SSH logins kept open by SSHDataGrabber, keyed by process and host, so that
+# all the grabbers of a process talking to the same server share them.
+_ssh_connections = {}
+_ssh_connections_lock = threading.Lock()
+# Parsed ssh config files, with the mtime they were parsed at
+_ssh_configs = {}
+
+
+def _load_ssh_config(path='~/.ssh/config'):
+    path = os.path.expanduser(path)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    cached = _ssh_configs.get(path)
+    if cached is None or cached[0] != mtime:
+        ssh_config = paramiko.SSHConfig()
+        if mtime is not None:
+            with open(path) as fp:
+                ssh_config.parse(fp)
+        cached = _ssh_configs[path] = (mtime, ssh_config)
+    return cached[1]
+
+
+class _SSHConnection(object):
+    """An SSH login and the SFTP channels opened over it"""
+
+    def __init__(self, client):
+        self.client = client
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    @contextmanager
+    def sftp(self):
+        """Borrow an SFTP channel, opening one if none is free"""
+        with self._lock:
+            sftp = self._idle.pop() if self._idle else None
+        if sftp is None:
+            sftp = self.client.open_sftp()
+        try:
+            yield sftp
+        finally:
+            with self._lock:
+                self._idle.append(sftp)
 
 
 class SSHDataGrabber(DataGrabber):
@@ -2207,6 +2849,10 @@ class SSHDataGrabber(DataGrabber):
         not need user and password so an SSH agent must be active in
         where this module is being run.
 
+        Connections are kept open and shared by all the SSHDataGrabbers of
+        a process that talk to the same host, remote directories are listed
+        once per run and matched files are downloaded ``ssh_transfers`` at a
+        time, each over its own SFTP channel.
 
         .. attention::
 
@@ -2327,6 +2973,9 @@ class SSHDataGrabber(DataGrabber):
                         (self.__class__.__name__, key)
                     raise ValueError(msg)
 
+        connection = self._get_connection()
+        listings = {}
+        downloads = []
         outputs = {}
         for key, args in list(self.inputs.template_args.items()):
             outputs[key] = []
@@ -2336,10 +2985,7 @@ class SSHDataGrabber(DataGrabber):
                     key in self.inputs.field_template:
                 template = self.inputs.field_template[key]
             if not args:
-                client = self._get_ssh_client()
-                sftp = client.open_sftp()
-                sftp.chdir(self.inputs.base_directory)
-                filelist = sftp.listdir()
+                filelist = self._listdir(connection, listings, '')
                 if self.inputs.template_expression == 'fnmatch':
                     filelist = fnmatch.filter(filelist, template)
                 elif self.inputs.template_expression == 'regexp':
@@ -2359,8 +3005,7 @@ class SSHDataGrabber(DataGrabber):
                         filelist = human_order_sorted(filelist)
                     outputs[key] = list_to_filename(filelist)
                 if self.inputs.download_files:
-                    for f in filelist:
-                        sftp.get(f, f)
+                    downloads.extend((f, f, False) for f in filelist)
             for argnum, arglist in enumerate(args):
                 maxlen = 1
                 for arg in arglist:
@@ -2387,12 +3032,10 @@ class SSHDataGrabber(DataGrabber):
                             filledtemplate = template % tuple(argtuple)
                         except TypeError as e:
                             raise TypeError(e.message + ": Template %s failed to convert with args %s" % (template, str(tuple(argtuple))))
-                    client = self._get_ssh_client()
-                    sftp = client.open_sftp()
-                    sftp.chdir(self.inputs.base_directory)
                     filledtemplate_dir = os.path.dirname(filledtemplate)
                     filledtemplate_base = os.path.basename(filledtemplate)
-                    filelist = sftp.listdir(filledtemplate_dir)
+                    filelist = self._listdir(connection, listings,
+                                             filledtemplate_dir)
                     if self.inputs.template_expression == 'fnmatch':
                         outfiles = fnmatch.filter(filelist, filledtemplate_base)
                     elif self.inputs.template_expression == 'regexp':
@@ -2412,11 +3055,9 @@ class SSHDataGrabber(DataGrabber):
                             outfiles = human_order_sorted(outfiles)
                         outputs[key].append(list_to_filename(outfiles))
                         if self.inputs.download_files:
-                            for f in outfiles:
-                                try:
-                                    sftp.get(os.path.join(filledtemplate_dir, f), f)
-                                except IOError:
-                                    iflogger.info('remote file %s not found' % f)
+                            downloads.extend(
+                                (os.path.join(filledtemplate_dir, f), f, True)
+                                for f in outfiles)
             if any([val is None for val in outputs[key]]):
                 outputs[key] = []
             if len(outputs[key]) == 0:
@@ -2424,15 +3065,79 @@ class SSHDataGrabber(DataGrabber):
             elif len(outputs[key]) == 1:
                 outputs[key] = outputs[key][0]
 
+        self._get_files(connection, downloads)
+
         for k, v in list(outputs.items()):
-            outputs[k] = os.path.join(os.getcwd(), v)
+            outputs[k] = self._local_path(v)
 
         return outputs
 
+    def _local_path(self, value):
+        if isinstance(value, list):
+            return [self._local_path(item) for item in value]
+        if value is None:
+            return value
+        return os.path.join(os.getcwd(), value)
+
+    # Remote directories are listed once per run
+    def _listdir(self, connection, listings, dirname):
+        path = posixpath.join(self.inputs.base_directory, dirname)
+        if path not in listings:
+            with connection.sftp() as sftp:
+                listings[path] = sftp.listdir(path or '.')
+        return listings[path]
+
+    def _get_files(self, connection, downloads):
+        """Fetch (remote, local, missing_ok) files over parallel channels"""
+        seen = set()
+        downloads = [item for item in downloads
+                     if not (item[1] in seen or seen.add(item[1]))]
+        if not downloads:
+            return
+
+        def get_batch(batch):
+            with connection.sftp() as sftp:
+                for remote, local, missing_ok in batch:
+                    try:
+                        sftp.get(posixpath.join(self.inputs.base_directory,
+                                                remote), local)
+                    except IOError:
+                        if not missing_ok:
+                            raise
+                        iflogger.info('remote file %s not found' % local)
+
+        n_procs = max(1, min(self.inputs.ssh_transfers, len(downloads)))
+        batches = [downloads[i::n_procs] for i in range(n_procs)]
+        if n_procs == 1:
+            get_batch(batches[0])
+            return
+        pool = ThreadPool(n_procs)
+        try:
+            pool.map(get_batch, batches)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _get_connection(self):
+        """Return the pooled connection to the host, logging in if needed"""
+        host = _load_ssh_config().lookup(self.inputs.hostname)
+        username = host.get('user')
+        if isdefined(self.inputs.username):
+            username = self.inputs.username
+        key = (os.getpid(), host['hostname'], host.get('port'), username,
+               host.get('proxycommand'))
+        with _ssh_connections_lock:
+            connection = _ssh_connections.get(key)
+            if connection is None or not connection.is_active():
+                connection = _SSHConnection(
+                    self._connect(host, username))
+                _ssh_connections[key] = connection
+        return connection
+
     def _get_ssh_client(self):
-        config = paramiko.SSHConfig()
-        config.parse(open(os.path.expanduser('~/.ssh/config')))
-        host = config.lookup(self.inputs.hostname)
+        return self._get_connection().client
+
+    def _connect(self, host, username):
         if 'proxycommand' in host:
             proxy = paramiko.ProxyCommand(
                 subprocess.check_output(
@@ -2441,17 +3146,115 @@ class SSHDataGrabber(DataGrabber):
             )
         else:
             proxy = None
+        password = None
+        if isdefined(self.inputs.password):
+            password = self.inputs.password
         client = paramiko.SSHClient()
         client.load_system_host_keys()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(host['hostname'], username=host['user'], sock=proxy)
+        client.connect(host['hostname'], port=int(host.get('port', 22)),
+                       username=username, password=password, sock=proxy)
         return client
 
 
+# A faster JSON module than simplejson, used when installed. ujson is not,
+# as by default it rounds floats and escapes slashes.
+try:
+    import rapidjson as _fast_json
+except ImportError:
+    _fast_json = None
+
+
+def _json_loads(text):
+    if _fast_json is not None:
+        try:
+            return _fast_json.loads(text)
+        except ValueError:
+            """Let simplejson parse, or report, what the backend rejects"""
+    import simplejson
+    return simplejson.loads(text)
+
+
+# ijson decodes only the requested first-level entries of a JSON file for
+# JSONFileGrabber's keys, when installed (3.1 or later, for use_float).
+try:
+    import ijson as _ijson
+    if not hasattr(_ijson, 'kvitems'):
+        _ijson = None
+except ImportError:
+    _ijson = None
+
+
+def _json_load_keys(in_file, keys):
+    """Decode the first-level entries ``keys`` of the JSON object in
+    ``in_file``. With ijson, the other entries are scanned but not built,
+    and reading stops once all the keys are found."""
+    keys = set(keys)
+    if _ijson is None:
+        with open(in_file, 'r') as f:
+            data = _json_loads(f.read())
+        if not isinstance(data, dict):
+            raise RuntimeError('JSON input has no dictionary structure')
+        return dict((key, data[key]) for key in keys if key in data)
+
+    data = {}
+    with open(in_file, 'rb') as f:
+        if f.read(4096).lstrip()[:1] != b'{':
+            raise RuntimeError('JSON input has no dictionary structure')
+        f.seek(0)
+        for key, value in _ijson.kvitems(f, '', use_float=True):
+            if key in keys:
+                data[key] = value
+                if len(data) == len(keys):
+                    break
+    return data
+
+
+def _json_dumps(obj):
+    if _fast_json is not None:
+        try:
+            return _fast_json.dumps(obj, ensure_ascii=False)
+        except (TypeError, ValueError, OverflowError):
+            """e.g. non-string keys, which simplejson converts"""
+    import simplejson
+    return simplejson.dumps(obj, ensure_ascii=False)
+
+
+def _append_line(out_file, line):
+    """Append a line to a file shared with other processes
+
+    The line is written with a single write on a descriptor opened in
+    append mode, under the lock AddCSVRow uses when lockfile is installed,
+    as appends are not atomic on network filesystems.
+    """
+    data = line.encode('utf-8')
+    try:
+        import lockfile as pl
+    except ImportError:
+        lock = None
+    else:
+        lock = pl.FileLock(out_file)
+        lock.acquire()
+    try:
+        fd = os.open(out_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+        try:
+            written = os.write(fd, data)
+            # only interrupted writes are short
+            while written < len(data):
+                written += os.write(fd, data[written:])
+        finally:
+            os.close(fd)
+    finally:
+        if lock is not None:
+            lock.release()
+
+
 class JSONFileGrabberInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     in_file = File(exists=True, desc='JSON source file')
     defaults = traits.Dict(desc=('JSON dictionary that sets default output'
                                  'values, overridden by values found in in_file'))
+    keys = traits.List(Str, desc=('Only output these first-level entries of '
+                                  'in_file, the others are skipped'))
 
 
 class JSONFileGrabber(IOBase):
@@ -2475,6 +3278,15 @@ class JSONFileGrabber(IOBase):
     >>> pprint.pprint(res.outputs.get())  # doctest: +NORMALIZE_WHITESPACE, +ELLIPSIS +ALLOW_UNICODE
     {'param1': 'exampleStr', 'param2': 4, 'param3': 1.0}
 
+    Only some of the entries can be output:
+
+    >>> jsonSource.inputs.keys = ['param2']
+    >>> res = jsonSource.run()
+    >>> pprint.pprint(res.outputs.get())  # doctest: +NORMALIZE_WHITESPACE, +ELLIPSIS +ALLOW_UNICODE
+    {'param1': 'overrideMe', 'param2': 4, 'param3': 1.0}
+
+    rapidjson is used to decode when installed. With ``keys``, ijson is used
+    when installed, so that the other entries are not decoded.
 
     """
     input_spec = JSONFileGrabberInputSpec
@@ -2482,18 +3294,17 @@ class JSONFileGrabber(IOBase):
     _always_run = True
 
     def _list_outputs(self):
-        import simplejson
-
         outputs = {}
         if isdefined(self.inputs.in_file):
-            with open(self.inputs.in_file, 'r') as f:
-                data = simplejson.load(f)
-
-            if not isinstance(data, dict):
-                raise RuntimeError('JSON input has no dictionary structure')
-
-            for key, value in list(data.items()):
-                outputs[key] = value
+            if isdefined(self.inputs.keys) and self.inputs.keys:
+                data = _json_load_keys(self.inputs.in_file, self.inputs.keys)
+            else:
+                with open(self.inputs.in_file, 'r') as f:
+                    data = _json_loads(f.read())
+                if not isinstance(data, dict):
+                    raise RuntimeError(
+                        'JSON input has no dictionary structure')
+            outputs.update(data)
 
         if isdefined(self.inputs.defaults):
             defaults = self.inputs.defaults
@@ -2508,6 +3319,9 @@ class JSONFileSinkInputSpec(DynamicTraitedSpec, BaseInterfaceInputSpec):
     out_file = File(desc='JSON sink file')
     in_dict = traits.Dict(value={}, usedefault=True,
                           desc='input JSON dictionary')
+    jsonl = traits.Bool(False, usedefault=True,
+                        desc=('Append the dictionary as one line of a JSON '
+                              'Lines file instead of overwriting out_file'))
     _outputs = traits.Dict(value={}, usedefault=True)
 
     def __setattr__(self, key, value):
@@ -2553,6 +3367,14 @@ class JSONFileSink(IOBase):
         ...                            'some_measurement': 11.4}
         >>> dictsink.run() # doctest: +SKIP
 
+        Many nodes can collect their values in a single JSON Lines file,
+        each run appending one line:
+
+        >>> qcsink = JSONFileSink(input_names=['subject_id', 'fd_mean'])
+        >>> qcsink.inputs.out_file = '/data/group/qc.jsonl'
+        >>> qcsink.inputs.jsonl = True
+        >>> qcsink.run() # doctest: +SKIP
+
     """
     input_spec = JSONFileSinkInputSpec
     output_spec = JSONFileSinkOutputSpec
@@ -2584,11 +3406,11 @@ class JSONFileSink(IOBase):
         return name, val
 
     def _list_outputs(self):
-        import simplejson
         import os.path as op
 
         if not isdefined(self.inputs.out_file):
-            out_file = op.abspath('datasink.json')
+            out_file = op.abspath('datasink.jsonl' if self.inputs.jsonl
+                                  else 'datasink.json')
         else:
             out_file = op.abspath(self.inputs.out_file)
 
@@ -2601,8 +3423,11 @@ class JSONFileSink(IOBase):
             key, val = self._process_name(key, val)
             out_dict[key] = val
 
-        with open(out_file, 'w') as f:
-            f.write(str(simplejson.dumps(out_dict, ensure_ascii=False)))
+        if self.inputs.jsonl:
+            _append_line(out_file, str(_json_dumps(out_dict)) + '\n')
+        else:
+            with open(out_file, 'w') as f:
+                f.write(str(_json_dumps(out_dict)))
 
         outputs = self.output_spec().get()
         outputs['out_file'] = out_file
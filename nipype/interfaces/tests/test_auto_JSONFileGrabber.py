@@ -9,6 +9,7 @@ def test_JSONFileGrabber_inputs():
     usedefault=True,
     ),
     in_file=dict(),
+    keys=dict(),
     )
     inputs = JSONFileGrabber.input_spec()
 
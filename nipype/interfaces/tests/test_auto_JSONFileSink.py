@@ -11,6 +11,8 @@ def test_JSONFileSink_inputs():
     ),
     in_dict=dict(usedefault=True,
     ),
+    jsonl=dict(usedefault=True,
+    ),
     out_file=dict(),
     )
     inputs = JSONFileSink.input_spec()
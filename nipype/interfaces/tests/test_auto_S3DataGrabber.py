@@ -18,6 +18,8 @@ def test_S3DataGrabber_inputs():
     ),
     region=dict(usedefault=True,
     ),
+    s3_transfers=dict(usedefault=True,
+    ),
     sort_filelist=dict(mandatory=True,
     ),
     template=dict(mandatory=True,
@@ -20,6 +20,8 @@ def test_SSHDataGrabber_inputs():
     ),
     ssh_log_to_file=dict(usedefault=True,
     ),
+    ssh_transfers=dict(usedefault=True,
+    ),
     template=dict(mandatory=True,
     ),
     template_args=dict(),
@@ -31,6 +31,8 @@ def test_XNATSink_inputs():
     subject_id=dict(mandatory=True,
     ),
     user=dict(),
+    xnat_transfers=dict(usedefault=True,
+    ),
     )
     inputs = XNATSink.input_spec()
 
@@ -21,6 +21,8 @@ def test_XNATSource_inputs():
     xor=['config'],
     ),
     user=dict(),
+    xnat_transfers=dict(usedefault=True,
+    ),
     )
     inputs = XNATSource.input_spec()
 
@@ -345,6 +345,57 @@ def test_TraitedSpec_withNoFileHashing(setup_file):
     assert hashval1[1] != hashval2[1]
 
 
+def test_TraitedSpec_hashval_memoized(setup_file):
+    tmp_infile = setup_file
+
+    class spec2(nib.TraitedSpec):
+        moo = nib.File(exists=True)
+        doo = nib.traits.List(nib.traits.Int)
+    infields = spec2(moo=tmp_infile, doo=[1])
+    hashval = infields.get_hashval(hash_method='content')
+    assert infields.get_hashval(hash_method='content') == hashval
+    assert infields.get_hashval(hash_method='timestamp') != hashval
+
+    # in-place changes of a trait invalidate the memoized hash
+    infields.doo.append(2)
+    hashval2 = infields.get_hashval(hash_method='content')
+    assert hashval2[1] != hashval[1]
+    infields.doo = [1]
+    assert infields.get_hashval(hash_method='content') == hashval
+
+    # so do changes of the hashed files
+    with open(tmp_infile, 'w') as fp:
+        fp.write(u'987654321 changed')
+    assert infields.get_hashval(hash_method='content')[1] != hashval[1]
+
+
+def test_TraitedSpec_hashval_untracked():
+    from threading import Lock
+
+    class spec2(nib.TraitedSpec):
+        foo = nib.traits.Any
+        lock = nib.traits.Any
+    # values that cannot be deep copied are hashed
+    infields = spec2(foo=[1], lock=Lock())
+    hashval = infields.get_hashval()
+    # and in-place changes that fire no trait notification are seen
+    infields.foo.append(2)
+    assert infields.get_hashval()[1] != hashval[1]
+
+
+def test_TraitedSpec_hashval_minlen():
+    from nipype.interfaces import fsl
+
+    # specs with List(minlen=1) traits, such as searchr_x, can be built
+    flirt = fsl.FLIRT()
+    hashval = flirt.inputs.get_hashval()
+    flirt.inputs.dof = 6
+    hashval2 = flirt.inputs.get_hashval()
+    assert hashval2[1] != hashval[1]
+    flirt.inputs.searchr_x = [-90, 90]
+    assert flirt.inputs.get_hashval()[1] != hashval2[1]
+
+
 def test_Interface():
     assert nib.Interface.input_spec == None
     assert nib.Interface.output_spec == None
@@ -5,6 +5,7 @@ from __future__ import print_function, unicode_literals
 from builtins import str, zip, range, open
 from future import standard_library
 import os
+import time
 import simplejson
 import glob
 import shutil
@@ -17,14 +18,6 @@ import nipype
 import nipype.interfaces.io as nio
 from nipype.interfaces.base import Undefined
 
-# Check for boto
-noboto = False
-try:
-    import boto
-    from boto.s3.connection import S3Connection, OrdinaryCallingFormat
-except ImportError:
-    noboto = True
-
 # Check for boto3
 noboto3 = False
 try:
@@ -33,6 +26,20 @@ try:
 except ImportError:
     noboto3 = True
 
+# Check for moto
+nomoto = False
+try:
+    from moto import mock_s3
+except ImportError:
+    nomoto = True
+
+# Check for paramiko
+noparamiko = False
+try:
+    import paramiko
+except ImportError:
+    noparamiko = True
+
 # Check for fakes3
 standard_library.install_aliases()
 from subprocess import check_call, CalledProcessError
@@ -51,7 +58,7 @@ def test_datagrabber():
     assert dg.inputs.template_args == {'outfiles': []}
 
 
-@pytest.mark.skipif(noboto, reason="boto library is not available")
+@pytest.mark.skipif(noboto3, reason="boto3 library is not available")
 def test_s3datagrabber():
     dg = nio.S3DataGrabber()
     assert dg.inputs.template == Undefined
@@ -59,6 +66,23 @@ def test_s3datagrabber():
     assert dg.inputs.template_args == {'outfiles': []}
 
 
+def test_s3datagrabber_s3tolocal_bucket(tmpdir):
+    class FakeBucket(object):
+        """boto3 Bucket stand-in, as passed by callers of s3tolocal"""
+        def download_file(self, key, filename):
+            with open(filename, 'w') as fp:
+                fp.write(key)
+
+    dg = nio.S3DataGrabber()
+    dg.inputs.bucket_path = 'ds001/'
+    dg.inputs.local_directory = str(tmpdir)
+    dg.inputs.template = '*'
+    localpath = dg.s3tolocal('ds001/sub001/anat.nii.gz', FakeBucket())
+    assert localpath == str(tmpdir.join('sub001', 'anat.nii.gz'))
+    with open(localpath) as fp:
+        assert fp.read() == 'ds001/sub001/anat.nii.gz'
+
+
 templates1 = {"model": "interfaces/{package}/model.py",
              "preprocess": "interfaces/{package}/pre*.py"}
 templates2 = {"converter": "interfaces/dcm{to!s}nii.py"}
@@ -103,7 +127,7 @@ def test_selectfiles_valueerror():
         sf.run()
 
 
-@pytest.mark.skipif(noboto, reason="boto library is not available")
+@pytest.mark.skipif(noboto3, reason="boto3 library is not available")
 def test_s3datagrabber_communication(tmpdir):
     dg = nio.S3DataGrabber(
         infields=['subj_id', 'run_num'], outfields=['func', 'struct'])
@@ -134,6 +158,364 @@ def test_s3datagrabber_communication(tmpdir):
     assert os.path.exists(struct_outfiles[1])
 
 
+@pytest.fixture()
+def moto_bucket(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with mock_s3():
+        resource = boto3.resource('s3', region_name='us-east-1')
+        yield resource.create_bucket(Bucket='test')
+
+
+@pytest.mark.parametrize("pattern, prefix", [
+    ('data/sub01/anat.nii', 'data/sub01/anat'),
+    ('^data/sub-[0-9]+/', 'data/sub-'),
+    ('data/sub01?/x', 'data/sub0'),
+    ('data/a|other/b', ''),
+    ('.*', ''),
+])
+def test_regex_prefix(pattern, prefix):
+    assert nio._regex_prefix(pattern) == prefix
+
+
+@pytest.mark.skipif(noboto3 or nomoto, reason="boto3 or moto library is not available")
+def test_s3_multipart_etag(moto_bucket, tmpdir):
+    chunksize = 5 * 1024 * 1024
+    src = tmpdir.join('big.bin')
+    src.write_binary(os.urandom(2 * chunksize + 1024))
+    transfers = nio.S3TransferManager(moto_bucket.meta.client, 'test',
+                                      chunksize=chunksize)
+
+    assert transfers.upload([(str(src), 'big.bin')]) == [True]
+    etag = moto_bucket.Object('big.bin').e_tag
+    assert etag.strip('"').endswith('-3')
+    assert nio._s3_etag_matches(str(src), etag, (chunksize,))
+    assert transfers.upload([(str(src), 'big.bin')]) == [False]
+
+    src.write_binary(os.urandom(2 * chunksize + 1024))
+    assert not nio._s3_etag_matches(str(src), etag, (chunksize,))
+    assert transfers.upload([(str(src), 'big.bin')]) == [True]
+
+
+@pytest.mark.skipif(noboto3 or nomoto, reason="boto3 or moto library is not available")
+def test_datasink_to_moto_s3(moto_bucket, tmpdir):
+    srcdir = tmpdir.mkdir('src')
+    files = []
+    for i in range(6):
+        files.append(srcdir.join('file%d.txt' % i))
+        files[-1].write('contents %d' % i)
+    srcdir.ensure('folder', 'nested.txt').write('nested')
+
+    ds = nio.DataSink(base_directory='s3://test', container='outputs',
+                      parameterization=False, bucket=moto_bucket)
+    setattr(ds.inputs, 'text', [str(f) for f in files])
+    setattr(ds.inputs, 'dir', str(srcdir.join('folder')))
+    res = ds.run()
+
+    assert len(res.outputs.out_file) == 7
+    keys = sorted(obj.key for obj in moto_bucket.objects.all())
+    assert keys == ['outputs/dir/folder/nested.txt'] + \
+        ['outputs/text/file%d.txt' % i for i in range(6)]
+    body = moto_bucket.Object('outputs/text/file3.txt').get()['Body']
+    assert body.read() == b'contents 3'
+
+
+@pytest.mark.skipif(noboto3 or nomoto, reason="boto3 or moto library is not available")
+def test_s3datagrabber_moto(moto_bucket, tmpdir, monkeypatch):
+    for key in ['data/sub01/anat.nii', 'data/sub02/anat.nii', 'other/x.nii']:
+        moto_bucket.put_object(Key=key, Body=key.encode() * 1000)
+
+    listed = []
+    list_keys = nio.S3TransferManager.list
+
+    def record_list(self, prefix=''):
+        listed.append(prefix)
+        return list_keys(self, prefix)
+    monkeypatch.setattr(nio.S3TransferManager, 'list', record_list)
+
+    dg = nio.S3DataGrabber(infields=['subj_id'], outfields=['anat'])
+    dg.inputs.bucket = 'test'
+    dg.inputs.bucket_path = 'data/'
+    dg.inputs.local_directory = str(tmpdir)
+    dg.inputs.sort_filelist = True
+    dg.inputs.template = '%s/anat.nii'
+    dg.inputs.subj_id = ['sub01', 'sub02']
+    res = dg.run()
+
+    assert res.outputs.anat == [str(tmpdir.join('sub01', 'anat.nii')),
+                                str(tmpdir.join('sub02', 'anat.nii'))]
+    assert tmpdir.join('sub02', 'anat.nii').read_binary() == \
+        b'data/sub02/anat.nii' * 1000
+    assert listed and all(prefix.startswith('data/') for prefix in listed)
+
+    # An interrupted download is picked up where it stopped
+    etag = moto_bucket.Object('data/sub01/anat.nii').e_tag.strip('"')
+    partial = tmpdir.join('sub01', 'anat.nii.%s.part' % etag)
+    content = b'data/sub01/anat.nii' * 1000
+    tmpdir.join('sub01', 'anat.nii').remove()
+    partial.write_binary(content[:5000])
+    dg.run()
+    assert tmpdir.join('sub01', 'anat.nii').read_binary() == content
+    assert not partial.exists()
+
+    # and checked against the ETag
+    tmpdir.join('sub01', 'anat.nii').remove()
+    partial.write_binary(b'x' * 5000)
+    with pytest.raises(IOError):
+        dg.run()
+    assert not partial.exists()
+
+
+if not noparamiko:
+    class StubSSHServer(paramiko.ServerInterface):
+        def check_auth_password(self, username, password):
+            return paramiko.AUTH_SUCCESSFUL
+
+        def get_allowed_auths(self, username):
+            return 'password'
+
+        def check_channel_request(self, kind, chanid):
+            return paramiko.OPEN_SUCCEEDED
+
+    class StubSFTPServer(paramiko.SFTPServerInterface):
+        """Read-only SFTP server rooted at StubSFTPServer.root"""
+        root = None
+
+        def _path(self, path):
+            return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+        def canonicalize(self, path):
+            return os.path.normpath(os.path.join('/', path))
+
+        def list_folder(self, path):
+            path = self._path(path)
+            return [paramiko.SFTPAttributes.from_stat(
+                os.stat(os.path.join(path, name)), name)
+                for name in os.listdir(path)]
+
+        def stat(self, path):
+            try:
+                return paramiko.SFTPAttributes.from_stat(
+                    os.stat(self._path(path)))
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+        lstat = stat
+
+        def open(self, path, flags, attr):
+            try:
+                fp = open(self._path(path), 'rb')
+            except (IOError, OSError) as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+            handle = paramiko.SFTPHandle(flags)
+            handle.readfile = fp
+            return handle
+
+
+@pytest.fixture()
+def sftp_server(tmpdir, monkeypatch):
+    """Serve tmpdir/remote over SFTP on localhost, as host 'stub'"""
+    import socket
+    import threading
+    remote = tmpdir.mkdir('remote')
+    StubSFTPServer.root = str(remote)
+    host_key = paramiko.RSAKey.generate(1024)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(5)
+    logins = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                            StubSFTPServer)
+            transport.start_server(server=StubSSHServer())
+            logins.append(transport)
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+
+    home = tmpdir.mkdir('home')
+    home.mkdir('.ssh').join('config').write(
+        'Host stub\n  HostName 127.0.0.1\n  Port %d\n  User test\n'
+        % sock.getsockname()[1])
+    monkeypatch.setenv('HOME', str(home))
+    yield remote, logins
+    sock.close()
+    for transport in logins:
+        transport.close()
+
+
+@pytest.mark.skipif(noparamiko, reason="paramiko library is not available")
+def test_sshdatagrabber(sftp_server, tmpdir, monkeypatch):
+    remote, logins = sftp_server
+    for sub in ['s1', 's2']:
+        for name in ['f3.nii', 'f5.nii', 'struct.nii']:
+            remote.ensure('data', sub, name).write(sub + name)
+
+    monkeypatch.chdir(tmpdir.mkdir('cwd'))
+    dg = nio.SSHDataGrabber(infields=['sid'], outfields=['func', 'struct'])
+    dg.inputs.hostname = 'stub'
+    dg.inputs.password = 'secret'
+    dg.inputs.base_directory = 'data'
+    dg.inputs.template = '%s/%s.nii'
+    dg.inputs.sort_filelist = True
+    dg.inputs.template_args = dict(func=[['sid', ['f3', 'f5']]],
+                                   struct=[['sid', 'struct']])
+    dg.inputs.sid = 's1'
+    res = dg.run()
+
+    cwd = str(tmpdir.join('cwd'))
+    assert res.outputs.func == [os.path.join(cwd, 'f3.nii'),
+                                os.path.join(cwd, 'f5.nii')]
+    assert res.outputs.struct == os.path.join(cwd, 'struct.nii')
+    assert tmpdir.join('cwd', 'f5.nii').read() == 's1f5.nii'
+
+    # A second grabber for the same host reuses the login
+    dg.inputs.sid = 's2'
+    dg.run()
+    assert tmpdir.join('cwd', 'struct.nii').read() == 's2struct.nii'
+    assert len(logins) == 1
+
+
+def test_sqlitesink(tmpdir):
+    import sqlite3
+    db = str(tmpdir.join('results.db'))
+    conn = sqlite3.connect(db)
+    conn.execute('CREATE TABLE results (subject_id TEXT PRIMARY KEY, '
+                 'run INTEGER, value REAL)')
+    conn.commit()
+
+    sql = nio.SQLiteSink(input_names=['subject_id', 'run', 'value'])
+    sql.inputs.database_file = db
+    sql.inputs.table_name = 'results'
+    sql.inputs.subject_id = 's0'
+    sql.inputs.run = 1
+    sql.inputs.value = 0.5
+    sql.run()
+
+    sql.inputs.batch = True
+    sql.inputs.subject_id = ['s%d' % i for i in range(1, 100)]
+    sql.inputs.value = [float(i) for i in range(1, 100)]
+    sql.run()
+
+    rows = conn.execute('SELECT subject_id, run, value FROM results '
+                        'ORDER BY value').fetchall()
+    assert len(rows) == 100
+    assert rows[0] == ('s0', 1, 0.5)
+    assert rows[-1] == ('s99', 1, 99.0)
+    # the journal mode of the database is left alone, and both runs used
+    # the same connection
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    assert len([key for key in nio._sql_connections if db in key]) == 1
+
+    sql.inputs.value = [1.0, 2.0]
+    with pytest.raises(ValueError):
+        sql.run()
+
+    conn.close()
+    sql.inputs.wal = True
+    sql.inputs.value = [float(i) for i in range(1, 100)]
+    sql.run()
+    # the write-ahead log is checkpointed when the connections are closed at
+    # exit
+    nio._close_sql_connections()
+    assert not [key for key in nio._sql_connections if db in key]
+    assert not os.path.exists(db + '-wal')
+    assert not os.path.exists(db + '-shm')
+    conn = sqlite3.connect(db)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+
+
+class FakeXNAT(object):
+    """Stand-in for pyxnat, records the requests sent to the server"""
+
+    def __init__(self, tmpdir):
+        self.tmpdir = tmpdir
+        self.logins = []
+        self.queries = []
+        self.inserts = []
+
+    def Interface(self, *args, **kwargs):
+        self.logins.append(args)
+        return self
+
+    def select(self, path):
+        return FakeXNATObject(self, path)
+
+
+class FakeXNATObject(object):
+
+    def __init__(self, xnat, path):
+        self.xnat = xnat
+        self.path = path
+
+    def get(self, *args):
+        if args:
+            self.xnat.queries.append(self.path)
+            subject = self.path.split('/')[4]
+            return [FakeXNATObject(self.xnat, '%s_%s.nii' % (subject, name))
+                    for name in ['a', 'b']]
+        local = self.xnat.tmpdir.join(self.path)
+        local.write(self.path)
+        return str(local)
+
+    def insert(self, file_name, **kwargs):
+        self.xnat.inserts.append(self.path)
+
+
+def test_xnat_batching(tmpdir, monkeypatch):
+    xnat = FakeXNAT(tmpdir)
+    monkeypatch.setattr(nio, 'pyxnat', xnat, raising=False)
+
+    xs = nio.XNATSource(infields=['sid'], outfields=['struct', 'func'],
+                        server='https://xnat.example.org', user='u', pwd='p',
+                        xnat_transfers=3)
+    xs.inputs.query_template = '/projects/p/subjects/%s/resources/*'
+    xs.inputs.query_template_args['struct'] = [['sid']]
+    xs.inputs.query_template_args['func'] = [['sid']]
+    xs.inputs.sid = ['s1', 's2', 's3']
+    res = xs.run()
+    assert res.outputs.struct == res.outputs.func
+    assert res.outputs.struct[1] == [str(tmpdir.join('s2_a.nii')),
+                                     str(tmpdir.join('s2_b.nii'))]
+    # each distinct query is sent once
+    assert sorted(xnat.queries) == ['/projects/p/subjects/s%d/resources/*' % i
+                                    for i in range(1, 4)]
+
+    files = []
+    for name in ['T1.nii', 'bold.nii', 'mask.nii']:
+        files.append(tmpdir.join('_subject_s1', name))
+        files[-1].write(name, ensure=True)
+    xk = nio.XNATSink(server='https://xnat.example.org', user='u', pwd='p',
+                      project_id='p', subject_id='s1', experiment_id='exp',
+                      xnat_transfers=3)
+    xk.inputs.anat = str(files[0])
+    xk.inputs.func = [str(f) for f in files[1:]]
+    xk.run()
+    assert len(xnat.inserts) == 3
+    assert set(path.rsplit('/', 1)[1] for path in xnat.inserts) == \
+        set(['T1.nii', 'bold.nii', 'mask.nii'])
+    assert len(set(path.split('/out/')[0] for path in xnat.inserts)) == 1
+
+
+def test_xnat_first_uploads():
+    container = '/project/p/subject/s1/experiment/exp/scan/1'
+    uploads = [('%s.nii' % i, '%s/out/resource/%s/file/%s.nii' % (
+        container, label, i), {}) for i, label in enumerate(
+            ['anat', 'anat', 'func', 'func', 'anat'])]
+    first, rest = nio._xnat_first_uploads(uploads)
+    # the first upload to each resource label goes on its own
+    assert first == [uploads[0], uploads[2]]
+    assert rest == [uploads[1], uploads[3], uploads[4]]
+
+
 def test_datagrabber_order(tmpdir):
     for file_name in ['sub002_L1_R1.q', 'sub002_L1_R2.q', 'sub002_L2_R1.q',
                       'sub002_L2_R2.qd', 'sub002_L3_R10.q', 'sub002_L3_R2.q']:
@@ -157,6 +539,32 @@ def test_datagrabber_order(tmpdir):
     assert 'sub002_L3_R10' in outfiles[2][1]
 
 
+def test_grabbers_see_new_files(tmpdir):
+    tmpdir.ensure('sub01', 'anat', 'T1.nii')
+    past = time.time() - 60
+    for dirpath in [str(tmpdir), str(tmpdir.join('sub01')),
+                    str(tmpdir.join('sub01', 'anat'))]:
+        os.utime(dirpath, (past, past))
+
+    dg = nio.DataGrabber(outfields=['anat'])
+    dg.inputs.base_directory = str(tmpdir)
+    dg.inputs.template = '*/anat/*.nii'
+    dg.inputs.sort_filelist = True
+    sf = nio.SelectFiles({'anat': '*/anat/*.nii'},
+                         base_directory=str(tmpdir), sort_filelist=True)
+    df = nio.DataFinder(root_paths=str(tmpdir), match_regex=r'.+\.nii$',
+                        unpack_single=True)
+    for interface, field in [(dg, 'anat'), (sf, 'anat'), (df, 'out_paths')]:
+        assert getattr(interface.run().outputs, field) == \
+            str(tmpdir.join('sub01', 'anat', 'T1.nii'))
+
+    tmpdir.ensure('sub01', 'anat', 'T2.nii')
+    expected = [str(tmpdir.join('sub01', 'anat', name))
+                for name in ['T1.nii', 'T2.nii']]
+    for interface, field in [(dg, 'anat'), (sf, 'anat'), (df, 'out_paths')]:
+        assert sorted(getattr(interface.run().outputs, field)) == expected
+
+
 def test_datasink():
     ds = nio.DataSink()
     assert ds.inputs.parameterization
@@ -303,6 +711,47 @@ def test_datasink_localcopy(dummy_input, tmpdir):
     assert src_md5 == dst_md5
 
 
+def test_datasink_skips_up_to_date(tmpdir, monkeypatch):
+    srcdir = tmpdir.mkdir('src')
+    files = []
+    for i in range(10):
+        files.append(srcdir.join('file%d.txt' % i))
+        files[-1].write('contents %d' % i)
+    srcdir.join('image.img').write('image')
+    srcdir.join('image.hdr').write('header')
+
+    ds = nio.DataSink(base_directory=str(tmpdir.join('out')),
+                      parameterization=False, copy_threads=3)
+    setattr(ds.inputs, 'text', [str(f) for f in files])
+    setattr(ds.inputs, 'image', str(srcdir.join('image.img')))
+    res = ds.run()
+    assert len(res.outputs.out_file) == 11
+    assert tmpdir.join('out', 'text', 'file7.txt').read() == 'contents 7'
+    assert tmpdir.join('out', 'image', 'image.hdr').read() == 'header'
+
+    # Nothing is copied, nor hashed, when the destinations are up to date
+    def fail(*args, **kwargs):
+        raise AssertionError('copyfile should not be called')
+    monkeypatch.setattr(nio, 'copyfile', fail)
+    ds.run()
+    monkeypatch.undo()
+
+    # but changed files, including related ones, are copied again
+    files[3].write('new contents')
+    srcdir.join('image.hdr').write('new header')
+    ds.run()
+    assert tmpdir.join('out', 'text', 'file3.txt').read() == 'new contents'
+    assert tmpdir.join('out', 'image', 'image.hdr').read() == 'new header'
+
+    # as are files rewritten with the same size within the same second
+    os.utime(str(files[5]), (1000000000.25, 1000000000.25))
+    ds.run()
+    files[5].write('contents X')
+    os.utime(str(files[5]), (1000000000.75, 1000000000.75))
+    ds.run()
+    assert tmpdir.join('out', 'text', 'file5.txt').read() == 'contents X'
+
+
 def test_datasink_substitutions(tmpdir):
     indir = tmpdir.mkdir('-Tmp-nipype_ds_subs_in')
     outdir = tmpdir.mkdir('-Tmp-nipype_ds_subs_out')
@@ -350,6 +799,9 @@ def test_datasink_copydir():
                                                       pth.split(sep)[-1],
                                                       fname))
     assert file_exists()
+    # directories are copied, not hard linked
+    assert not os.path.samefile(
+        os.path.join(outdir, pth.split(sep)[-1], fname), orig_img)
     shutil.rmtree(pth)
 
     orig_img, orig_hdr = _temp_analyze_files()
@@ -362,6 +814,50 @@ def test_datasink_copydir():
     shutil.rmtree(pth)
 
 
+def test_copytree(tmpdir, monkeypatch):
+    src = tmpdir.join('subject')
+    for i in range(3):
+        for j in range(20):
+            src.join('dir%d' % i, 'sub', 'f%d.txt' % j).write(
+                'contents %d %d' % (i, j), ensure=True)
+    # a symlinked loop is not followed back into the tree, but a symlink to
+    # a directory copied elsewhere in the tree is
+    src.join('dir0', 'loop').mksymlinkto(src)
+    src.join('dir2', 'alias').mksymlinkto(src.join('dir1'))
+
+    dst = tmpdir.join('copy')
+    nbytes, up_to_date = nio.copytree(str(src), str(dst), n_procs=4)
+    assert not up_to_date
+    assert dst.join('dir2', 'sub', 'f7.txt').read() == 'contents 2 7'
+    assert not dst.join('dir0', 'loop').check()
+    assert dst.join('dir2', 'alias', 'sub', 'f3.txt').read() == 'contents 1 3'
+    assert dst.join('dir1', 'sub', 'f1.txt').mtime() == \
+        src.join('dir1', 'sub', 'f1.txt').mtime()
+
+    # unchanged files are not copied again
+    def fail(*args):
+        raise AssertionError('copyfile should not be called')
+    monkeypatch.setattr(nio.shutil, 'copyfile', fail)
+    assert nio.copytree(str(src), str(dst), n_procs=4) == (nbytes, True)
+    monkeypatch.undo()
+
+    linked = tmpdir.join('linked')
+    nio.copytree(str(src), str(linked), use_hardlink=True)
+    assert os.path.samefile(str(linked.join('dir1', 'sub', 'f1.txt')),
+                            str(src.join('dir1', 'sub', 'f1.txt')))
+
+    # errors are reported once the rest of the tree is copied, for every
+    # path that fails, including through the dir2/alias copy of dir1
+    src.join('dir1', 'dangling').mksymlinkto(tmpdir.join('missing'))
+    src.join('dir2', 'new.txt').write('new')
+    with pytest.raises(Exception) as excinfo:
+        nio.copytree(str(src), str(dst), n_procs=4)
+    assert sorted(error[0] for error in excinfo.value.args[0]) == [
+        str(src.join('dir1', 'dangling')),
+        str(src.join('dir2', 'alias', 'dangling'))]
+    assert dst.join('dir2', 'new.txt').read() == 'new'
+
+
 def test_datafinder_depth(tmpdir):
     outdir = str(tmpdir)
     os.makedirs(os.path.join(outdir, '0', '1', '2', '3'))
@@ -433,4 +929,32 @@ def test_jsonsink(tmpdir, inputs_attributes):
     assert data == expected_data
 
 
-
+def test_jsonsink_jsonl(tmpdir):
+    tmpdir.chdir()
+    for sid in ['s1', 's2', 's3']:
+        js = nio.JSONFileSink(infields=['subject_id'], jsonl=True,
+                              out_file='qc.jsonl')
+        js.inputs.subject_id = sid
+        setattr(js.inputs, 'fd.mean', 0.1)
+        res = js.run()
+    with open(res.outputs.out_file, 'r') as f:
+        lines = [simplejson.loads(line) for line in f]
+    assert lines == [{'subject_id': sid, 'fd': {'mean': 0.1}}
+                     for sid in ['s1', 's2', 's3']]
+
+
+@pytest.mark.parametrize('incremental', [True, False])
+def test_jsongrabber_keys(tmpdir, monkeypatch, incremental):
+    if incremental and nio._ijson is None:
+        pytest.skip('ijson is not installed')
+    if not incremental:
+        monkeypatch.setattr(nio, '_ijson', None)
+    data = {'big': [{'a': '{[,"\\'}, list(range(1000))] * 100,
+            'name': 'sub-01', 'nested': {'x': [1, 2], 'y': None},
+            'last': 1.5}
+    in_file = tmpdir.join('data.json')
+    in_file.write(simplejson.dumps(data))
+    jg = nio.JSONFileGrabber(in_file=str(in_file), keys=['nested', 'last',
+                                                         'missing'])
+    res = jg.run()
+    assert res.outputs.get() == {'nested': data['nested'], 'last': 1.5}
@@ -4,7 +4,9 @@ from ..csv import CSVReader
 
 
 def test_CSVReader_inputs():
-    input_map = dict(header=dict(usedefault=True,
+    input_map = dict(as_arrays=dict(usedefault=True,
+    ),
+    header=dict(usedefault=True,
     ),
     in_file=dict(mandatory=True,
     ),
@@ -3,6 +3,8 @@
 # vi: set ft=python sts=4 ts=4 sw=4 et:
 from __future__ import print_function, unicode_literals
 
+import numpy as np
+
 from nipype.interfaces import utility
 
 
@@ -30,3 +32,31 @@ def test_csvReader(tmpdir):
                 assert out.outputs.column_0 == ['foo', 'bar', 'baz']
                 assert out.outputs.column_1 == ['hello', 'world', 'goodbye']
                 assert out.outputs.column_2 == ['300.1', '5', '0.3']
+
+
+def test_csvReader_arrays(tmpdir):
+    name = str(tmpdir.join("testfile.csv"))
+    with open(name, 'w') as fid:
+        fid.write("files,labels,erosion\n")
+        for i in range(25000):
+            fid.write("foo%d,%d,%d.5\n" % (i, i, i))
+    reader = utility.CSVReader(in_file=name, header=True, as_arrays=True)
+    out = reader.run()
+    assert out.outputs.files.dtype.kind == 'U'
+    assert out.outputs.files[-1] == 'foo24999'
+    assert out.outputs.labels.dtype.kind == 'i'
+    assert np.all(out.outputs.labels == np.arange(25000))
+    assert np.allclose(out.outputs.erosion, np.arange(25000) + 0.5)
+
+
+def test_csvReader_arrays_overflow(tmpdir):
+    name = str(tmpdir.join("testfile.csv"))
+    with open(name, 'w') as fid:
+        fid.write("ids,labels\n")
+        fid.write("1,%d\n" % 10 ** 30)
+        fid.write("2,1\n")
+    reader = utility.CSVReader(in_file=name, header=True, as_arrays=True)
+    out = reader.run()
+    assert out.outputs.ids.dtype.kind == 'i'
+    assert out.outputs.labels.dtype.kind == 'f'
+    assert np.allclose(out.outputs.labels, [1e30, 1])
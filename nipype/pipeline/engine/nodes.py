@@ -51,7 +51,9 @@ from ...interfaces.base import (traits, InputMultiPath, CommandLine,
 from .utils import (generate_expanded_graph, modify_paths,
                     export_graph, make_output_dir, write_workflow_prov,
                     clean_working_directory, format_dot, topological_sort,
-                    get_print_name, merge_dict, evaluate_connect_function)
+                    get_print_name, merge_dict, evaluate_connect_function,
+                    store_outputs, reuse_stored_outputs,
+                    release_stored_outputs)
 from .base import EngineBase
 
 logger = logging.getLogger('workflow')
@@ -159,6 +161,7 @@ class Node(EngineBase):
         self._interface = interface
         self.name = name
         self._result = None
+        self._hashvalue = None
         self.iterables = iterables
         self.synchronize = synchronize
         self.itersource = itersource
@@ -278,6 +281,7 @@ class Node(EngineBase):
             logger.debug('Output dir: %s', to_str(os.listdir(outdir)))
         hash_info = self.hash_exists(updatehash=updatehash)
         hash_exists, hashvalue, hashfile, hashed_inputs = hash_info
+        self._hashvalue = hashvalue
         logger.debug(
             'updatehash=%s, overwrite=%s, always_run=%s, hash_exists=%s',
             updatehash, self.overwrite, self._interface.always_run, hash_exists)
@@ -331,6 +335,8 @@ class Node(EngineBase):
                          (op.exists(hashfile_unfinished) and
                              self._interface.can_resume) and not
                          isinstance(self, MapNode))
+            # the directory is emptied, or its files are rewritten in place
+            release_stored_outputs(outdir, unshare=not rm_outdir)
             if rm_outdir:
                 logger.debug("Removing old %s and its contents", outdir)
                 try:
@@ -362,12 +368,20 @@ class Node(EngineBase):
             savepkl(op.join(outdir, '_node.pklz'), self)
             savepkl(op.join(outdir, '_inputs.pklz'),
                     self.inputs.get_traitsfree())
+            store = self.config['execution'].get('output_store')
+            if isinstance(self, MapNode) or self._interface.always_run:
+                store = None
             try:
-                self._run_interface()
+                reused = store and reuse_stored_outputs(store, self, outdir,
+                                                        hashed_inputs)
+                self._run_interface(execute=not reused)
             except:
                 os.remove(hashfile_unfinished)
                 raise
             shutil.move(hashfile_unfinished, hashfile)
+            if store and not reused:
+                store_outputs(store, self, outdir, hashed_inputs,
+                              self._result)
             self.write_report(report_type='postexec', cwd=outdir)
         else:
             if not op.exists(op.join(outdir, '_inputs.pklz')):
@@ -10,12 +10,14 @@ import os
 from copy import deepcopy
 from shutil import rmtree
 import pytest
+import prov.model as pm
 
 from ... import engine as pe
 from ....interfaces import base as nib
 from ....interfaces import utility as niu
 from .... import config
-from ..utils import merge_dict, clean_working_directory, write_workflow_prov
+from ..utils import (merge_dict, clean_working_directory, write_workflow_prov,
+                     WorkflowProvWriter)
 
 
 def test_identitynode_removal():
@@ -339,6 +341,28 @@ def test_provenance(tmpdir):
     assert len(psg.get_records()) == 7
 
 
+def test_provenance_writer(tmpdir):
+    out_dir = str(tmpdir)
+    metawf = pe.Workflow(name='meta')
+    metawf.base_dir = out_dir
+    metawf.add_nodes([create_wf('wf%d' % i) for i in range(2)])
+    statuses = []
+    writer = WorkflowProvWriter(
+        status_callback=lambda node, status: statuses.append(status))
+    eg = metawf.run(plugin='Linear',
+                    plugin_args={'status_callback': writer})
+    assert statuses.count('end') == 4
+    prov_base = os.path.join(out_dir, 'workflow_provenance_test')
+    psg = writer.write(eg, prov_base, format='provn')
+    assert os.path.exists(prov_base + '.provn')
+    assert len(psg.bundles) == 4
+    assert len(psg.get_records()) == 14
+    # the hashes recorded at execution time are used
+    hashvals = sorted(record.get_attribute('nipype:hashval').pop()
+                      for record in psg.get_records(pm.ProvActivity))
+    assert hashvals == sorted(node.hash_exists()[1] for node in eg.nodes())
+
+
 def dummy_func(value):
     return value + 1
 
@@ -389,3 +413,135 @@ def test_mapnode_crash3(tmpdir):
     wf.base_dir = str(tmpdir)
     with pytest.raises(RuntimeError):
         wf.run(plugin='Linear')
+
+
+def make_file(value):
+    import os
+    out_file = os.path.abspath('out.txt')
+    with open(out_file, 'wt') as fp:
+        fp.write('%d' % value)
+    return out_file
+
+
+def test_output_store(tmpdir):
+    from ..utils import release_stored_outputs
+    store = tmpdir.join('store')
+    out_files = []
+    for name in ['wf1', 'wf2']:
+        wf = pe.Workflow(name=name, base_dir=str(tmpdir))
+        wf.config['execution']['output_store'] = str(store)
+        node = pe.Node(niu.Function(input_names=['value'],
+                                    output_names=['out_file'],
+                                    function=make_file),
+                       name='make_file_%s' % name)
+        node.inputs.value = 1
+        wf.add_nodes([node])
+        eg = wf.run()
+        out_files.append(eg.nodes()[0].result.outputs.out_file)
+
+    # the second node reused the outputs of the first one, without a copy
+    assert out_files[0] != out_files[1]
+    assert os.path.dirname(out_files[1]) == str(tmpdir.join('wf2',
+                                                         'make_file_wf2'))
+    entries = store.listdir()
+    assert len(entries) == 1
+    assert len(entries[0].join('_refs').listdir()) == 2
+    stored_file = str(entries[0].join('out.txt'))
+    for out_file in out_files:
+        # hard links are read-only, clones are private
+        if os.path.samefile(out_file, stored_file):
+            assert not os.stat(out_file).st_mode & 0o222
+
+    # a node to be rerun in place gets private copies of its outputs
+    release_stored_outputs(os.path.dirname(out_files[1]), unshare=True)
+    assert not os.path.samefile(out_files[1], stored_file)
+    with open(out_files[1], 'wt') as fp:
+        fp.write('2')
+    with open(out_files[0], 'rt') as fp:
+        assert fp.read() == '1'
+    with open(stored_file, 'rt') as fp:
+        assert fp.read() == '1'
+
+    # the entry is removed along with the last node directory using it
+    for out_file in out_files:
+        outdir = os.path.dirname(out_file)
+        release_stored_outputs(outdir)
+        rmtree(outdir)
+    assert store.listdir() == []
+
+
+def pass_file(in_file):
+    return in_file
+
+
+def test_output_store_rerun(tmpdir):
+    store = tmpdir.join('store')
+    wf = pe.Workflow(name='wf', base_dir=str(tmpdir))
+    wf.config['execution']['output_store'] = str(store)
+    node = pe.Node(niu.Function(input_names=['value'],
+                                output_names=['out_file'],
+                                function=make_file),
+                   name='make_file')
+    node.inputs.value = 1
+    wf.add_nodes([node])
+    wf.run()
+    assert len(store.listdir()) == 1
+
+    # a rerun with other inputs releases the previous entry
+    node.inputs.value = 2
+    wf.run()
+    entries = store.listdir()
+    assert len(entries) == 1
+    with open(str(entries[0].join('out.txt')), 'rt') as fp:
+        assert fp.read() == '2'
+
+
+def test_output_store_outside(tmpdir):
+    store = tmpdir.join('store')
+    in_file = tmpdir.join('in.txt')
+    in_file.write('1')
+    wf = pe.Workflow(name='wf', base_dir=str(tmpdir))
+    wf.config['execution']['output_store'] = str(store)
+    node = pe.Node(niu.Function(input_names=['in_file'],
+                                output_names=['out_file'],
+                                function=pass_file),
+                   name='pass_file')
+    node.inputs.in_file = str(in_file)
+    wf.add_nodes([node])
+    wf.run()
+    # outputs that are not in the node directory are not stored
+    assert not store.check() or store.listdir() == []
+
+
+def copy_text(in_file):
+    import os
+    out_file = os.path.abspath('out.txt')
+    with open(in_file, 'rt') as fin:
+        with open(out_file, 'wt') as fout:
+            fout.write(fin.read())
+    return out_file
+
+
+def test_output_store_paths(tmpdir):
+    store = tmpdir.join('store')
+    out_texts = []
+    for subject in ['s1', 's2']:
+        # inputs of the same size and modification time
+        in_file = tmpdir.join('%s.txt' % subject)
+        in_file.write(subject)
+        os.utime(str(in_file), (1000000000, 1000000000))
+        wf = pe.Workflow(name='wf_%s' % subject, base_dir=str(tmpdir))
+        wf.config['execution']['output_store'] = str(store)
+        wf.config['execution']['hash_method'] = 'timestamp'
+        node = pe.Node(niu.Function(input_names=['in_file'],
+                                    output_names=['out_file'],
+                                    function=copy_text),
+                       name='copy_text')
+        node.inputs.in_file = str(in_file)
+        wf.add_nodes([node])
+        eg = wf.run()
+        with open(eg.nodes()[0].result.outputs.out_file, 'rt') as fp:
+            out_texts.append(fp.read())
+    # the second subject did not reuse the outputs of the first one
+    assert out_texts == ['s1', 's2']
+    assert len(store.listdir()) == 2
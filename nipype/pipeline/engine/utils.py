@@ -22,6 +22,11 @@ except ImportError:
 import os
 import re
 import pickle
+import shutil
+import threading
+from hashlib import md5
+from uuid import uuid1
+from queue import Queue
 from functools import reduce
 import numpy as np
 from nipype.utils.misc import package_check
@@ -31,7 +36,8 @@ package_check('networkx', '1.3')
 import networkx as nx
 
 from ...utils.filemanip import (fname_presuffix, FileNotFoundError, to_str,
-                                filename_to_list, get_related_files)
+                                filename_to_list, get_related_files, loadpkl,
+                                savepkl, share_file, unshare_file)
 from ...utils.misc import create_function_from_source, str2bool
 from ...interfaces.base import (CommandLine, isdefined, Undefined,
                                 InterfaceResult)
@@ -1180,6 +1186,183 @@ def clean_working_directory(outputs, cwd, inputs, needed_outputs, config,
     return outputs
 
 
+# Node working directory entries that are not outputs
+_STORE_SKIP = re.compile(r'^(_0x.*\.json|_inputs\.pklz|_node\.pklz|'
+                         r'result_.*\.pklz|_report|_store_key|command\.txt)$')
+
+
+def _rebase_paths(object, olddir, newdir):
+    """Replace the olddir prefix of the paths in a data structure"""
+    if isinstance(object, dict):
+        return dict((key, _rebase_paths(val, olddir, newdir))
+                    for key, val in list(object.items()))
+    if isinstance(object, (list, tuple)):
+        out = [_rebase_paths(val, olddir, newdir) for val in object]
+        if isinstance(object, tuple):
+            out = tuple(out)
+        return out
+    if (isinstance(object, (str, bytes)) and
+            object.startswith(olddir + os.sep)):
+        return newdir + object[len(olddir):]
+    return object
+
+
+def _share_tree(src, dst, skip=None):
+    """Share the files of src with dst, recreating its directory structure
+
+    Files are cloned where the filesystem supports copy-on-write, and
+    otherwise hard linked and made read-only (see
+    :func:`~nipype.utils.filemanip.share_file`), so that the store holds a
+    single copy of the data. Symbolic links are copied as links.
+    """
+    for name in os.listdir(src):
+        if skip is not None and skip.match(name):
+            continue
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if os.path.isdir(srcname) and not os.path.islink(srcname):
+            if not os.path.isdir(dstname):
+                os.makedirs(dstname)
+            _share_tree(srcname, dstname)
+            continue
+        if os.path.lexists(dstname):
+            os.unlink(dstname)
+        if os.path.islink(srcname):
+            os.symlink(os.readlink(srcname), dstname)
+        else:
+            share_file(srcname, dstname)
+
+
+def _outputs_outside(outputs, outdir):
+    """Return the files and directories of outputs that are not in outdir"""
+    return [path for path, _ in walk_outputs(outputs)
+            if not os.path.abspath(path).startswith(outdir + os.sep)]
+
+
+def _store_entry(store, node, hashed_inputs):
+    """Return the output store entry of a node with the given hashed inputs
+
+    The key uses the inputs with the paths of their files, not only the
+    input hash of the node, which leaves the paths out: under the
+    timestamp hash method, files of other subjects with the same size and
+    modification time would otherwise share an entry.
+    """
+    interface = node._interface.__class__
+    key = md5(('%s.%s:%s' % (interface.__module__, interface.__name__,
+                             to_str(hashed_inputs))).encode()).hexdigest()
+    return os.path.join(os.path.abspath(store), key)
+
+
+def _add_store_ref(entry, outdir):
+    """Record that outdir uses the outputs of a store entry"""
+    refs_dir = os.path.join(entry, '_refs')
+    ref = md5(outdir.encode()).hexdigest()
+    with open(os.path.join(refs_dir, ref), 'wt') as fp:
+        fp.write(outdir)
+    with open(os.path.join(outdir, '_store_key'), 'wt') as fp:
+        fp.write(entry)
+
+
+def store_outputs(store, node, outdir, hashed_inputs, result):
+    """Add the outputs of a node that has just run to the output store
+
+    The files of the node working directory are shared with an entry of
+    the store keyed by the node interface and inputs, and the outputs
+    of the node are recorded, so that another node with the same interface
+    and inputs can reuse them (see :func:`reuse_stored_outputs`). Results
+    with outputs outside of the working directory, such as input files
+    passed through, are not stored, as they could not be relocated.
+    """
+    outputs = {}
+    if result.outputs:
+        outputs = result.outputs.get_traitsfree()
+    outside = _outputs_outside(outputs, outdir)
+    if outside:
+        logger.debug('Not storing the outputs of node %s, %s are outside '
+                     'of %s', node.name, ', '.join(outside), outdir)
+        return
+    entry = _store_entry(store, node, hashed_inputs)
+    if not os.path.exists(entry):
+        tmp_entry = '%s.%s.tmp' % (entry, uuid1().hex)
+        os.makedirs(os.path.join(tmp_entry, '_refs'))
+        try:
+            _share_tree(outdir, tmp_entry, skip=_STORE_SKIP)
+            savepkl(os.path.join(tmp_entry, '_outputs.pklz'),
+                    dict(outdir=outdir, outputs=outputs,
+                         runtime=result.runtime))
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another process stored the same outputs first
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            if not os.path.exists(entry):
+                raise
+    _add_store_ref(entry, outdir)
+
+
+def reuse_stored_outputs(store, node, outdir, hashed_inputs):
+    """Share the outputs of an identical node from the output store with
+    outdir and save them as the results of node
+
+    Returns True if the outputs were found in the store.
+    """
+    entry = _store_entry(store, node, hashed_inputs)
+    outputs_file = os.path.join(entry, '_outputs.pklz')
+    if not os.path.exists(outputs_file):
+        return False
+    stored = loadpkl(outputs_file)
+    logger.info('Reusing outputs of %s for node %s', stored['outdir'],
+                node.name)
+    _share_tree(entry, outdir, skip=re.compile(r'^(_refs|_outputs\.pklz)$'))
+    _add_store_ref(entry, outdir)
+    outputs = node._interface._outputs()
+    outputs.set(**_rebase_paths(stored['outputs'], stored['outdir'], outdir))
+    runtime = stored['runtime']
+    runtime.cwd = outdir
+    result = InterfaceResult(interface=node._interface.__class__,
+                             runtime=runtime,
+                             inputs=node._interface.inputs.get_traitsfree(),
+                             outputs=outputs)
+    node._save_results(result, outdir)
+    return True
+
+
+def release_stored_outputs(outdir, unshare=False):
+    """Drop the reference of outdir to its output store entry, removing the
+    entry once no node working directory uses it anymore
+
+    With unshare, the files outdir shares with the entry are replaced by
+    private copies first, for them to be rewritten in place.
+    """
+    key_file = os.path.join(outdir, '_store_key')
+    if not os.path.exists(key_file):
+        return
+    if unshare:
+        for dirpath, _, filenames in os.walk(outdir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if not os.path.islink(path):
+                    unshare_file(path)
+    with open(key_file, 'rt') as fp:
+        entry = fp.read().strip()
+    os.unlink(key_file)
+    refs_dir = os.path.join(entry, '_refs')
+    try:
+        os.unlink(os.path.join(refs_dir, md5(outdir.encode()).hexdigest()))
+    except OSError:
+        "Reference already removed"
+    try:
+        refs = os.listdir(refs_dir)
+    except OSError:
+        "Entry already removed"
+        return
+    for ref in refs:
+        with open(os.path.join(refs_dir, ref), 'rt') as fp:
+            if os.path.exists(os.path.join(fp.read(), '_store_key')):
+                return
+    logger.debug('Removing output store entry %s', entry)
+    shutil.rmtree(entry, ignore_errors=True)
+
+
 def merge_dict(d1, d2, merge=lambda x, y: y):
     """
     Merges two dictionaries, non-destructively, combining
@@ -1225,23 +1408,77 @@ def merge_bundles(g1, g2):
     return g1
 
 
-def write_workflow_prov(graph, filename=None, format='all'):
-    """Write W3C PROV Model JSON file
+def _get_node_hashval(node):
+    """Return the hash of the inputs of a node that has been run
+
+    The hash recorded by the node at execution time, or the name of its
+    hash file, is used before falling back to hashing the inputs again.
     """
-    if not filename:
-        filename = os.path.join(os.getcwd(), 'workflow_provenance')
+    hashval = getattr(node, '_hashvalue', None)
+    if hashval:
+        return hashval
+    hashfiles = [hashfile for hashfile in
+                 glob(os.path.join(node.output_dir(), '_0x*.json'))
+                 if not hashfile.endswith('_unfinished.json')]
+    if len(hashfiles) == 1:
+        return os.path.basename(hashfiles[0])[len('_0x'):-len('.json')]
+    _, hashval, _, _ = node.hash_exists()
+    return hashval
+
+
+class WorkflowProvWriter(object):
+    """Collect the W3C PROV records of a workflow while it runs
+
+    The writer is a valid ``status_callback``: nodes reported as finished
+    are queued and their records are built by a background thread, off the
+    critical path of the scheduler. :meth:`write` adds the nodes that were
+    not reported (e.g., with graph-based plugins), the dependencies between
+    nodes, and writes the document.
 
-    ps = ProvStore()
+    Parameters
+    ----------
+    status_callback : callable, optional
+        Another status callback, called before queueing the node
+    """
 
-    processes = []
-    nodes = graph.nodes()
-    for idx, node in enumerate(nodes):
+    def __init__(self, status_callback=None):
+        self.status_callback = status_callback
+        self.ps = ProvStore()
+        self._processes = {}
+        self._queue = Queue()
+        self._thread = None
+
+    def __call__(self, node, status):
+        if self.status_callback:
+            self.status_callback(node, status)
+        if status == 'end':
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._consume)
+                self._thread.daemon = True
+                self._thread.start()
+            self._queue.put(node)
+
+    def _consume(self):
+        while True:
+            node = self._queue.get()
+            if node is None:
+                break
+            try:
+                self.add_node(node)
+            except Exception as exc:
+                logger.debug('Provenance of node %s deferred: %s',
+                             node, exc)
+
+    def add_node(self, node):
+        """Add the records of a node that has been run"""
+        if node in self._processes:
+            return
+        ps = self.ps
         result = node.result
         classname = node._interface.__class__.__name__
-        _, hashval, _, _ = node.hash_exists()
         attrs = {pm.PROV["type"]: nipype_ns[classname],
                  pm.PROV["label"]: '_'.join((classname, node.name)),
-                 nipype_ns['hashval']: hashval}
+                 nipype_ns['hashval']: _get_node_hashval(node)}
         process = ps.g.activity(get_id(), None, None, attrs)
         if isinstance(result.runtime, list):
             process.add_attributes({pm.PROV["type"]: nipype_ns["MapNode"]})
@@ -1257,38 +1494,52 @@ def write_workflow_prov(graph, filename=None, format='all'):
                         values = getattr(result.outputs, key)
                         if isdefined(values) and idx < len(values):
                             subresult.outputs[key] = values[idx]
-                sub_doc = ProvStore().add_results(subresult)
-                sub_bundle = pm.ProvBundle(sub_doc.get_records(),
-                                           identifier=get_id())
-                ps.g.add_bundle(sub_bundle)
+                sub_bundle = ps.g.bundle(get_id())
+                ProvStore(sub_bundle).add_results(subresult)
                 bundle_entity = ps.g.entity(sub_bundle.identifier,
                                             other_attributes={'prov:type':
-                                                               pm.PROV_BUNDLE})
+                                                              pm.PROV_BUNDLE})
                 ps.g.wasGeneratedBy(bundle_entity, process)
         else:
             process.add_attributes({pm.PROV["type"]: nipype_ns["Node"]})
             if result.provenance:
-                prov_doc = result.provenance
+                result_bundle = pm.ProvBundle(
+                    result.provenance.get_records(), identifier=get_id())
+                ps.g.add_bundle(result_bundle)
             else:
-                prov_doc = ProvStore().add_results(result)
-            result_bundle = pm.ProvBundle(prov_doc.get_records(),
-                                          identifier=get_id())
-            ps.g.add_bundle(result_bundle)
+                result_bundle = ps.g.bundle(get_id())
+                ProvStore(result_bundle).add_results(result)
             bundle_entity = ps.g.entity(result_bundle.identifier,
                                         other_attributes={'prov:type':
-                                                              pm.PROV_BUNDLE})
+                                                          pm.PROV_BUNDLE})
             ps.g.wasGeneratedBy(bundle_entity, process)
-        processes.append(process)
+        self._processes[node] = process
+
+    def write(self, graph, filename=None, format='all'):
+        """Complete the provenance of graph and write it to filename"""
+        if not filename:
+            filename = os.path.join(os.getcwd(), 'workflow_provenance')
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for node in graph.nodes():
+            self.add_node(node)
+        # add dependencies (edges)
+        # Process->Process
+        for edgeinfo in graph.in_edges_iter():
+            self.ps.g.wasStartedBy(self._processes[edgeinfo[1]],
+                                   starter=self._processes[edgeinfo[0]])
+
+        # write provenance
+        self.ps.write_provenance(filename, format=format)
+        return self.ps.g
 
-    # add dependencies (edges)
-    # Process->Process
-    for idx, edgeinfo in enumerate(graph.in_edges_iter()):
-        ps.g.wasStartedBy(processes[nodes.index(edgeinfo[1])],
-                          starter=processes[nodes.index(edgeinfo[0])])
 
-    # write provenance
-    ps.write_provenance(filename, format=format)
-    return ps.g
+def write_workflow_prov(graph, filename=None, format='all'):
+    """Write W3C PROV Model JSON file
+    """
+    return WorkflowProvWriter().write(graph, filename, format=format)
 
 
 def topological_sort(graph, depth_first=False):
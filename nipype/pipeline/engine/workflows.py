@@ -50,10 +50,10 @@ from ...utils.filemanip import (save_json, FileNotFoundError,
                                 write_rst_header, write_rst_dict,
                                 write_rst_list, to_str)
 from .utils import (generate_expanded_graph, modify_paths,
-                    export_graph, make_output_dir, write_workflow_prov,
-                    clean_working_directory, format_dot, topological_sort,
-                    get_print_name, merge_dict, evaluate_connect_function,
-                    _write_inputs, format_node)
+                    export_graph, make_output_dir,
+                    WorkflowProvWriter, clean_working_directory, format_dot,
+                    topological_sort, get_print_name, merge_dict,
+                    evaluate_connect_function, _write_inputs, format_node)
 
 from .base import EngineBase
 from .nodes import Node, MapNode
@@ -584,13 +584,23 @@ connected.
         self._configure_exec_nodes(execgraph)
         if str2bool(self.config['execution']['create_report']):
             self._write_report_info(self.base_dir, self.name, execgraph)
-        runner.run(execgraph, updatehash=updatehash, config=self.config)
-        datestr = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        prov_writer = None
         if str2bool(self.config['execution']['write_provenance']):
+            # Collect the provenance of nodes as they finish
+            status_callback = getattr(runner, '_status_callback', None)
+            prov_writer = WorkflowProvWriter(status_callback)
+            runner._status_callback = prov_writer
+        try:
+            runner.run(execgraph, updatehash=updatehash, config=self.config)
+        finally:
+            if prov_writer is not None:
+                runner._status_callback = prov_writer.status_callback
+        datestr = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        if prov_writer is not None:
             prov_base = op.join(self.base_dir,
                                 'workflow_provenance_%s' % datestr)
             logger.info('Provenance file prefix: %s' % prov_base)
-            write_workflow_prov(execgraph, prov_base, format='all')
+            prov_writer.write(execgraph, prov_base, format='all')
         return execgraph
 
     # PRIVATE API AND FUNCTIONS
@@ -25,7 +25,8 @@ import scipy.sparse as ssp
 from ... import logging
 from ...utils.filemanip import savepkl, loadpkl, crash2txt
 from ...utils.misc import str2bool
-from ..engine.utils import (nx, dfs_preorder, topological_sort)
+from ..engine.utils import (nx, dfs_preorder, topological_sort,
+                            release_stored_outputs)
 from ..engine import MapNode
 
 
@@ -483,10 +484,11 @@ class DistributedPluginBase(PluginBase):
                     continue
                 if self.proc_done[idx] and (not self.proc_pending[idx]):
                     self.refidx[idx, idx] = -1
-                    outdir = self.procs[idx]._output_directory()
+                    outdir = self.procs[idx].output_dir()
                     logger.info(('[node dependencies finished] '
                                  'removing node: %s from directory %s') %
                                 (self.procs[idx]._id, outdir))
+                    release_stored_outputs(outdir)
                     shutil.rmtree(outdir)
 
 
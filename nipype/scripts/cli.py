@@ -13,6 +13,7 @@ from .utils import (CONTEXT_SETTINGS,
                     UnexistingFilePath,
                     RegularExpression,
                     PythonModule,
+                    ByteSize,
                     check_not_none,)
 
 
@@ -152,6 +153,57 @@ def run(ctx, module, interface, list, help):
             run_instance(node, args)
 
 
+@cli.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('base_dir', type=ExistingDirPath, callback=check_not_none)
+@click.option('-s', '--max-size', type=ByteSize(),
+              help='Remove cached runs until the cache fits in this size '
+                   '(e.g. 500M, 10G).')
+@click.option('-p', '--policy', type=click.Choice(['lru', 'cost']),
+              default='lru', show_default=True,
+              help='Eviction policy: least recently used runs first, or '
+                   'cheapest runs to recompute per byte first.')
+@click.option('-n', '--dry-run', is_flag=True, flag_value=True,
+              help='Only report the runs that would be removed.')
+def cache(base_dir, max_size, policy, dry_run):
+    """Report and trim the disk usage of a nipype.caching.Memory cache.
+
+    BASE_DIR is the directory given to Memory, which contains nipype_mem.
+
+    Examples:\n
+    nipypecli cache /path/to/cache\n
+    nipypecli cache /path/to/cache -s 10G -p cost
+    """
+    import os.path as op
+    from ..caching.memory import Memory
+    from .utils import format_size
+
+    if not op.isdir(op.join(base_dir, 'nipype_mem')):
+        raise click.BadParameter('{} does not contain a nipype_mem '
+                                 'cache.'.format(base_dir))
+    mem = Memory(base_dir)
+    usage = mem.cache_usage()
+
+    per_dir = {}
+    for key, record in usage.items():
+        dir_name = key.split('/')[0]
+        count, size = per_dir.get(dir_name, (0, 0))
+        per_dir[dir_name] = (count + 1, size + record[0])
+    for dir_name, (count, size) in sorted(per_dir.items()):
+        click.echo('{:>10}  {:>6} runs  {}'.format(format_size(size), count,
+                                                   dir_name))
+    total = sum(record[0] for record in usage.values())
+    click.echo('{:>10}  {:>6} runs  total'.format(format_size(total),
+                                                 len(usage)))
+
+    if max_size is not None:
+        removed = mem.trim(max_size, policy=policy, dry_run=dry_run,
+                           warn=False)
+        freed = sum(usage[key][0] for key in removed)
+        click.echo('{} {} runs ({}).'.format(
+            'Would remove' if dry_run else 'Removed', len(removed),
+            format_size(freed)))
+
+
 @cli.group()
 def convert():
     """Export nipype interfaces to other formats."""
@@ -43,6 +43,32 @@ class RegularExpression(click.ParamType):
             return rex
 
 
+class ByteSize(click.ParamType):
+    name = 'size'
+    units = dict(K=1024, M=1024 ** 2, G=1024 ** 3, T=1024 ** 4)
+
+    def convert(self, value, param, ctx):
+        match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', value,
+                         re.IGNORECASE)
+        if match is None:
+            self.fail('%s is not a valid size (e.g., 500M, 10G).' % value,
+                      param, ctx)
+        size = float(match.group(1))
+        unit = match.group(2).upper()
+        if unit:
+            size *= self.units[unit]
+        return int(size)
+
+
+def format_size(size):
+    """Return a human readable representation of a size in bytes."""
+    for unit in ('B', 'K', 'M', 'G'):
+        if abs(size) < 1024:
+            return '{:.1f}{}'.format(size, unit)
+        size /= 1024.
+    return '{:.1f}T'.format(size)
+
+
 class PythonModule(click.ParamType):
     name = 'Python module path'
 
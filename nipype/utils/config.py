@@ -50,6 +50,7 @@ job_finished_timeout = 5
 keep_inputs = false
 local_hash_check = true
 matplotlib_backend = Agg
+output_store =
 plugin = Linear
 remove_node_directories = false
 remove_unnecessary_outputs = true
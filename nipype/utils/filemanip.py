@@ -13,14 +13,24 @@ standard_library.install_aliases()
 import sys
 import pickle
 import gzip
+import glob
+import fnmatch
+import time
 import hashlib
 from hashlib import md5
 import os
 import re
 import shutil
 import posixpath
+from collections import OrderedDict
 import simplejson as json
 import numpy as np
+from stat import S_ISDIR, S_IWUSR, S_IWGRP, S_IWOTH
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
 
 from .. import logging, config
 from .misc import is_container
@@ -237,6 +247,83 @@ def hash_timestamp(afile):
     return md5hex
 
 
+# from linux/fs.h, clones a file on copy-on-write filesystems
+_FICLONE = 0x40049409
+# (source, destination) devices between which cloning failed
+_no_reflink = set()
+
+
+def _reflink(src, dst):
+    """Make ``dst`` a copy-on-write clone of ``src``, raises OSError (or
+    IOError) where the filesystem cannot do it"""
+    import fcntl
+    with open(src, 'rb') as fsrc:
+        with open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            except (IOError, OSError):
+                fdst.close()
+                os.unlink(dst)
+                raise
+
+
+def _try_reflink(src, dst):
+    """Clone ``src`` to ``dst`` with its permissions and times, returns
+    False where the filesystem cannot do it"""
+    devices = (os.stat(src).st_dev,
+               os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+    if sys.platform.startswith('linux') and devices not in _no_reflink:
+        try:
+            _reflink(src, dst)
+            shutil.copystat(src, dst)
+            return True
+        except (IOError, OSError):
+            _no_reflink.add(devices)
+    return False
+
+
+def clone_file(src, dst):
+    """Copy ``src`` to ``dst`` with its permissions and times, as a
+    copy-on-write clone where the filesystem supports it"""
+    if not _try_reflink(src, dst):
+        shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+
+
+def share_file(src, dst):
+    """Make ``dst`` share the data of ``src`` without copying it
+
+    ``dst`` is a copy-on-write clone where the filesystem supports it.
+    Otherwise it is a hard link to ``src``, and the write permissions of
+    both are removed so that an in-place write to one of them fails rather
+    than changing the other (see :func:`unshare_file`). Files that cannot
+    be linked are copied.
+    """
+    if _try_reflink(src, dst):
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+        shutil.copystat(src, dst)
+        return
+    mode = os.stat(dst).st_mode
+    os.chmod(dst, mode & ~(S_IWUSR | S_IWGRP | S_IWOTH))
+
+
+def unshare_file(path):
+    """Replace a hard link made by :func:`share_file` with a private,
+    writable copy of its data"""
+    path_st = os.stat(path)
+    if path_st.st_nlink < 2:
+        return
+    tmp_path = '%s.%d.unshare' % (path, os.getpid())
+    shutil.copyfile(path, tmp_path)
+    shutil.copystat(path, tmp_path)
+    os.chmod(tmp_path, path_st.st_mode | S_IWUSR)
+    os.rename(tmp_path, path)
+
+
 def copyfile(originalfile, newfile, copy=False, create_new=False,
              hashmethod=None, use_hardlink=False,
              copy_related_files=True):
@@ -307,6 +394,10 @@ def copyfile(originalfile, newfile, copy=False, create_new=False,
                 keep = True
         elif posixpath.samefile(newfile, originalfile):
             keep = True
+        elif hashmethod == 'content' and \
+                os.path.getsize(newfile) != os.path.getsize(originalfile):
+            fmlogger.debug("File: %s already exists with a different size"
+                           % newfile)
         else:
             if hashmethod == 'timestamp':
                 hashfn = hash_timestamp
@@ -461,6 +552,144 @@ def check_depends(targets, dependencies):
         max(list(map(os.path.getmtime, deps)) + [0])
 
 
+# Directory listings shared by the data grabbers, keyed by absolute
+# directory path, so that relative paths survive changes of directory.
+# Each entry is ((st_dev, st_ino, mtime), names, dirnames, filenames,
+# symlinked dirnames), and only the most recently used _DIR_INDEX_SIZE
+# listings are kept.
+_dir_index = OrderedDict()
+_DIR_INDEX_SIZE = 10000
+# A directory modified this close to the moment it was listed may change
+# again without its mtime moving (coarse timestamps, NFS), so such listings
+# are not kept.
+_DIR_INDEX_RACY = 2.0
+
+
+def _list_dir(path):
+    """Return the cached listing of ``path`` or None if it is not a directory
+
+    The directory is only read again when its mtime has changed since it
+    was indexed, or when the path now names another directory (e.g. a tree
+    removed and extracted again), so repeated queries on a tree cost one
+    stat per directory.
+    """
+    key = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        _dir_index.pop(key, None)
+        return None
+    mtime = stat.st_mtime
+    version = (stat.st_dev, stat.st_ino,
+               getattr(stat, 'st_mtime_ns', mtime))
+    entry = _dir_index.pop(key, None)
+    if entry is not None and entry[0] == version:
+        _dir_index[key] = entry
+        return entry
+    if not S_ISDIR(stat.st_mode):
+        return None
+    listed_at = time.time()
+    names, dirnames, filenames, links = [], [], [], set()
+    try:
+        if scandir is not None:
+            for item in scandir(path):
+                names.append(item.name)
+                try:
+                    is_dir = item.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirnames.append(item.name)
+                    if item.is_symlink():
+                        links.add(item.name)
+                else:
+                    filenames.append(item.name)
+        else:
+            for name in os.listdir(path):
+                names.append(name)
+                fullname = os.path.join(path, name)
+                if os.path.isdir(fullname):
+                    dirnames.append(name)
+                    if os.path.islink(fullname):
+                        links.add(name)
+                else:
+                    filenames.append(name)
+    except OSError:
+        return None
+    entry = (version, names, dirnames, filenames, links)
+    if mtime < listed_at - _DIR_INDEX_RACY:
+        _dir_index[key] = entry
+        while len(_dir_index) > _DIR_INDEX_SIZE:
+            _dir_index.popitem(last=False)
+    return entry
+
+
+def clear_dir_index():
+    """Forget all directory listings kept by indexed_glob/indexed_walk"""
+    _dir_index.clear()
+
+
+def _glob_dir(dirname, pattern):
+    entry = _list_dir(dirname or os.curdir)
+    if entry is None:
+        return []
+    names = entry[1]
+    if not pattern.startswith('.'):
+        names = [name for name in names if not name.startswith('.')]
+    return fnmatch.filter(names, pattern)
+
+
+def indexed_glob(pattern):
+    """Return the paths matching ``pattern``, like glob.glob
+
+    Directory listings are served from an in-process index that is
+    invalidated by directory mtimes, so grabbing many templates from the
+    same tree only reads each directory once.
+
+    """
+    dirname, basename = os.path.split(pattern)
+    if not glob.has_magic(pattern):
+        if basename:
+            return [pattern] if os.path.lexists(pattern) else []
+        return [pattern] if os.path.isdir(dirname) else []
+    if not dirname:
+        return _glob_dir(dirname, basename)
+    if dirname != pattern and glob.has_magic(dirname):
+        dirs = indexed_glob(dirname)
+    else:
+        dirs = [dirname]
+    results = []
+    for dname in dirs:
+        if glob.has_magic(basename):
+            names = _glob_dir(dname, basename)
+        elif basename:
+            names = [basename] if os.path.lexists(
+                os.path.join(dname, basename)) else []
+        else:
+            names = [basename] if os.path.isdir(dname) else []
+        results.extend(os.path.join(dname, name) for name in names)
+    return results
+
+
+def indexed_walk(top):
+    """Walk a directory tree top-down, like os.walk, using the index
+
+    As with os.walk, ``dirnames`` may be pruned in place and symlinked
+    directories are listed but not descended into.
+
+    """
+    entry = _list_dir(top)
+    if entry is None:
+        return
+    dirnames, filenames = list(entry[2]), list(entry[3])
+    yield top, dirnames, filenames
+    for name in dirnames:
+        if name in entry[4]:
+            continue
+        for item in indexed_walk(os.path.join(top, name)):
+            yield item
+
+
 def save_json(filename, data):
     """Save data to a json file
 
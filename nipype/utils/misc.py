@@ -11,6 +11,7 @@ from future.utils import raise_from
 
 import sys
 import re
+import csv
 from collections import Iterator
 import inspect
 
@@ -248,10 +249,86 @@ def unflatten(in_list, prev_structure):
 def normalize_mc_params(params, source):
     """
     Normalize a single row of motion parameters to the SPM format.
+
+    A [timepoints x parameters] array is normalized row by row.
     """
     if source == 'FSL':
-        params = params[[3, 4, 5, 0, 1, 2]]
+        params = params[..., [3, 4, 5, 0, 1, 2]]
     elif source in ('AFNI', 'FSFAST'):
-        params = params[np.asarray([4, 5, 3, 1, 2, 0]) + (len(params) > 6)]
-        params[3:] = params[3:] * np.pi / 180.
-    return params
\ No newline at end of file
+        params = params[..., np.asarray([4, 5, 3, 1, 2, 0]) +
+                        (params.shape[-1] > 6)]
+        params[..., 3:] = params[..., 3:] * np.pi / 180.
+    return params
+
+
+# Default size in bytes of the blocks of an image processed at once
+BLOCK_BYTES = 2 ** 26
+
+
+def iter_blocks(n_items, item_bytes, block_bytes=None):
+    """
+    Yield the slices of consecutive blocks of ``n_items`` items (e.g.
+    volumes of an image) of ``item_bytes`` each, with as many items per
+    block as fit in about ``block_bytes``, and at least one.
+
+    >>> [(s.start, s.stop) for s in iter_blocks(5, 10, block_bytes=20)]
+    [(0, 2), (2, 4), (4, 5)]
+    """
+    if block_bytes is None:
+        block_bytes = BLOCK_BYTES
+    step = max(1, int(block_bytes // max(item_bytes, 1)))
+    for start in range(0, n_items, step):
+        yield slice(start, min(start + step, n_items))
+
+
+def open_nifti(filename, shape, dtype, affine=None, header=None):
+    """
+    Opens a new NIfTI file and writes the header for data of the given
+    shape and type, so the data can be written after it in Fortran order,
+    e.g. volume after volume, or through a memory map.
+
+    Returns the file object, positioned at the start of the data, and the
+    byte ordered type the data must be written with.
+    """
+    import nibabel as nb
+    from nibabel.openers import ImageOpener
+
+    hdr = nb.Nifti1Image(np.zeros((1, ) * len(shape), dtype=dtype), affine,
+                         header).header
+    hdr.set_data_shape(shape)
+    hdr.set_data_dtype(dtype)
+    hdr.set_slope_inter(1., 0.)
+    hdr.set_data_offset(352 + hdr.extensions.get_sizeondisk())
+    fobj = ImageOpener(filename, 'wb')
+    hdr.write_to(fobj)
+    fobj.write(b'\x00' * (hdr.get_data_offset() - fobj.tell()))
+    return fobj, hdr.get_data_dtype()
+
+
+def write_batch_table(out_file, header, items, item_rows, formats, ids=None):
+    """
+    Writes a CSV table with the rows of each item of a batch, e.g. one per
+    subject, prefixed with the identifier of the item in ``ids`` or, if
+    ``ids`` is None, its position in the batch.
+
+    ``item_rows(item)`` returns the rows of an item, and ``formats`` has
+    the ``%`` format of each of their columns.
+    """
+    items = list(items)
+    if ids is None:
+        ids = list(range(len(items)))
+    elif len(ids) != len(items):
+        raise ValueError('%d identifiers given for %d items' % (
+            len(ids), len(items)))
+
+    if sys.version_info[0] < 3:
+        fid = open(out_file, 'wb')
+    else:
+        fid = open(out_file, 'w', newline='')
+    with fid:
+        writer = csv.writer(fid, lineterminator='\n')
+        writer.writerow(header)
+        for item_id, item in zip(ids, items):
+            writer.writerows(
+                [item_id] + [fmt % value for fmt, value in zip(formats, row)]
+                for row in item_rows(item))
@@ -291,9 +291,16 @@ def write_provenance(results, filename='provenance', format='all'):
 
 
 class ProvStore(object):
+    """Build the provenance of interface results
 
-    def __init__(self):
-        self.g = pm.ProvDocument()
+    Records are added to ``g``, a new document unless an existing
+    document or bundle is given.
+    """
+
+    def __init__(self, g=None):
+        if g is None:
+            g = pm.ProvDocument()
+        self.g = g
         self.g.add_namespace(foaf)
         self.g.add_namespace(dcterms)
         self.g.add_namespace(nipype_ns)
@@ -5,6 +5,7 @@ from __future__ import unicode_literals
 from builtins import open
 
 import os
+import glob
 import time
 from tempfile import mkstemp, mkdtemp
 import shutil
@@ -18,7 +19,8 @@ from ...utils.filemanip import (save_json, load_json,
                                 copyfile, copyfiles,
                                 filename_to_list, list_to_filename,
                                 check_depends,
-                                split_filename, get_related_files)
+                                split_filename, get_related_files,
+                                indexed_glob, indexed_walk, clear_dir_index)
 
 import numpy as np
 
@@ -319,6 +321,86 @@ def test_json():
     assert sorted(adict.items()) == sorted(new_dict.items())
 
 
+@pytest.fixture()
+def _dir_tree(tmpdir):
+    for sub in ['sub-01', 'sub-02', 'sub-10']:
+        tmpdir.ensure(sub, 'anat', sub + '_T1w.nii.gz')
+        tmpdir.ensure(sub, 'func', sub + '_bold.nii.gz')
+        tmpdir.ensure(sub, '.hidden')
+    tmpdir.join('alias').mksymlinkto(tmpdir.join('sub-02', 'anat'))
+    # Age the directories so that their listings are kept in the index
+    past = time.time() - 60
+    for dirpath, _, _ in os.walk(str(tmpdir)):
+        os.utime(dirpath, (past, past))
+    clear_dir_index()
+    yield str(tmpdir)
+    clear_dir_index()
+
+
+@pytest.mark.parametrize("pattern", [
+    '*', '*/*', '*/anat/*.nii.gz', 'sub-0?/func/*', 'sub-[01]*/.*',
+    'sub-01/anat/sub-01_T1w.nii.gz', 'sub-01/', '*/', 'missing/*', '*/x/*'])
+def test_indexed_glob(_dir_tree, pattern):
+    pattern = os.path.join(_dir_tree, pattern)
+    for _ in range(2):
+        assert indexed_glob(pattern) == glob.glob(pattern)
+
+
+def test_indexed_walk(_dir_tree):
+    assert list(indexed_walk(_dir_tree)) == list(os.walk(_dir_tree))
+    pruned = []
+    for dirpath, dirnames, _ in indexed_walk(_dir_tree):
+        pruned.append(dirpath)
+        dirnames[:] = [d for d in dirnames if d != 'sub-01']
+    assert not [d for d in pruned if 'sub-01' in d]
+
+
+def test_indexed_glob_invalidation(_dir_tree):
+    pattern = os.path.join(_dir_tree, '*', 'anat', '*')
+    assert len(indexed_glob(pattern)) == 3
+    open(os.path.join(_dir_tree, 'sub-10', 'anat', 'new.nii'), 'w').close()
+    assert len(indexed_glob(pattern)) == 4
+    os.unlink(os.path.join(_dir_tree, 'sub-01', 'anat', 'sub-01_T1w.nii.gz'))
+    assert indexed_glob(pattern) == glob.glob(pattern)
+
+
+def test_indexed_glob_replaced_dir(_dir_tree):
+    # a directory replaced by another one with the same mtime
+    anat = os.path.join(_dir_tree, 'sub-10', 'anat')
+    assert indexed_glob(os.path.join(anat, '*')) == [
+        os.path.join(anat, 'sub-10_T1w.nii.gz')]
+    mtime = os.stat(anat).st_mtime
+    os.mkdir(anat + '.new')
+    open(os.path.join(anat + '.new', 'new.nii'), 'w').close()
+    os.utime(anat + '.new', (mtime, mtime))
+    shutil.rmtree(anat)
+    os.rename(anat + '.new', anat)
+    assert indexed_glob(os.path.join(anat, '*')) == [
+        os.path.join(anat, 'new.nii')]
+
+
+def test_dir_index_size(_dir_tree, monkeypatch):
+    from nipype.utils import filemanip
+    monkeypatch.setattr(filemanip, '_DIR_INDEX_SIZE', 2)
+    pattern = os.path.join(_dir_tree, '*', 'anat', '*')
+    assert indexed_glob(pattern) == glob.glob(pattern)
+    # only the last two anat directories listed are kept
+    assert len(filemanip._dir_index) == 2
+    assert all(key.endswith('anat') for key in filemanip._dir_index)
+
+
+def test_indexed_glob_relative(_dir_tree):
+    # the directories share their mtime, as in an extracted archive
+    cwd = os.getcwd()
+    try:
+        for sub in ['sub-01', 'sub-02']:
+            os.chdir(os.path.join(_dir_tree, sub))
+            assert indexed_glob('anat/*') == ['anat/%s_T1w.nii.gz' % sub]
+            assert indexed_glob('*') == glob.glob('*')
+    finally:
+        os.chdir(cwd)
+
+
 @pytest.mark.parametrize("file, length, expected_files", [
         ('/path/test.img',  3, ['/path/test.hdr', '/path/test.img', '/path/test.mat']),
         ('/path/test.hdr',  3, ['/path/test.hdr', '/path/test.img', '/path/test.mat']),
@@ -10,7 +10,7 @@ import pytest
 
 from nipype.utils.misc import (container_to_string, getsource,
                                create_function_from_source, str2bool, flatten,
-                               unflatten)
+                               unflatten, open_nifti)
 
 
 def test_cont_to_str():
@@ -81,3 +81,24 @@ def test_flatten():
 
     back = unflatten([], [])
     assert back == []
+
+
+@pytest.mark.parametrize('fname', ['volumes.nii', 'volumes.nii.gz'])
+def test_open_nifti(tmpdir, fname):
+    import numpy as np
+    import nibabel as nb
+
+    tmpdir.chdir()
+    data = np.arange(24, dtype=np.int16).reshape((2, 3, 2, 2))
+    affine = np.diag([2., 3., 4., 1.])
+    # a big-endian reference header gives big-endian data
+    header = nb.Nifti1Header(endianness='>')
+    fobj, dtype = open_nifti(fname, data.shape, data.dtype, affine, header)
+    assert dtype == np.dtype('>i2')
+    with fobj:
+        for t in range(data.shape[3]):
+            fobj.write(data[..., t].astype(dtype).tobytes(order='F'))
+
+    img = nb.load(fname)
+    assert np.allclose(img.affine, affine)
+    assert np.array_equal(img.get_data(), data)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time AddCSVRow building a summary table, and CSVReader reading it back.
+
+Rows are added one AddCSVRow run at a time, as a group-level workflow
+would, first by rewriting the table (the default) and then in append mode.
+Rewriting is quadratic, so it is timed on fewer rows and the per-row cost
+is reported for both.
+
+Usage::
+
+    python tools/bench_addcsvrow.py --rows 100000 --rewrite-rows 2000
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from nipype.algorithms.misc import AddCSVRow
+from nipype.interfaces.utility import CSVReader
+
+
+def add_rows(in_file, rows, append):
+    start = time.time()
+    for i in range(rows):
+        addrow = AddCSVRow(in_file=in_file, append=append)
+        addrow.inputs.subject_id = 'sub-%06d' % i
+        addrow.inputs.fd_mean = 0.001 * i
+        addrow.inputs.tsnr = [50.0 + i % 7, 60.0 + i % 11]
+        addrow.run()
+    return time.time() - start
+
+
+def read_table(in_file, as_arrays):
+    start = time.time()
+    CSVReader(in_file=in_file, header=True, as_arrays=as_arrays).run()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--rewrite-rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for append, rows in [(False, args.rewrite_rows), (True, args.rows)]:
+            in_file = os.path.join(tmpdir, 'table_%s.csv' % append)
+            elapsed = add_rows(in_file, rows, append)
+            print('append=%-5s  %7d rows  %8.2fs  %7.3fms/row' % (
+                append, rows, elapsed, 1000 * elapsed / rows))
+        for as_arrays in [False, True]:
+            print('CSVReader as_arrays=%-5s  %.3fs' % (
+                as_arrays, read_table(in_file, as_arrays)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
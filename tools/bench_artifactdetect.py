@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time the global signal and motion norm steps of ArtifactDetect.
+
+A long synthetic int16 run and its motion parameters are generated, then
+the previous per-volume implementations (kept below) are timed against
+the vectorized ones: the spm_global mask and intensity signal, the
+composite norm with displacements bounded by the brain mask, and filling
+the displacement map.  Finally the whole interface is run.
+
+Usage::
+
+    python tools/bench_artifactdetect.py --shape 64 64 36 --volumes 1200
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import nibabel as nb
+import numpy as np
+
+from nipype.algorithms import rapidart as ra
+
+
+def legacy_global_signal(data, global_threshold=8.0):
+    timepoints = data.shape[-1]
+    g = np.zeros((timepoints, 1))
+    mask = np.ones(data.shape[:3], dtype=bool)
+    for t0 in range(timepoints):
+        vol = data[:, :, :, t0]
+        mask = mask * (vol > (ra._nanmean(vol) / global_threshold))
+    for t0 in range(timepoints):
+        vol = data[:, :, :, t0]
+        g[t0] = ra._nanmean(vol[mask])
+    return g, mask
+
+
+def global_signal(data, global_threshold=8.0):
+    thresholds = ra._volume_means(data) / global_threshold
+    mask = np.ones(data.shape[:3], dtype=bool)
+    for volumes, block in ra._volume_blocks(data):
+        mask &= np.all(block > thresholds[volumes], axis=3)
+    return ra._volume_means(data, mask)[:, np.newaxis], mask
+
+
+def legacy_calc_norm(mc, source, brain_pts):
+    n_pts = brain_pts.size - brain_pts.shape[1]
+    newpos = np.zeros((mc.shape[0], n_pts))
+    displacement = np.zeros((mc.shape[0], int(n_pts / 3)))
+    for i in range(mc.shape[0]):
+        affine = ra._get_affine_matrix(mc[i, :], source)
+        newpos[i, :] = np.dot(affine, brain_pts)[0:3, :].ravel()
+        displacement[i, :] = np.sqrt(np.sum(np.power(
+            np.reshape(newpos[i, :], (3, brain_pts.shape[1])) -
+            brain_pts[0:3, :], 2), axis=0))
+    normdata = np.zeros(mc.shape[0])
+    newpos = np.concatenate((np.zeros((1, n_pts)),
+                             np.diff(newpos, n=1, axis=0)), axis=0)
+    for i in range(newpos.shape[0]):
+        normdata[i] = np.max(np.sqrt(np.sum(np.reshape(
+            np.power(np.abs(newpos[i, :]), 2),
+            (3, brain_pts.shape[1])), axis=0)))
+    return normdata, displacement
+
+
+def legacy_fill(shape, voxel_coords, displacement):
+    dmap = np.zeros(shape, dtype=np.float)
+    for i in range(shape[-1]):
+        dmap[voxel_coords[0], voxel_coords[1], voxel_coords[2], i] = \
+            displacement[i, :]
+    return dmap
+
+
+def fill(shape, voxel_coords, displacement):
+    dmap = np.zeros(shape, dtype=np.float)
+    dmap[voxel_coords] = displacement.T
+    return dmap
+
+
+def timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shape', type=int, nargs=3, default=[64, 64, 36])
+    parser.add_argument('--volumes', type=int, default=1200)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    shape = tuple(args.shape) + (args.volumes, )
+    data = np.empty(shape, dtype=np.int16)
+    brain = np.zeros(args.shape, dtype=bool)
+    brain[args.shape[0] // 5:-args.shape[0] // 5,
+          args.shape[1] // 5:-args.shape[1] // 5] = True
+    for z in range(shape[2]):
+        data[:, :, z] = 1000 * brain[:, :, z, np.newaxis] + \
+            rng.randint(0, 50, shape[:2] + shape[3:])
+    params = 0.05 * np.cumsum(rng.randn(args.volumes, 6), axis=0)
+    print('%d voxels x %d volumes' % (np.prod(args.shape), args.volumes))
+
+    elapsed, (g_legacy, mask) = timeit(legacy_global_signal, data)
+    print('spm_global signal, per volume:  %7.2fs' % elapsed)
+    elapsed, (g, mask_new) = timeit(global_signal, data)
+    print('spm_global signal, vectorized:  %7.2fs' % elapsed)
+    assert np.array_equal(mask, mask_new)
+    assert np.allclose(g_legacy, g)
+
+    voxel_coords = np.nonzero(mask)
+    brain_pts = np.vstack(voxel_coords + (np.ones(len(voxel_coords[0])), ))
+    elapsed, (norm_legacy, disp) = timeit(legacy_calc_norm, params, 'FSL',
+                                          brain_pts)
+    print('norm, per timepoint:            %7.2fs' % elapsed)
+    elapsed, (norm, disp_new) = timeit(ra._calc_norm, params, True, 'FSL',
+                                       brain_pts)
+    print('norm, batched affines:          %7.2fs' % elapsed)
+    assert np.allclose(norm_legacy, norm)
+    assert np.allclose(disp, disp_new)
+
+    print('displacement map, per volume:   %7.2fs' % timeit(
+        legacy_fill, shape, voxel_coords, disp)[0])
+    print('displacement map, one scatter:  %7.2fs' % timeit(
+        fill, shape, voxel_coords, disp)[0])
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        os.chdir(root)
+        nb.Nifti1Image(data, np.eye(4)).to_filename('func.nii')
+        np.savetxt('func.par', params)
+        ad = ra.ArtifactDetect(realigned_files='func.nii',
+                               realignment_parameters='func.par',
+                               parameter_source='FSL', norm_threshold=1,
+                               zintensity_threshold=3, mask_type='spm_global',
+                               intersect_mask=True, bound_by_brainmask=True,
+                               save_plot=False)
+        print('ArtifactDetect:                 %7.2fs' % timeit(ad.run)[0])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time CompCor and measure its peak memory with each svd_method.
+
+A synthetic float32 run with a few spatially spread signals is written to
+disk, then CompCor runs once per method in a fresh process so that the
+peak resident set size of each can be told apart.
+
+Usage::
+
+    python tools/bench_compcor.py --shape 64 64 40 --volumes 1000
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import nibabel as nb
+import numpy as np
+
+
+def make_data(root, shape, volumes):
+    rng = np.random.RandomState(0)
+    data = np.empty(tuple(shape) + (volumes, ), dtype=np.float32)
+    signals = rng.randn(volumes, 3).astype(np.float32)
+    for z in range(shape[2]):
+        loadings = rng.randn(shape[0], shape[1], 3).astype(np.float32)
+        data[:, :, z] = 100 + rng.randn(shape[0], shape[1], volumes) + \
+            loadings.dot(signals.T)
+    func = os.path.join(root, 'func.nii')
+    nb.Nifti1Image(data, np.eye(4)).to_filename(func)
+    mask = os.path.join(root, 'mask.nii')
+    nb.Nifti1Image(np.ones(shape, dtype=np.uint8),
+                   np.eye(4)).to_filename(mask)
+    return func, mask
+
+
+def run(func, mask, svd_method):
+    from nipype.algorithms.confounds import CompCor
+    start = time.time()
+    CompCor(realigned_file=func, mask_file=mask, svd_method=svd_method,
+            components_file=svd_method + '.txt').run()
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print('%-5s %8.1fs %8.0f MB peak RSS' % (svd_method, elapsed, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shape', type=int, nargs=3, default=[64, 64, 40])
+    parser.add_argument('--volumes', type=int, default=1000)
+    parser.add_argument('--run', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run(*args.run)
+
+    script = os.path.abspath(__file__)
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        func, mask = make_data(root, args.shape, args.volumes)
+        print('%d voxels x %d volumes, %.0f MB on disk' % (
+            np.prod(args.shape), args.volumes, os.path.getsize(func) / 1e6))
+        os.chdir(root)
+        for svd_method in ['svd', 'gram']:
+            subprocess.check_call([sys.executable, script,
+                                   '--run', func, mask, svd_method])
+        components = [np.loadtxt(m + '.txt', skiprows=1)
+                      for m in ['svd', 'gram']]
+        signs = np.sign(np.sum(components[0] * components[1], axis=0))
+        print('largest difference: %.2g' % np.abs(
+            components[0] * signs - components[1]).max())
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
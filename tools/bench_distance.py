@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time Distance between two whole-brain masks.
+
+Two overlapping, brain-sized ellipsoids are written on an MNI-like grid at
+the requested resolution, and the Distance interface is run with the
+eucl_min and eucl_max methods.  The nearest border distances of eucl_mean
+are timed directly, as the interface also plots a histogram: through the
+distance transform used on a shared axis aligned grid, and through cKDTree
+used otherwise.
+The previous all-pairs cdist computation is timed as well whenever its
+distance matrix fits within --max-cdist-mb.
+
+Usage::
+
+    python tools/bench_distance.py --voxel-size 1
+    python tools/bench_distance.py --voxel-size 3
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import nibabel as nb
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+from nipype.algorithms.metrics import Distance
+
+
+def make_masks(root, voxel_size):
+    shape = tuple(int(round(n / voxel_size)) for n in (182, 218, 182))
+    affine = np.diag([voxel_size] * 3 + [1.])
+    affine[:3, 3] = [-90, -126, -72]
+    grid = np.indices(shape).reshape(3, -1).T * voxel_size + affine[:3, 3]
+    masks = []
+    for i, (center, radii) in enumerate([((0, -18, 18), (70, 85, 65)),
+                                         ((2, -15, 16), (68, 86, 62))]):
+        inside = (((grid - center) / radii) ** 2).sum(axis=1) <= 1
+        masks.append(os.path.join(root, 'mask%d.nii' % i))
+        nb.Nifti1Image(inside.reshape(shape).astype(np.uint8),
+                       affine).to_filename(masks[-1])
+    return masks
+
+
+def coordinates(dist, fname, border):
+    nii = nb.load(fname)
+    data = nii.get_data().astype(bool)
+    if border:
+        data = dist._find_border(data)
+    return dist._get_coordinates(data, nii.affine).T
+
+
+def timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--voxel-size', type=float, default=1.)
+    parser.add_argument('--max-cdist-mb', type=float, default=2000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        mask1, mask2 = make_masks(root, args.voxel_size)
+        os.chdir(root)
+        dist = Distance()
+        border1 = coordinates(dist, mask1, True)
+        border2 = coordinates(dist, mask2, True)
+        voxels2 = coordinates(dist, mask2, False)
+        print('%d and %d border voxels, %d voxels in volume2' % (
+            len(border1), len(border2), len(voxels2)))
+
+        for method, n_pairs in [('eucl_min', len(border1) * len(border2)),
+                                ('eucl_max', len(border1) * len(border2))]:
+            elapsed, res = timeit(Distance(volume1=mask1, volume2=mask2,
+                                           method=method).run)
+            print('%-9s cKDTree: %7.2fs  (%.4f mm)' % (
+                method, elapsed, res.outputs.distance))
+            if n_pairs * 8 / 1e6 > args.max_cdist_mb:
+                print('%-9s cdist:   skipped, needs %.1f GB' % (
+                    method, n_pairs * 8 / 1e9))
+            else:
+                print('%-9s cdist:   %7.2fs' % (method, timeit(
+                    cdist, border1, border2)[0]))
+
+        nii1, nii2 = nb.load(mask1), nb.load(mask2)
+        data1 = nii1.get_data().astype(bool)
+        data2 = nii2.get_data().astype(bool)
+        assert dist._same_axis_aligned_grid(nii1, nii2, data2)
+        elapsed, mins = timeit(dist._border_distances,
+                               dist._find_border(data1), data2, nii1.affine)
+        print('eucl_mean EDT:     %7.2fs  (%.4f mm)' % (elapsed, mins.mean()))
+        elapsed, kd_mins = timeit(lambda: cKDTree(border1).query(voxels2)[0])
+        print('eucl_mean cKDTree: %7.2fs  (%.4f mm)' % (
+            elapsed, kd_mins.mean()))
+        assert np.array_equal(mins, kd_mins)
+        n_pairs = len(border1) * len(voxels2)
+        if n_pairs * 8 / 1e6 > args.max_cdist_mb:
+            print('eucl_mean cdist:   skipped, needs %.1f GB' % (
+                n_pairs * 8 / 1e9))
+        else:
+            print('eucl_mean cdist:   %7.2fs' % timeit(
+                lambda: np.amin(cdist(border1, voxels2), axis=0))[0])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
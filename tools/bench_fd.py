@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time framewise displacement of many runs, run by run and batched.
+
+Random-walk motion parameters are written for --runs runs, in the format
+of the chosen package.  One FramewiseDisplacement run per file, as a
+workflow with one node per run would do, is timed against a single
+BatchFramewiseDisplacement run, and the previous row by row normalization
+against the vectorized one.
+
+Usage::
+
+    python tools/bench_fd.py --runs 2000 --volumes 300 --source AFNI
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from nipype.algorithms.confounds import (FramewiseDisplacement,
+                                         BatchFramewiseDisplacement,
+                                         compute_fd, _load_motion_params)
+from nipype.utils.misc import normalize_mc_params
+
+
+def make_runs(root, runs, volumes, source):
+    rng = np.random.RandomState(0)
+    n_params = {'FSFAST': 10}.get(source, 6)
+    in_files = []
+    for run in range(runs):
+        in_files.append(os.path.join(root, 'run-%05d.txt' % run))
+        np.savetxt(in_files[-1], np.cumsum(
+            0.01 * rng.randn(volumes, n_params), axis=0), fmt='%.6f')
+    return in_files
+
+
+def run_single(in_files, source):
+    for in_file in in_files:
+        FramewiseDisplacement(in_file=in_file, parameter_source=source,
+                              out_file='fd.txt').run()
+
+
+def legacy_fd(in_files, source):
+    for in_file in in_files:
+        mpars = np.apply_along_axis(func1d=normalize_mc_params, axis=1,
+                                    arr=np.loadtxt(in_file), source=source)
+        diff = mpars[:-1, :6] - mpars[1:, :6]
+        diff[:, 3:6] *= 50
+        np.abs(diff).sum(axis=1)
+
+
+def vectorized_fd(in_files, source):
+    for in_file in in_files:
+        compute_fd(_load_motion_params(in_file), source)
+
+
+def timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--volumes', type=int, default=300)
+    parser.add_argument('--source', default='FSL',
+                        choices=['FSL', 'AFNI', 'SPM', 'FSFAST'])
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        in_files = make_runs(root, args.runs, args.volumes, args.source)
+        os.chdir(root)
+        batch = BatchFramewiseDisplacement(in_files=in_files,
+                                           parameter_source=args.source)
+        for name, func, func_args in [
+                ('loadtxt, row by row', legacy_fd, (in_files, args.source)),
+                ('fromstring, vectorized', vectorized_fd,
+                 (in_files, args.source)),
+                ('FramewiseDisplacement, one run per file', run_single,
+                 (in_files, args.source)),
+                ('BatchFramewiseDisplacement', batch.run, ())]:
+            elapsed = timeit(func, *func_args)
+            print('%-40s %7.2fs  (%.2fms per run)' % (
+                name, elapsed, 1e3 * elapsed / args.runs))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
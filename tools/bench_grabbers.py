@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time the data grabbers on a synthetic BIDS-like tree.
+
+The same per-subject queries are timed with glob.glob/os.walk and with
+the directory index, first cold and then warm.  The grabbers themselves
+are then run the way a per-subject iterable would: one DataGrabber,
+SelectFiles and DataFinder per subject.  Use --base-dir to put the tree
+on the filesystem of interest, the gain is largest on network mounts.
+
+Usage::
+
+    python tools/bench_grabbers.py --subjects 500 --sessions 2
+
+"""
+from __future__ import print_function, division
+import argparse
+import glob
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from nipype.interfaces.io import DataGrabber, SelectFiles, DataFinder
+from nipype.utils.filemanip import (indexed_glob, indexed_walk,
+                                    clear_dir_index)
+
+
+MODALITIES = {
+    'anat': ['T1w.nii.gz', 'T1w.json', 'T2w.nii.gz', 'T2w.json'],
+    'func': ['task-rest_bold.nii.gz', 'task-rest_bold.json',
+             'task-rest_events.tsv'],
+    'dwi': ['dwi.nii.gz', 'dwi.bval', 'dwi.bvec', 'dwi.json'],
+}
+
+
+def make_tree(root, subjects, sessions):
+    for sub in range(subjects):
+        for ses in range(sessions):
+            prefix = 'sub-%04d_ses-%02d_' % (sub, ses)
+            for modality, names in MODALITIES.items():
+                dirname = os.path.join(root, 'sub-%04d' % sub,
+                                       'ses-%02d' % ses, modality)
+                os.makedirs(dirname)
+                for name in names:
+                    open(os.path.join(dirname, prefix + name), 'w').close()
+    # Directories modified moments ago are not kept in the index
+    past = time.time() - 60
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (past, past))
+
+
+def run_grabbers(root, subjects):
+    for sub in range(subjects):
+        sid = 'sub-%04d' % sub
+        dg = DataGrabber(infields=['sid'], outfields=['bold'],
+                         base_directory=root, sort_filelist=True,
+                         template='%s/ses-*/func/*_bold.nii.gz')
+        dg.inputs.template_args = {'bold': [['sid']]}
+        dg.inputs.sid = sid
+        dg.run()
+        sf = SelectFiles({'T1': '{sid}/ses-*/anat/*_T1w.nii.gz',
+                          'dwi': '{sid}/ses-*/dwi/*_dwi.nii.gz'},
+                         base_directory=root, sort_filelist=True)
+        sf.inputs.sid = sid
+        sf.run()
+        DataFinder(root_paths=os.path.join(root, sid),
+                   match_regex=r'.+/(?P<basename>[^/]+)\.bv[ae][lc]$').run()
+
+
+def run_queries(root, subjects, globber=glob.glob, walker=os.walk):
+    regex = re.compile(r'.+/(?P<basename>[^/]+)\.bv[ae][lc]$')
+    for sub in range(subjects):
+        sid = 'sub-%04d' % sub
+        globber(os.path.join(root, sid, 'ses-*/func/*_bold.nii.gz'))
+        globber(os.path.join(root, sid, 'ses-*/anat/*_T1w.nii.gz'))
+        globber(os.path.join(root, sid, 'ses-*/dwi/*_dwi.nii.gz'))
+        for dirpath, _, files in walker(os.path.join(root, sid)):
+            [regex.search(os.path.join(dirpath, f)) for f in files]
+
+
+def timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--subjects', type=int, default=200)
+    parser.add_argument('--sessions', type=int, default=2)
+    parser.add_argument('--base-dir', default=None,
+                        help='where to build the tree (e.g. an NFS mount)')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(dir=args.base_dir)
+    try:
+        make_tree(root, args.subjects, args.sessions)
+        print('glob/os.walk:              %.3fs' % timeit(
+            run_queries, root, args.subjects))
+        clear_dir_index()
+        for state in ['cold', 'warm']:
+            print('indexed, %s index:        %.3fs' % (state, timeit(
+                run_queries, root, args.subjects, indexed_glob,
+                indexed_walk)))
+        clear_dir_index()
+        for state in ['cold', 'warm']:
+            print('grabber nodes, %s index:  %.3fs' % (state, timeit(
+                run_grabbers, root, args.subjects)))
+    finally:
+        clear_dir_index()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
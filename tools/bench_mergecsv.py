@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time MergeCSVFiles on per-subject ROI tables.
+
+Each subject has a CSV file with a header and a column of ROI labels, the
+way group-level workflows write them.  The previous reader (np.loadtxt
+with fallbacks, then np.dstack file by file) is timed against
+merge_csvs, then the whole interface is run.
+
+Usage::
+
+    python tools/bench_mergecsv.py --subjects 300 --rois 5000
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from nipype.algorithms.misc import MergeCSVFiles, merge_csvs
+
+
+def legacy_merge_csvs(in_list):
+    for idx, in_file in enumerate(in_list):
+        try:
+            in_array = np.loadtxt(in_file, delimiter=',')
+        except ValueError:
+            try:
+                in_array = np.loadtxt(in_file, delimiter=',', skiprows=1)
+            except ValueError:
+                with open(in_file, 'r') as first:
+                    n_cols = len(first.readline().split(','))
+                in_array = np.loadtxt(in_file, delimiter=',', skiprows=1,
+                                      usecols=list(range(1, n_cols)))
+        if idx == 0:
+            out_array = in_array
+        else:
+            out_array = np.dstack((out_array, in_array))
+    return np.squeeze(out_array)
+
+
+def make_tables(root, subjects, rois):
+    in_files = []
+    for sub in range(subjects):
+        in_files.append(os.path.join(root, 'sub-%04d.csv' % sub))
+        values = np.random.rand(rois)
+        with open(in_files[-1], 'w') as fid:
+            fid.write('roi,value\n')
+            fid.writelines('roi%d,%.6f\n' % (i, v)
+                           for i, v in enumerate(values))
+    return in_files
+
+
+def timeit(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--subjects', type=int, default=300)
+    parser.add_argument('--rois', type=int, default=5000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        in_files = make_tables(root, args.subjects, args.rois)
+        elapsed, legacy = timeit(legacy_merge_csvs, in_files)
+        print('loadtxt + dstack:   %.2fs' % elapsed)
+        elapsed, merged = timeit(merge_csvs, in_files)
+        print('merge_csvs:         %.2fs' % elapsed)
+        assert np.array_equal(legacy, merged)
+
+        os.chdir(root)
+        merge = MergeCSVFiles(in_files=in_files,
+                              row_headings=['roi%d' % i
+                                            for i in range(args.rois)],
+                              extra_field='controls')
+        print('MergeCSVFiles:      %.2fs' % timeit(merge.run)[0])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
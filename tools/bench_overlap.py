@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time per-label overlap of many segmentations, pair by pair and batched.
+
+Reference label maps with --labels parcels are written on a 2 mm MNI-like
+grid together with a test map per subject, in which voxels near parcel
+boundaries were relabelled.  One Overlap run per pair, as a workflow with
+one node per subject would do, is timed against a single BatchOverlap run.
+
+Usage::
+
+    python tools/bench_overlap.py --subjects 50 --labels 100
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import nibabel as nb
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+from nipype.algorithms.metrics import Overlap, BatchOverlap
+
+
+def make_pairs(root, subjects, labels):
+    rng = np.random.RandomState(0)
+    shape = (91, 109, 91)
+    # parcels: nearest of `labels` random seeds, on a coarse grid
+    seeds = rng.rand(labels, 3) * shape
+    coarse = np.indices((23, 28, 23)).reshape(3, -1).T * 4
+    nearest = ((coarse[:, np.newaxis] - seeds) ** 2).sum(axis=2).argmin(1)
+    parcels = (nearest + 1).reshape(23, 28, 23)
+    parcels = parcels.repeat(4, 0).repeat(4, 1).repeat(4, 2)
+    parcels = parcels[:shape[0], :shape[1], :shape[2]].astype(np.int16)
+    affine = np.diag([2., 2., 2., 1.])
+    in_ref, in_tst = [], []
+    for sub in range(subjects):
+        shifted = maximum_filter(parcels, size=3)
+        tst = np.where(rng.rand(*shape) < 0.3, shifted, parcels)
+        for name, data, files in [('ref', parcels, in_ref),
+                                  ('tst', tst, in_tst)]:
+            files.append(os.path.join(root, 'sub-%04d_%s.nii.gz' % (
+                sub, name)))
+            nb.Nifti1Image(data, affine).to_filename(files[-1])
+    return in_ref, in_tst
+
+
+def run_pairs(in_ref, in_tst):
+    for ref, tst in zip(in_ref, in_tst):
+        Overlap(volume1=ref, volume2=tst).run()
+
+
+def timeit(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--subjects', type=int, default=50)
+    parser.add_argument('--labels', type=int, default=100)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        in_ref, in_tst = make_pairs(root, args.subjects, args.labels)
+        os.chdir(root)
+        elapsed = timeit(run_pairs, in_ref, in_tst)
+        print('Overlap, one run per pair:  %7.2fs  (%.3fs per pair)' % (
+            elapsed, elapsed / args.subjects))
+        elapsed = timeit(BatchOverlap(in_ref=in_ref, in_tst=in_tst).run)
+        print('BatchOverlap:               %7.2fs  (%.3fs per pair)' % (
+            elapsed, elapsed / args.subjects))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
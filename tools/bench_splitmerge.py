@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# emacs: -*- mode: python; py-indent-offset: 4; indent-tabs-mode: nil -*-
+# vi: set ft=python sts=4 ts=4 sw=4 et:
+"""Time SplitROIs and MergeROIs and measure their peak memory.
+
+A synthetic float32 diffusion run and a brain mask are written to disk,
+then the run is split in ROIs and merged back, with gzipped and with
+memory mapped ROIs, each in a fresh process so that the peak resident set
+size of each can be told apart.
+
+Usage::
+
+    python tools/bench_splitmerge.py --shape 128 128 70 --volumes 100
+
+"""
+from __future__ import print_function, division
+import argparse
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import nibabel as nb
+import numpy as np
+
+
+def make_data(root, shape, volumes):
+    rng = np.random.RandomState(0)
+    grid = np.indices(shape).reshape(3, -1).T / (np.array(shape) - 1.)
+    brain = (((grid - 0.5) / 0.45) ** 2).sum(axis=1) <= 1
+    brain = brain.reshape(shape)
+    dwi = os.path.join(root, 'dwi.nii')
+    nb.Nifti1Image(np.empty(tuple(shape) + (volumes, ), dtype=np.float32),
+                   np.eye(4)).to_filename(dwi)
+    data = np.memmap(dwi, dtype=np.float32, mode='r+', offset=352,
+                     shape=tuple(shape) + (volumes, ), order='F')
+    for t in range(volumes):
+        data[..., t] = 1000 * brain + rng.rand(*shape).astype(np.float32)
+    del data
+    mask = os.path.join(root, 'mask.nii')
+    nb.Nifti1Image(brain.astype(np.uint8), np.eye(4)).to_filename(mask)
+    return dwi, mask
+
+
+def run(dwi, mask, compress):
+    from nipype.algorithms.misc import SplitROIs, MergeROIs
+    compress = compress == 'gzip'
+    os.mkdir(str(compress))
+    os.chdir(str(compress))
+    start = time.time()
+    res = SplitROIs(in_file=dwi, in_mask=mask, roi_size=(5, 5, 1),
+                    compress=compress).run()
+    split = time.time() - start
+    start = time.time()
+    MergeROIs(in_files=res.outputs.out_files, in_index=res.outputs.out_index,
+              in_reference=mask, compress=compress).run()
+    merge = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    print('%-5s %d ROIs, split %7.1fs, merge %7.1fs, %6.0f MB peak RSS' % (
+        'gzip' if compress else 'mmap', len(res.outputs.out_files), split,
+        merge, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--shape', type=int, nargs=3, default=[128, 128, 70])
+    parser.add_argument('--volumes', type=int, default=100)
+    parser.add_argument('--run', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run(*args.run)
+
+    script = os.path.abspath(__file__)
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        dwi, mask = make_data(root, args.shape, args.volumes)
+        print('%d voxels x %d volumes, %.0f MB on disk' % (
+            np.prod(args.shape), args.volumes, os.path.getsize(dwi) / 1e6))
+        os.chdir(root)
+        for compress in ['gzip', 'mmap']:
+            subprocess.check_call([sys.executable, script,
+                                   '--run', dwi, mask, compress])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()